@@ -2,10 +2,15 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import io
+import hmac
 import json
+import functools
 import dateutil.parser
 import babel
+import babel.dates
 import sys
+from datetime import datetime, timedelta
 from flask import (
   Flask, 
   render_template, 
@@ -13,33 +18,104 @@ from flask import (
   Response, 
   flash, 
   redirect, 
-  url_for
+  url_for,
+  stream_with_context,
+  jsonify,
+  abort
   )
 from flask_moment import Moment
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
+from sqlalchemy import func, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from forms import *
-from models import Venue,db, Artist, Show, app
+from models import Venue,db, Artist, Show, app, upcoming_show_feed
+import search
+from suggest import name_index
+from cache import cache
+from fragment_cache import fragment_cache
+from metrics import metrics, view_cache_lines, template_lines, thumbnail_lines
+from tracing import trace_recorder
+from routing import replica_router
+from assets import assets, assets_cli
+from partitions import partitions_cli
+from facets import Filters, get_facets
+from geo import nearby_index, geocode_command
+from thumbnails import thumbnails
+from counters import record_created_shows, record_deleted_shows, counters_cli
+from bookings import find_conflicts, conflict_messages, is_booking_conflict
+from feed import feed_refresher, feed_cli
+from pagination import keyset_query, keyset_result, keyset_page
+from importer import import_rows, import_command, guess_format, ENTITIES, ENCODING_ERRORS
+import exporter
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 app.config.from_object('config')
 moment = Moment(app)
 db.init_app(app)
+cache.init_app(app)
+fragment_cache.init_app(app, cache)
+metrics.init_app(app)
+trace_recorder.init_app(app)
+replica_router.init_app(app)
+assets.init_app(app)
+thumbnails.init_app(app)
+nearby_index.init_app(app)
+metrics.collectors.append(lambda: view_cache_lines(cache))
+metrics.collectors.append(lambda: template_lines(fragment_cache.stats))
+metrics.collectors.append(lambda: thumbnail_lines(thumbnails))
+feed_refresher.init_app(app)
+# /shows pages built while the feed was stale are dropped once it is refreshed
+feed_refresher.on_refresh.append(lambda: cache.invalidate('show-list'))
+# The KD-tree of /venues/nearby is rebuilt when a venue changes
+cache.on_invalidate.append(nearby_index.invalidate)
+app.cli.add_command(import_command)
+app.cli.add_command(counters_cli)
+app.cli.add_command(feed_cli)
+app.cli.add_command(exporter.export_command)
+app.cli.add_command(assets_cli)
+app.cli.add_command(partitions_cli)
+app.cli.add_command(geocode_command)
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+# Compiled Babel pattern and locale of a format, resolved once per (format, locale)
+@functools.lru_cache(maxsize=64)
+def get_datetime_pattern(format, locale=None):
+  pattern = babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+  return pattern, babel.Locale.parse(locale or babel.dates.LC_TIME or 'en_US')
+
+# Accepts datetimes, or ISO strings for values that went through JSON
+def format_datetime(value, format='medium', locale=None):
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  pattern, locale = get_datetime_pattern(format, locale)
+  return pattern.apply(value, locale)
+
+# Formats a whole list of datetimes, each distinct value once:
+# {% set start_times = shows|map(attribute='start_time')|datetimes('full') %}
+# Not for lists of fragment cached tiles, which format their own value inside the fragment so
+# that the hits don't format anything
+def format_datetimes(values, format='medium', locale=None):
+  formatted = {}
+  result = []
+  for value in values:
+    if value not in formatted:
+      formatted[value] = format_datetime(value, format, locale)
+    result.append(formatted[value])
+  return result
 
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['datetimes'] = format_datetimes
 
 #----------------------------------------------------------------------------#
 # Controllers.
@@ -55,76 +131,65 @@ def index():
 
 @app.route('/venues')
 def venues():
-  venues_city = Venue.query.all()
-  data=[]
-  # Filling data[] with cities and states, venues is set as an empty array
-  # to fill later
-  for venue in venues_city:
-    d = {
-      'city': venue.city,
-      'state': venue.state,
-      'venues':[]
-    }
-    # If d isn't in data, add d to data
-    if d not in data:
-      data.append(d)
-  
-  # Go through all the cities of data[] and add the venues
-  for d in data:
-    # Getting all venues of a d.city
-    venues_add = Venue.query.filter(Venue.city==d.get('city')).all()
-    # Adding the venues_add to d['venues].
-    for v in venues_add:
-      d['venues'].append({
-        "id":v.id,
-        "name":v.name,
-        "num_upcoming_shows":count_upcoming_shows_venue(v.id)
-      })
-      
-  return render_template('pages/venues.html', areas=data)
+  per_page = app.config.get('AREAS_PER_PAGE', 20)
+  cursor = request.args.get('cursor')
+  # Genre, state and seeking_talent filters, see facets.py
+  filters = Filters.from_args(Venue, request.args)
+  data, next_cursor, prev_cursor = cache.get_or_build('venues:%s:%s' % (filters.key(), cursor),
+    lambda page: ['venue-list'] + ['venue:%d' % venue['id'] for area in page[0] for venue in area['venues']],
+    lambda: get_venue_areas(cursor, per_page, filters))
+  facets = cache.get_or_build('venue-facets:%s' % filters.key(), ['venue-list'], lambda: get_facets(filters))
+  return render_template('pages/venues.html', areas=data, next_cursor=next_cursor, prev_cursor=prev_cursor,
+    filters=filters, facets=facets)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  search_term = request.form.get('search_term')
-  # search: pattern matching to search
-  search = "%{}%".format(search_term)
-  # Searching all venues with case-insensitive
-  venues = Venue.query.filter(Venue.name.ilike(search)).all()
-  
-  response = {
-    "count":len(venues),
-    "data":[]
-  }
-  # Filling response['data'] 
-  for venue in venues:
-    response['data'].append({
-      'id':venue.id,
-      'name':venue.name,
-      'num_upcoming_shows':count_upcoming_shows_venue(venue.id)
-    })
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  search_term = request.form.get('search_term', '')
+  page = request.form.get('page', 1, type=int)
+  per_page = app.config.get('SEARCH_RESULTS_PER_PAGE', 20)
+  # Ranked full-text and trigram search, see search.py
+  response = search.search_venues(search_term, page, per_page)
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+#  Suggestions
+#  ----------------------------------------------------------------
+
+@app.route('/search/suggest')
+def search_suggest():
+  # Served from the in-process name index, see suggest.py. Built on the first request, not
+  # at startup (the CLI commands, migrations included, import the app too), and reloaded when
+  # another worker changed a name.
+  version = cache.get_versions(['suggest'])[0]
+  if not name_index.is_current(version):
+    load_name_index(version)
+  data = name_index.suggest(request.args.get('q', ''), request.args.get('kind'),
+    app.config.get('SUGGESTIONS_LIMIT', 10))
+  for suggestion in data:
+    suggestion['url'] = url_for('show_' + suggestion['kind'], **{suggestion['kind'] + '_id': suggestion['id']})
+  return jsonify(data=data)
+
+#  Nearby venues
+#  ----------------------------------------------------------------
+
+@app.route('/venues/nearby')
+def nearby_venues():
+  # Venues within radius km of (lat, lng), nearest first, see geo.py
+  max_radius = app.config.get('NEARBY_MAX_RADIUS_KM', 500)
+  max_results = app.config.get('NEARBY_MAX_RESULTS', 50)
+  lat = request.args.get('lat', type=float)
+  lng = request.args.get('lng', type=float)
+  radius = request.args.get('radius', app.config.get('NEARBY_DEFAULT_RADIUS_KM', 25), type=float)
+  limit = min(request.args.get('limit', max_results, type=int), max_results)
+  # The comparisons are False for nan, and missing or invalid values are None
+  if lat is None or lng is None or radius is None or limit is None or not -90 <= lat <= 90 or \
+      not -180 <= lng <= 180 or not 0 < radius <= max_radius or limit < 1:
+    abort(400)
+  venues = nearby_index.nearby(lat, lng, radius, limit)
+  return jsonify({'lat': lat, 'lng': lng, 'radius_km': radius, 'venues': venues})
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-  venue = Venue.query.get(venue_id)
-  data={
-    "id": venue.id,
-    "name": venue.name,
-    "genres": venue.genres,
-    "address": venue.address,
-    "city": venue.city,
-    "state": venue.state,
-    "phone": venue.phone,
-    "website": venue.website,
-    "facebook_link": venue.facebook_link,
-    "seeking_talent": venue.seeking_talent,
-    "seeking_description": venue.seeking_description,
-    "image_link": venue.image_link,
-    "past_shows": get_past_shows_venue(venue.id),
-    "upcoming_shows": get_upcoming_shows_venue(venue.id),
-    "past_shows_count": count_past_shows_venue(venue.id),
-    "upcoming_shows_count": count_upcoming_shows_venue(venue.id)
-  }
+  data = cache.get_or_build('venue:%d' % venue_id, venue_tags, lambda: get_venue_data(venue_id))
   return render_template('pages/show_venue.html', venue=data)
 
 
@@ -153,21 +218,16 @@ def create_venue_submission():
   facebook_link = request.form['facebook_link']
   website = request.form['website']
 
-  # Getting the max_id of the venue to avoid IntegrityError duplicate key id value violates unique constraint
-  # Verifying if there aren't venues, set max_id = 1, to avoid send None type to Venue(id=None).
-  if len(Venue.query.all()) == 0 :
-    max_id=1
-  else:
-    max_id = Venue.query.order_by(Venue.id.desc()).first().id
-    max_id = max_id+1
-
-  venue = Venue(id=max_id, name=name, city=city, state=state, address=address, phone=phone, genres=genres,seeking_talent=seeking_talent, 
+  venue = Venue(name=name, city=city, state=state, address=address, phone=phone, genres=genres,seeking_talent=seeking_talent, 
   seeking_description=seeking_description, image_link=image_link, facebook_link=facebook_link, website=website)
 
   # Adding a new row to table "Venue" with postgresql
   try:
     db.session.add(venue)
     db.session.commit()
+    name_index.add('venue', venue.id, name)
+    name_index_changed()
+    cache.invalidate('venue-list')
     flash('Venue ' + name + ' was successfully listed!')
   except:
     db.session.rollback()
@@ -181,8 +241,17 @@ def create_venue_submission():
 @app.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   try:
+    # The shows of the venue go with it, taking them off the counters of their artists
+    shows = db.session.query(Show.artist_id, Show.venue_id, Show.start_time).filter(Show.venue_id==venue_id).all()
+    Show.query.filter(Show.venue_id==venue_id).delete()
+    record_deleted_shows(shows)
     Venue.query.filter(Venue.id==venue_id).delete()
     db.session.commit()
+    name_index.remove('venue', int(venue_id))
+    name_index_changed()
+    cache.invalidate('venue:%s' % venue_id, 'venue-shows:%s' % venue_id, 'venue-list', 'show-list',
+      *['artist-shows:%d' % show.artist_id for show in shows])
+    feed_refresher.request_refresh()
   except:
     db.session.rollback()
   finally:
@@ -194,59 +263,28 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  artists = Artist.query.all()
-  data=[]
-  # Filling data with artists.
-  for artist in artists:
-    data.append({
-      'id':artist.id,
-      "name":artist.name,
-    })
-  return render_template('pages/artists.html', artists=data)
+  per_page = app.config.get('ARTISTS_PER_PAGE', 50)
+  cursor = request.args.get('cursor')
+  # Genre, state and seeking_venue filters, see facets.py
+  filters = Filters.from_args(Artist, request.args)
+  data, next_cursor, prev_cursor = cache.get_or_build('artists:%s:%s' % (filters.key(), cursor), ['artist-list'],
+    lambda: get_artists_page(cursor, per_page, filters))
+  facets = cache.get_or_build('artist-facets:%s' % filters.key(), ['artist-list'], lambda: get_facets(filters))
+  return render_template('pages/artists.html', artists=data, next_cursor=next_cursor, prev_cursor=prev_cursor,
+    filters=filters, facets=facets)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-  search_term = request.form.get('search_term')
-  search_term = search_term.lower()
-  # search: pattern matching to search
-  search = "%{}%".format(search_term)
-  # Searching all Artist with case-insensitive
-
-  artists = Artist.query.filter(Artist.name.ilike(search)).all()
-  
-  response = {
-    "count":len(artists),
-    "data":[]
-  }
-  # filling response['data'] with all artist obtained
-  for artist in artists:
-    response['data'].append({
-      'id':artist.id,
-      'name':artist.name, 
-      'num_upcoming_shows':count_upcoming_shows_artist(artist.id)
-    })
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  search_term = request.form.get('search_term', '')
+  page = request.form.get('page', 1, type=int)
+  per_page = app.config.get('SEARCH_RESULTS_PER_PAGE', 20)
+  # Ranked full-text and trigram search, see search.py
+  response = search.search_artists(search_term, page, per_page)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-  artist = Artist.query.get(artist_id)
-  data={
-    "id": artist.id,
-    "name": artist.name,
-    "genres": artist.genres,
-    "city": artist.city,
-    "state": artist.state,
-    "phone": artist.phone,
-    "website": artist.website,
-    "facebook_link": artist.facebook_link,
-    "seeking_venue": artist.seeking_venue,
-    "seeking_description": artist.seeking_description,
-    "image_link": artist.image_link,
-    "past_shows": get_past_shows_artist(artist.id),
-    "upcoming_shows": get_upcoming_shows_artist(artist.id),
-    "past_shows_count": count_past_shows_artist(artist.id),
-    "upcoming_shows_count": count_upcoming_shows_artist(artist.id)
-  }
+  data = cache.get_or_build('artist:%d' % artist_id, artist_tags, lambda: get_artist_data(artist_id))
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
@@ -303,6 +341,10 @@ def edit_artist_submission(artist_id):
 
   try:
     db.session.commit()
+    name_index.add('artist', artist_id, request.form['name'])
+    name_index_changed()
+    cache.invalidate('artist:%d' % artist_id, 'artist-list')
+    feed_refresher.request_refresh()
   except:
     db.session.rollback()
     print(sys.exc_info())
@@ -347,6 +389,10 @@ def edit_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   venue = Venue.query.get(venue_id)
+  # Moved venues are geocoded again by the next "flask geocode", see geo.py
+  if (venue.city, venue.state) != (request.form['city'], request.form['state']):
+    venue.latitude = None
+    venue.longitude = None
   venue.name = request.form['name']
   venue.city = request.form['city']
   venue.state = request.form['state']
@@ -362,9 +408,12 @@ def edit_venue_submission(venue_id):
   venue.facebook_link = request.form['facebook_link']
   venue.image_link = request.form['image_link']
   venue.website = request.form['website']
-  print(venue)
   try:
     db.session.commit()
+    name_index.add('venue', venue_id, request.form['name'])
+    name_index_changed()
+    cache.invalidate('venue:%d' % venue_id, 'venue-list')
+    feed_refresher.request_refresh()
   except:
     db.session.rollback()
     print(sys.exc_info())
@@ -397,17 +446,13 @@ def create_artist_submission():
     image_link=request.form['image_link']
     facebook_link = request.form['facebook_link']
     website = request.form['website']
-    # Getting the max_id of the Artist to avoid IntegrityError duplicate key id value violates unique constraint
-    # Verifying if there aren't Artist, set max_id = 1, to avoid send None type to Artist(id=None)
-    if len(Artist.query.all()) == 0:
-      max_id=1
-    else:
-      max_id = Artist.query.order_by(Artist.id.desc()).first().id
-      max_id = max_id+1
-    artist = Artist(id=max_id,name=name, city=city, state=state, phone=phone, genres=genres, seeking_venue=seeking_venue, 
+    artist = Artist(name=name, city=city, state=state, phone=phone, genres=genres, seeking_venue=seeking_venue, 
     seeking_description=seeking_description, image_link=image_link, facebook_link=facebook_link,website=website)
     db.session.add(artist)
     db.session.commit()
+    name_index.add('artist', artist.id, name)
+    name_index_changed()
+    cache.invalidate('artist-list')
     flash('Artist ' + name + ' was successfully listed!')
   except:
     db.session.rollback()
@@ -426,20 +471,11 @@ def create_artist_submission():
 @app.route('/shows')
 def shows():
   # displays list of shows at /shows
-  shows = getall_upcoming_shows()
-  data=[]
-  for show in shows:
-    artist = show.artist
-    venue = show.venue
-    data.append({
-      'venue_id':venue.id,
-      'venue_name':venue.name,
-      'artist_id':artist.id,
-      'artist_name':artist.name,
-      'artist_image_link':artist.image_link,
-      'start_time':show.start_time.isoformat()
-    })
-  return render_template('pages/shows.html', shows=data)
+  per_page = app.config.get('SHOWS_PER_PAGE', 30)
+  cursor = request.args.get('cursor')
+  data, next_cursor, prev_cursor = cache.get_or_build('shows:%s' % cursor, show_list_tags,
+    lambda: get_upcoming_shows_page(cursor, per_page))
+  return render_template('pages/shows.html', shows=data, next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 @app.route('/shows/create')
 def create_shows():
@@ -454,18 +490,33 @@ def create_show_submission():
     artist_id=request.form['artist_id']
     venue_id=request.form['venue_id']
     start_time =request.form['start_time']
-    # Getting the max_id of the Show to avoid IntegrityError duplicate key id value violates unique constraint
-    # Verifying if there aren't Shows, set max_id = 1 to avoid send None type to Show(id=None) 
-    if len(Show.query.all())==0:
-      max_id=1
-    else:
-      max_id = Show.query.order_by(Show.id.desc()).first().id
-      max_id = max_id+1
-    show = Show(id=max_id,artist_id=artist_id,venue_id=venue_id,start_time=start_time)
+    # Checked like the bulk import does, with the NumberRange of ShowForm.duration_minutes
+    show_form = ShowForm(formdata=request.form, meta={'csrf': False})
+    if not show_form.duration_minutes.validate(show_form):
+      flash('Show could not be listed: the duration must be between 1 and %d minutes.' % MAX_SHOW_MINUTES)
+      return render_template('forms/new_show.html', form=ShowForm()), 400
+    duration_minutes = show_form.duration_minutes.data or DEFAULT_SHOW_MINUTES
+    # The artist and the venue must be free for the whole show, see bookings.py
+    conflicts = find_conflicts(artist_id, venue_id, dateutil.parser.parse(start_time), duration_minutes)
+    if conflicts:
+      flash('Show could not be listed: ' + '; '.join(conflict_messages(artist_id, venue_id, conflicts)))
+      return render_template('forms/new_show.html', form=ShowForm()), 409
+    show = Show(artist_id=artist_id,venue_id=venue_id,start_time=start_time,duration_minutes=duration_minutes)
 
     db.session.add(show)
+    record_created_shows([(artist_id, venue_id, dateutil.parser.parse(start_time))])
     db.session.commit()
+    cache.invalidate('venue-shows:%s' % venue_id, 'artist-shows:%s' % artist_id, 'venue-list', 'show-list')
+    feed_refresher.request_refresh()
     flash('Show was successfully listed!')
+  except IntegrityError as e:
+    db.session.rollback()
+    # Booked by another request since find_conflicts()
+    if is_booking_conflict(e):
+      flash('Show could not be listed: the artist or the venue was just booked at that time.')
+    else:
+      flash('An error occurred. Show could not be listed.')
+    print(sys.exc_info())
   except:
     db.session.rollback()
     flash('An error occurred. Show could not be listed.') 
@@ -474,6 +525,118 @@ def create_show_submission():
     db.session.close()
   return render_template('pages/home.html')
 
+#  Calendars
+#  ----------------------------------------------------------------
+
+@app.route('/shows/calendar')
+def shows_calendar():
+  # Shows from ?from= to ?to= (YYYY-MM-DD) grouped by day, in a ?city= and of a ?genre= (of the artist)
+  start, end = get_calendar_range()
+  city = request.args.get('city') or None
+  genre = request.args.get('genre') or None
+  filters = []
+  if city:
+    filters.append(Venue.city==city)
+  if genre:
+    filters.append(Artist.genres.contains([genre]))
+  data = cache.get_or_build('calendar:%s:%s:%s:%s' % (start.date(), end.date(), city, genre), calendar_tags,
+    lambda: get_calendar(start, end, *filters))
+  return jsonify(calendar_json(start, end, data))
+
+@app.route('/venues/<int:venue_id>/calendar')
+def venue_calendar(venue_id):
+  start, end = get_calendar_range()
+  data = cache.get_or_build('venue-calendar:%d:%s:%s' % (venue_id, start.date(), end.date()),
+    lambda data: calendar_tags(data) + ['venue:%d' % venue_id, 'venue-shows:%d' % venue_id],
+    lambda: get_calendar(start, end, Show.venue_id==venue_id))
+  return jsonify(calendar_json(start, end, data))
+
+@app.route('/artists/<int:artist_id>/calendar')
+def artist_calendar(artist_id):
+  start, end = get_calendar_range()
+  data = cache.get_or_build('artist-calendar:%d:%s:%s' % (artist_id, start.date(), end.date()),
+    lambda data: calendar_tags(data) + ['artist:%d' % artist_id, 'artist-shows:%d' % artist_id],
+    lambda: get_calendar(start, end, Show.artist_id==artist_id))
+  return jsonify(calendar_json(start, end, data))
+
+#  Images
+#  ----------------------------------------------------------------
+
+IMAGE_MODELS = {'venue': Venue, 'artist': Artist}
+
+@app.route('/img/<kind>/<int:id>/<size>')
+def image(kind, id, size):
+  # Resized copy of the image_link of a venue or artist, see thumbnails.py
+  model = IMAGE_MODELS.get(kind)
+  if model is None:
+    abort(404)
+  return thumbnails.serve(size, lambda: db.session.query(model.image_link).filter(model.id==id).scalar())
+
+#  Cache
+#  ----------------------------------------------------------------
+
+@app.route('/cache/stats')
+def cache_stats():
+  # Hit/miss counters of the view cache (cache.py), render time and fragment cache
+  # hits/misses per template (fragment_cache.py), the thumbnail cache (thumbnails.py) and the
+  # index of /venues/nearby (geo.py)
+  return jsonify(views=cache.to_dict(), templates=fragment_cache.stats.to_dict(), thumbnails=thumbnails.to_dict(),
+    nearby=nearby_index.to_dict())
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/metrics')
+def metrics_export():
+  # Queries, SQL/render time and N+1 statements per endpoint, and the cache counters,
+  # in the Prometheus text format, see metrics.py
+  return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+#  Import
+#  ----------------------------------------------------------------
+
+@app.route('/import/<entity>', methods=['POST'])
+def import_submission(entity):
+  # Bulk import of a CSV or JSONL upload (multipart "file" field or raw body), see importer.py.
+  # Needs "Authorization: Bearer <IMPORT_API_TOKEN>", disabled when no token is configured.
+  token = app.config.get('IMPORT_API_TOKEN')
+  if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+    abort(401)
+  if entity not in ENTITIES:
+    abort(404)
+  upload = request.files.get('file')
+  if upload:
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8', errors=ENCODING_ERRORS, newline='')
+    format = request.args.get('format') or guess_format(upload.filename)
+  else:
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', errors=ENCODING_ERRORS, newline='')
+    format = request.args.get('format', 'csv')
+  report = import_rows(entity, stream, format, app.config.get('IMPORT_CHUNK_SIZE', 5000))
+  if entity != 'shows':
+    cache.incr_version('suggest')
+  cache.clear()
+  if entity == 'shows':
+    feed_refresher.request_refresh()
+  return jsonify(report.to_dict())
+
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<entity>.<format>')
+def export(entity, format):
+  # Streams the whole table with a server-side cursor, see exporter.py.
+  # ?since= filters shows on start_time.
+  if entity not in exporter.ENTITIES or format not in exporter.FORMATS:
+    abort(404)
+  try:
+    since = exporter.parse_since(request.args.get('since'))
+  except (ValueError, OverflowError):
+    abort(400)
+  chunks = exporter.generate_export(entity, format, since, app.config.get('EXPORT_CHUNK_SIZE', 1000))
+  response = Response(stream_with_context(chunks), mimetype=exporter.FORMATS[format])
+  response.headers['Content-Disposition'] = 'attachment; filename={0}.{1}'.format(entity, format)
+  return response
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -492,92 +655,274 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
-# Get all the upcoming shows of a venue, and return data[] with dictionaries, with all the information needed it
-def get_upcoming_shows_venue(id):
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = db.session.query(Show).join(Venue).filter(Show.venue_id==id).filter(Show.start_time>=todays_datetime).all()
-  data = []
-  for show in shows:
-    artist = Artist.query.get(show.artist_id)
-    data.append({
-      "artist_id":artist.id,
-      "artist_name":artist.name,
-      "artist_image_link":artist.image_link,
-      "start_time": show.start_time.isoformat()
-    })
-  return data
+# Fill the suggestions index with the names of all venues and artists
+def load_name_index(version=None):
+  venues = db.session.query(Venue.id, Venue.name).all()
+  artists = db.session.query(Artist.id, Artist.name).all()
+  name_index.load(venues, artists, version)
+
+# Tells the other workers that their suggestions index is stale
+def name_index_changed():
+  name_index.updated(cache.incr_version('suggest'))
+
+# Midnight of the current day, the boundary between past and upcoming shows
+def get_todays_datetime():
+  return datetime(datetime.today().year, datetime.today().month, datetime.today().day)
+
+# Build the city/state -> venues -> num_upcoming_shows tree of /venues with one query.
+# Areas are paged by their (state, city) key, only the areas of the requested page are loaded.
+# With filters, areas only list their matching venues and those without any are skipped.
+# Returns (data[], next_cursor, prev_cursor)
+def get_venue_areas(cursor=None, per_page=20, filters=None):
+  conditions = filters.conditions() if filters else []
+  areas, direction, after = keyset_query(db.session.query(Venue.state, Venue.city).filter(*conditions).distinct(),
+    [Venue.state, Venue.city], cursor, per_page)
+  areas = areas.subquery()
+  rows = db.session.query(
+      Venue.id,
+      Venue.name,
+      Venue.city,
+      Venue.state,
+      Venue.upcoming_shows_count
+    ).join(areas, and_(Venue.city==areas.c.city, Venue.state==areas.c.state))\
+    .filter(*conditions)\
+    .order_by(Venue.state, Venue.city, Venue.name, Venue.id).all()
 
-# Get all the past shows of a venue, and return data[] with dictionaries with all the information needed it. 
-def get_past_shows_venue(id):
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = db.session.query(Show).join(Venue).filter(Show.venue_id==id).filter(Show.start_time<=todays_datetime).all()
   data = []
-  for show in shows:
-    artist = Artist.query.get(show.artist_id)
-    data.append({
-      "artist_id":artist.id,
-      "artist_name":artist.name,
-      "artist_image_link":artist.image_link,
-      "start_time": show.start_time.isoformat()
+  # rows are sorted by area, so a new area starts whenever city/state changes
+  for id, name, city, state, num_upcoming_shows in rows:
+    if not data or data[-1]['city'] != city or data[-1]['state'] != state:
+      data.append({
+        'city': city,
+        'state': state,
+        'venues': []
+      })
+    data[-1]['venues'].append({
+      "id": id,
+      "name": name,
+      "num_upcoming_shows": num_upcoming_shows
     })
-  return data
-# Get all the past shows of an artist, and return data[] with dictionaries, with all the information needed it. 
-def get_past_shows_artist(id):
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = db.session.query(Show).join(Artist).filter(Show.artist_id == id).filter(Show.start_time<=todays_datetime).all()
-  data = []
+  # keyset_result expects the areas in fetch order, which is descending for previous pages
+  if direction == 'prev':
+    data.reverse()
+  return keyset_result(data, lambda area: (area['state'], area['city']), direction, after, per_page)
+
+# Get all the shows of a venue with their artists in one query, and split them into
+# past_shows[] and upcoming_shows[] with dictionaries, with all the information needed it
+def get_shows_timeline_venue(id):
+  todays_datetime = get_todays_datetime()
+  shows = Show.query.options(joinedload(Show.artist))\
+    .filter(Show.venue_id==id).order_by(Show.start_time).all()
+  past_shows = []
+  upcoming_shows = []
+  for show in shows:
+    data = {
+      "show_id":show.id,
+      "artist_id":show.artist.id,
+      "artist_name":show.artist.name,
+      "artist_image_link":show.artist.image_link,
+      "start_time": show.start_time
+    }
+    if show.start_time >= todays_datetime:
+      upcoming_shows.append(data)
+    else:
+      past_shows.append(data)
+  return past_shows, upcoming_shows
+
+# Get all the shows of an artist with their venues in one query, and split them into
+# past_shows[] and upcoming_shows[] with dictionaries, with all the information needed it
+def get_shows_timeline_artist(id):
+  todays_datetime = get_todays_datetime()
+  shows = Show.query.options(joinedload(Show.venue))\
+    .filter(Show.artist_id==id).order_by(Show.start_time).all()
+  past_shows = []
+  upcoming_shows = []
+  for show in shows:
+    data = {
+      "show_id":show.id,
+      "venue_id":show.venue.id,
+      "venue_name":show.venue.name,
+      "venue_image_link":show.venue.image_link,
+      "start_time": show.start_time
+    }
+    if show.start_time >= todays_datetime:
+      upcoming_shows.append(data)
+    else:
+      past_shows.append(data)
+  return past_shows, upcoming_shows
+
+# Get one page of the upcoming shows from the upcoming_show_feed view, ordered by
+# (start_time, show_id). Returns (data[], next_cursor, prev_cursor)
+def get_upcoming_shows_page(cursor=None, per_page=30):
+  todays_datetime = get_todays_datetime()
+  feed = upcoming_show_feed.c
+  # The view may still hold yesterday's shows until its midnight refresh
+  shows, next_cursor, prev_cursor = keyset_page(db.session.query(upcoming_show_feed).filter(feed.start_time>=todays_datetime),
+    [feed.start_time, feed.show_id], lambda show: (show.start_time, show.show_id), cursor, per_page)
+  data=[]
   for show in shows:
-    venue = Venue.query.get(show.venue_id)
     data.append({
-      "venue_id":venue.id,
-      "venue_name":venue.name,
-      "venue_image_link":venue.image_link,
-      "start_time": show.start_time.isoformat()
+      'show_id':show.show_id,
+      'venue_id':show.venue_id,
+      'venue_name':show.venue_name,
+      'artist_id':show.artist_id,
+      'artist_name':show.artist_name,
+      'artist_image_link':show.artist_image_link,
+      'start_time':show.start_time
     })
-  return data
-# Get all the upcoming shows of the database
-def getall_upcoming_shows():
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = Show.query.filter(Show.start_time>=todays_datetime).all()
-  return shows
-# Get all the upcoming shows of an artist, and return data[] with dictionaries, with all the information needed it
-def get_upcoming_shows_artist(id):
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = db.session.query(Show).join(Artist).filter(Show.artist_id==id).filter(Show.start_time>=todays_datetime).all()
-  data = []
-  for show in shows:
-    venue = Venue.query.get(show.venue_id)
+  return data, next_cursor, prev_cursor
+
+# The [start, end) datetimes of the ?from= and ?to= dates of a calendar (to is included), from
+# today for CALENDAR_DEFAULT_DAYS by default. 400 on invalid dates or ranges over CALENDAR_MAX_DAYS.
+def get_calendar_range():
+  try:
+    start = datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from') else get_todays_datetime()
+    if request.args.get('to'):
+      end = datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1)
+    else:
+      end = start + timedelta(days=app.config.get('CALENDAR_DEFAULT_DAYS', 31))
+  except ValueError:
+    abort(400)
+  if end <= start or (end - start).days > app.config.get('CALENDAR_MAX_DAYS', 366):
+    abort(400)
+  return start, end
+
+# Get the shows starting in [start, end) matching filters with their venue and artist in one
+# query, which only reads the partitions of those months. Returns (days[], truncated): the days
+# having shows, with their shows, and whether there were more than CALENDAR_MAX_SHOWS shows
+def get_calendar(start, end, *filters):
+  limit = app.config.get('CALENDAR_MAX_SHOWS', 2000)
+  rows = db.session.query(Show.id, Show.start_time, Show.duration_minutes, Show.venue_id,
+      Venue.name.label('venue_name'), Venue.city, Venue.state, Show.artist_id,
+      Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'))\
+    .join(Venue, Show.venue_id==Venue.id).join(Artist, Show.artist_id==Artist.id)\
+    .filter(Show.start_time>=start, Show.start_time<end, *filters)\
+    .order_by(Show.start_time, Show.id).limit(limit + 1).all()
+  days = []
+  for row in rows[:limit]:
+    day = row.start_time.date()
+    if not days or days[-1]['date'] != day:
+      days.append({'date': day, 'shows': []})
+    days[-1]['shows'].append({
+      'show_id': row.id,
+      'start_time': row.start_time,
+      'end_time': row.start_time + timedelta(minutes=row.duration_minutes),
+      'venue_id': row.venue_id,
+      'venue_name': row.venue_name,
+      'city': row.city,
+      'state': row.state,
+      'artist_id': row.artist_id,
+      'artist_name': row.artist_name,
+      'artist_image_link': row.artist_image_link
+    })
+  return days, len(rows) > limit
+
+# Cache tags of a calendar
+def calendar_tags(data):
+  shows = [show for day in data[0] for show in day['shows']]
+  return ['show-list'] + ['venue:%d' % show['venue_id'] for show in shows] + \
+    ['artist:%d' % show['artist_id'] for show in shows]
+
+# The JSON of a calendar, with ISO dates and times
+def calendar_json(start, end, data):
+  days, truncated = data
+  return {
+    'from': start.date().isoformat(),
+    'to': (end - timedelta(days=1)).date().isoformat(),
+    'truncated': truncated,
+    'days': [{
+      'date': day['date'].isoformat(),
+      'shows': [dict(show, start_time=show['start_time'].isoformat(), end_time=show['end_time'].isoformat())
+        for show in day['shows']]
+    } for day in days]
+  }
+
+# Get one page of the artists ordered by (name, id). Returns (data[], next_cursor, prev_cursor)
+def get_artists_page(cursor=None, per_page=50, filters=None):
+  query = db.session.query(Artist.id, Artist.name)
+  if filters:
+    query = query.filter(*filters.conditions())
+  artists, next_cursor, prev_cursor = keyset_page(query,
+    [Artist.name, Artist.id], lambda artist: (artist.name, artist.id), cursor, per_page)
+  data=[]
+  for artist in artists:
     data.append({
-      "venue_id":venue.id,
-      "venue_name":venue.name,
-      "venue_image_link":venue.image_link,
-      "start_time": show.start_time.isoformat()
+      'id':artist.id,
+      "name":artist.name,
     })
+  return data, next_cursor, prev_cursor
+
+# Cache tags of the venue and artist pages and of the /shows pages
+def venue_tags(venue):
+  return ['venue:%d' % venue['id'], 'venue-shows:%d' % venue['id']] + \
+    ['artist:%d' % show['artist_id'] for show in venue['past_shows'] + venue['upcoming_shows']]
+
+def artist_tags(artist):
+  return ['artist:%d' % artist['id'], 'artist-shows:%d' % artist['id']] + \
+    ['venue:%d' % show['venue_id'] for show in artist['past_shows'] + artist['upcoming_shows']]
+
+def show_list_tags(page):
+  return ['show-list'] + ['venue:%d' % show['venue_id'] for show in page[0]] + \
+    ['artist:%d' % show['artist_id'] for show in page[0]]
+
+# Get the data of the venue page, 404 when the venue doesn't exist
+def get_venue_data(venue_id):
+  venue = Venue.query.get(venue_id)
+  if venue is None:
+    abort(404)
+  past_shows, upcoming_shows = get_shows_timeline_venue(venue_id)
+  return venue_data(venue, past_shows, upcoming_shows)
+
+# The venue page data of a venue (model or row) and its shows
+def venue_data(venue, past_shows, upcoming_shows):
+  data={
+    "id": venue.id,
+    "name": venue.name,
+    "genres": venue.genres,
+    "address": venue.address,
+    "city": venue.city,
+    "state": venue.state,
+    "phone": venue.phone,
+    "website": venue.website,
+    "facebook_link": venue.facebook_link,
+    "seeking_talent": venue.seeking_talent,
+    "seeking_description": venue.seeking_description,
+    "image_link": venue.image_link,
+    "past_shows": past_shows,
+    "upcoming_shows": upcoming_shows,
+    "past_shows_count": len(past_shows),
+    "upcoming_shows_count": len(upcoming_shows)
+  }
   return data
 
-# Count all the past shows of a venue
-def count_past_shows_venue(id):
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = db.session.query(Show).join(Venue).filter(Show.venue_id==id).filter(Show.start_time<=todays_datetime).count()
-  return shows
-
-# Count all the past shows of an artist
-
-def count_past_shows_artist(id):
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = db.session.query(Show).join(Artist).filter(Show.artist_id==id).filter(Show.start_time<=todays_datetime).count()
-  return shows
-
-# Count all the upcoming shows of a artist
-def count_upcoming_shows_artist(id):
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = db.session.query(Show).join(Artist).filter(Show.artist_id==id).filter(Show.start_time>=todays_datetime).count()
-  return shows
-# Count all the upcoming shows of a venue
-def count_upcoming_shows_venue(id):
-  todays_datetime = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
-  shows = db.session.query(Show).join(Venue).filter(Show.venue_id==id).filter(Show.start_time>=todays_datetime).count()
-  return shows
+# Get the data of the artist page, 404 when the artist doesn't exist
+def get_artist_data(artist_id):
+  artist = Artist.query.get(artist_id)
+  if artist is None:
+    abort(404)
+  past_shows, upcoming_shows = get_shows_timeline_artist(artist_id)
+  return artist_data(artist, past_shows, upcoming_shows)
+
+# The artist page data of an artist (model or row) and its shows
+def artist_data(artist, past_shows, upcoming_shows):
+  data={
+    "id": artist.id,
+    "name": artist.name,
+    "genres": artist.genres,
+    "city": artist.city,
+    "state": artist.state,
+    "phone": artist.phone,
+    "website": artist.website,
+    "facebook_link": artist.facebook_link,
+    "seeking_venue": artist.seeking_venue,
+    "seeking_description": artist.seeking_description,
+    "image_link": artist.image_link,
+    "past_shows": past_shows,
+    "upcoming_shows": upcoming_shows,
+    "past_shows_count": len(past_shows),
+    "upcoming_shows_count": len(upcoming_shows)
+  }
+  return data
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -0,0 +1,206 @@
+import asyncio
+from asgiref.wsgi import WsgiToAsgi
+from flask import render_template, request, abort, g
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+from app import (app, get_todays_datetime, venue_data, artist_data, venue_tags, artist_tags,
+  show_list_tags)
+from models import Venue, Artist, Show, upcoming_show_feed
+from cache import cache
+from pagination import keyset_query, keyset_result
+from facets import Filters, facet_statement, facet_counts
+
+#----------------------------------------------------------------------------#
+# Async serving mode.
+#----------------------------------------------------------------------------#
+
+# ASGI entry point: uvicorn asgi:application --workers 4
+#
+# The venue and artist pages, /artists and /shows are served by the coroutines below, which
+# query an asyncpg engine and run their independent queries (the entity, its upcoming shows,
+# its past shows) concurrently, so a worker keeps serving other requests while it waits on
+# the database. Every other route goes to the WSGI app in a thread pool. The Flask request
+# hooks (metrics, traces, replica routing), the view cache and the templates are the same in
+# both modes.
+
+# Views served by the coroutines below, by endpoint
+ASYNC_VIEWS = {}
+
+def async_view(endpoint):
+  def register(view):
+    ASYNC_VIEWS[endpoint] = view
+    return view
+  return register
+
+class AsyncEngines:
+  def __init__(self):
+    # bind key (None for the primary) -> AsyncEngine
+    self.engines = {}
+
+  def get(self, bind_key=None):
+    engine = self.engines.get(bind_key)
+    if engine is None:
+      uri = app.config['SQLALCHEMY_DATABASE_URI'] if bind_key is None else app.config['SQLALCHEMY_BINDS'][bind_key]
+      engine = create_async_engine(make_url(uri).set(drivername='postgresql+asyncpg'),
+        pool_size=app.config.get('ASYNC_POOL_SIZE', 20), max_overflow=app.config.get('ASYNC_MAX_OVERFLOW', 10))
+      self.engines[bind_key] = engine
+    return engine
+
+  # The engine of the current request, a replica when routing.py picked one
+  def current(self):
+    return self.get(g.get('replica_bind_key'))
+
+async_engines = AsyncEngines()
+
+# Every query runs on its own connection, so the ones gathered together run concurrently
+async def fetch_all(statement):
+  async with async_engines.current().connect() as connection:
+    return (await connection.execute(statement)).all()
+
+async def fetch_one(statement):
+  async with async_engines.current().connect() as connection:
+    return (await connection.execute(statement)).first()
+
+VENUE_COLUMNS = [Venue.id, Venue.name, Venue.genres, Venue.address, Venue.city, Venue.state, Venue.phone,
+  Venue.website, Venue.facebook_link, Venue.seeking_talent, Venue.seeking_description, Venue.image_link]
+ARTIST_COLUMNS = [Artist.id, Artist.name, Artist.genres, Artist.city, Artist.state, Artist.phone,
+  Artist.website, Artist.facebook_link, Artist.seeking_venue, Artist.seeking_description, Artist.image_link]
+
+# Upcoming (or past) shows of a venue, as the dictionaries of get_shows_timeline_venue
+async def fetch_venue_shows(venue_id, upcoming):
+  today = get_todays_datetime()
+  rows = await fetch_all(select(Show.id.label('show_id'), Show.artist_id, Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'), Show.start_time)
+    .join(Artist, Show.artist_id==Artist.id)
+    .where(Show.venue_id==venue_id, Show.start_time>=today if upcoming else Show.start_time<today)
+    .order_by(Show.start_time))
+  return [row._asdict() for row in rows]
+
+async def fetch_artist_shows(artist_id, upcoming):
+  today = get_todays_datetime()
+  rows = await fetch_all(select(Show.id.label('show_id'), Show.venue_id, Venue.name.label('venue_name'),
+      Venue.image_link.label('venue_image_link'), Show.start_time)
+    .join(Venue, Show.venue_id==Venue.id)
+    .where(Show.artist_id==artist_id, Show.start_time>=today if upcoming else Show.start_time<today)
+    .order_by(Show.start_time))
+  return [row._asdict() for row in rows]
+
+async def get_venue_data(venue_id):
+  venue, upcoming_shows, past_shows = await asyncio.gather(
+    fetch_one(select(*VENUE_COLUMNS).where(Venue.id==venue_id)),
+    fetch_venue_shows(venue_id, True),
+    fetch_venue_shows(venue_id, False))
+  if venue is None:
+    abort(404)
+  return venue_data(venue, past_shows, upcoming_shows)
+
+async def get_artist_data(artist_id):
+  artist, upcoming_shows, past_shows = await asyncio.gather(
+    fetch_one(select(*ARTIST_COLUMNS).where(Artist.id==artist_id)),
+    fetch_artist_shows(artist_id, True),
+    fetch_artist_shows(artist_id, False))
+  if artist is None:
+    abort(404)
+  return artist_data(artist, past_shows, upcoming_shows)
+
+async def get_facets(filters):
+  return facet_counts(filters, await fetch_one(facet_statement(filters)))
+
+async def get_keyset_page(statement, columns, key, cursor, per_page):
+  statement, direction, after = keyset_query(statement, columns, cursor, per_page)
+  rows = [row._asdict() for row in await fetch_all(statement)]
+  return keyset_result(rows, key, direction, after, per_page)
+
+@async_view('show_venue')
+async def show_venue(venue_id):
+  data = await cache.get_or_build_async('venue:%d' % venue_id, venue_tags, lambda: get_venue_data(venue_id))
+  return render_template('pages/show_venue.html', venue=data)
+
+@async_view('show_artist')
+async def show_artist(artist_id):
+  data = await cache.get_or_build_async('artist:%d' % artist_id, artist_tags, lambda: get_artist_data(artist_id))
+  return render_template('pages/show_artist.html', artist=data)
+
+@async_view('artists')
+async def artists():
+  per_page = app.config.get('ARTISTS_PER_PAGE', 50)
+  cursor = request.args.get('cursor')
+  filters = Filters.from_args(Artist, request.args)
+  # The page and the facet counts of its filters are cached (and queried) independently
+  (data, next_cursor, prev_cursor), facets = await asyncio.gather(
+    cache.get_or_build_async('artists:%s:%s' % (filters.key(), cursor), ['artist-list'],
+      lambda: get_keyset_page(select(Artist.id, Artist.name).where(*filters.conditions()),
+        [Artist.name, Artist.id], lambda artist: (artist['name'], artist['id']), cursor, per_page)),
+    cache.get_or_build_async('artist-facets:%s' % filters.key(), ['artist-list'], lambda: get_facets(filters)))
+  return render_template('pages/artists.html', artists=data, next_cursor=next_cursor, prev_cursor=prev_cursor,
+    filters=filters, facets=facets)
+
+@async_view('shows')
+async def shows():
+  per_page = app.config.get('SHOWS_PER_PAGE', 30)
+  cursor = request.args.get('cursor')
+  feed = upcoming_show_feed.c
+  data, next_cursor, prev_cursor = await cache.get_or_build_async('shows:%s' % cursor, show_list_tags,
+    lambda: get_keyset_page(select(upcoming_show_feed).where(feed.start_time>=get_todays_datetime()),
+      [feed.start_time, feed.show_id], lambda show: (show['start_time'], show['show_id']), cursor, per_page))
+  return render_template('pages/shows.html', shows=data, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+class AsyncApplication:
+  def __init__(self, app):
+    self.app = app
+    self.wsgi = WsgiToAsgi(app)
+    self.url_adapter = app.url_map.bind('')
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'http':
+      try:
+        endpoint, args = self.url_adapter.match(scope['path'], scope['method'])
+      except HTTPException:
+        endpoint = None
+      if endpoint in ASYNC_VIEWS:
+        await self.dispatch(scope, send, ASYNC_VIEWS[endpoint], args)
+        return
+    elif scope['type'] == 'lifespan':
+      await self.lifespan(receive, send)
+      return
+    await self.wsgi(scope, receive, send)
+
+  # Runs an async view like Flask's full_dispatch_request: before/after request hooks,
+  # error handlers and session cookie included
+  async def dispatch(self, scope, send, view, args):
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    host = dict(headers).get('host') or '%s:%d' % tuple(scope['server'])
+    # The async views are all GETs, there is no body to read
+    environ = EnvironBuilder(path=scope['path'], base_url='%s://%s' % (scope.get('scheme', 'http'), host),
+      query_string=scope['query_string'], method=scope['method'], headers=headers,
+      environ_base={'REMOTE_ADDR': (scope.get('client') or ('', 0))[0]}).get_environ()
+    with self.app.request_context(environ):
+      try:
+        rv = self.app.preprocess_request()
+        if rv is None:
+          rv = await view(**args)
+      except HTTPException as e:
+        rv = self.app.handle_user_exception(e)
+      except Exception as e:
+        rv = self.app.handle_exception(e)
+      response = self.app.process_response(self.app.make_response(rv))
+      body = response.get_data()
+    await send({'type': 'http.response.start', 'status': response.status_code,
+      'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+  async def lifespan(self, receive, send):
+    while True:
+      message = await receive()
+      if message['type'] == 'lifespan.startup':
+        await send({'type': 'lifespan.startup.complete'})
+      elif message['type'] == 'lifespan.shutdown':
+        for engine in async_engines.engines.values():
+          await engine.dispose()
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+application = AsyncApplication(app)
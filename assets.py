@@ -0,0 +1,193 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import click
+from flask import request, send_from_directory, current_app
+from flask.cli import AppGroup, with_appcontext
+
+#----------------------------------------------------------------------------#
+# Static assets.
+#----------------------------------------------------------------------------#
+
+# The stylesheets and scripts of layouts/main.html are concatenated into two bundles,
+# minified, fingerprinted with the hash of their content and precompressed with gzip (and
+# brotli when the brotli package is installed) by "flask assets build", which also
+# fingerprints the other static files. It writes everything to static/dist with a
+# manifest.json, and url_for('static', filename=...) then returns the fingerprinted names,
+# served with a one year immutable Cache-Control. Without a build (development), the
+# bundles are concatenated on every request and nothing is cached.
+#
+#   <link rel="stylesheet" href="{{ url_for('static', filename='bundles/main.css') }}">
+
+BUNDLES = {
+  'bundles/main.css': ['css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css',
+    'css/main.responsive.css', 'css/main.quickfix.css'],
+  # Deferred. modernizr isn't bundled: it sets its classes on <html> before the page renders,
+  # so it is loaded on its own and not deferred
+  'bundles/main.js': ['js/libs/moment.min.js', 'js/libs/jquery-1.11.1.min.js',
+    'js/libs/bootstrap-3.1.1.min.js', 'js/plugins.js', 'js/script.js'],
+}
+
+DIST_FOLDER = 'dist'
+COMPRESSED_TYPES = ('.css', '.js', '.svg', '.map', '.json', '.txt', '.eot', '.ttf', '.otf')
+# Files left out of the build
+SKIPPED = ('.gitkeep', '.DS_Store')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+SOURCE_MAP = re.compile(r'^\s*/[/*][#@] sourceMappingURL=.*$', re.MULTILINE)
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+def minify_css(text):
+  text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL)
+  text = re.sub(r'\s+', ' ', text)
+  text = re.sub(r'\s*([{};:,>])\s*', r'\1', text)
+  return text.replace(';}', '}').strip()
+
+# Rewrites the relative url()s of a stylesheet, which no longer sit next to it once bundled,
+# to resolve(name of the file in the static folder)
+def rewrite_css_urls(text, source, resolve):
+  def rewrite(match):
+    url = match.group(2)
+    if url.startswith(('/', 'data:', 'http:', 'https:', '#')):
+      return match.group(0)
+    path, sep, fragment = url.partition('?') if '?' in url else url.partition('#')
+    name = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+    return 'url("{0}{1}{2}")'.format(resolve(name), sep, fragment)
+  return CSS_URL.sub(rewrite, text)
+
+def minify_js(text):
+  try:
+    import rjsmin
+  except ImportError:
+    return text
+  return rjsmin.jsmin(text)
+
+# The concatenated (and minified) content of a bundle, resolve(name) gives the URL of a
+# static file referenced by a stylesheet
+def build_bundle(static_folder, name, resolve, minify=True):
+  parts = []
+  for source in BUNDLES[name]:
+    with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+      text = SOURCE_MAP.sub('', f.read())
+    if name.endswith('.css'):
+      text = rewrite_css_urls(text, source, resolve)
+    if minify and not source.endswith('.min.js') and not source.endswith('.min.css'):
+      text = minify_css(text) if name.endswith('.css') else minify_js(text)
+    parts.append(text)
+  # Scripts are joined with ';' in case one of them doesn't end its last statement
+  return ('\n' if name.endswith('.css') else ';\n').join(parts).encode('utf-8')
+
+def fingerprinted(name, data):
+  root, ext = os.path.splitext(name)
+  return '{0}.{1}{2}'.format(root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+def write_asset(dist_folder, name, data):
+  path = os.path.join(dist_folder, name)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'wb') as f:
+    f.write(data)
+  if name.endswith(COMPRESSED_TYPES):
+    with open(path + '.gz', 'wb') as f:
+      f.write(gzip.compress(data, 9))
+    try:
+      import brotli
+    except ImportError:
+      return
+    with open(path + '.br', 'wb') as f:
+      f.write(brotli.compress(data))
+
+# Builds the dist folder, returns the manifest {name: fingerprinted name}
+def build(static_folder, static_url_path='/static'):
+  dist_folder = os.path.join(static_folder, DIST_FOLDER)
+  manifest = {}
+  for folder, folders, files in os.walk(static_folder):
+    if os.path.abspath(folder).startswith(os.path.abspath(dist_folder)):
+      continue
+    for filename in files:
+      if filename in SKIPPED:
+        continue
+      name = os.path.relpath(os.path.join(folder, filename), static_folder).replace(os.sep, '/')
+      with open(os.path.join(folder, filename), 'rb') as f:
+        data = f.read()
+      manifest[name] = fingerprinted(name, data)
+      write_asset(dist_folder, manifest[name], data)
+  # After the other files, so the stylesheets point to their fingerprinted names
+  def resolve(name):
+    if name in manifest:
+      return '{0}/{1}/{2}'.format(static_url_path, DIST_FOLDER, manifest[name])
+    return '{0}/{1}'.format(static_url_path, name)
+  for name in BUNDLES:
+    data = build_bundle(static_folder, name, resolve)
+    manifest[name] = fingerprinted(name, data)
+    write_asset(dist_folder, manifest[name], data)
+  with open(os.path.join(dist_folder, 'manifest.json'), 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+  return manifest
+
+class Assets:
+  def __init__(self):
+    self.app = None
+    # name -> fingerprinted name, empty without a build
+    self.manifest = {}
+
+  def init_app(self, app):
+    self.app = app
+    self.load()
+    app.url_defaults(self.fingerprint_url)
+    app.view_functions['static'] = self.send_static
+
+  def load(self):
+    path = os.path.join(self.app.static_folder, DIST_FOLDER, 'manifest.json')
+    if os.path.exists(path):
+      with open(path) as f:
+        self.manifest = json.load(f)
+
+  # url_for('static', filename='css/main.css') -> /static/dist/css/main.<hash>.css
+  def fingerprint_url(self, endpoint, values):
+    if endpoint == 'static' and values.get('filename') in self.manifest:
+      values['filename'] = DIST_FOLDER + '/' + self.manifest[values['filename']]
+
+  # Serves the precompressed copy of a fingerprinted file accepted by the client, with a
+  # far future expiry. Bundles are built on the fly when there is no build.
+  def send_static(self, filename):
+    static_folder = self.app.static_folder
+    if filename in BUNDLES:
+      if filename in self.manifest:
+        return self.send_static(DIST_FOLDER + '/' + self.manifest[filename])
+      mimetype = 'text/css' if filename.endswith('.css') else 'application/javascript'
+      data = build_bundle(static_folder, filename, lambda name: self.app.static_url_path + '/' + name, minify=False)
+      return self.app.response_class(data, mimetype=mimetype)
+    if not filename.startswith(DIST_FOLDER + '/'):
+      return self.app.send_static_file(filename)
+    accepted = request.accept_encodings
+    for encoding, suffix in [('br', '.br'), ('gzip', '.gz')]:
+      if accepted[encoding] and os.path.exists(os.path.join(static_folder, filename + suffix)):
+        response = send_from_directory(static_folder, filename + suffix, max_age=0,
+          mimetype=self.mimetype(filename))
+        response.headers['Content-Encoding'] = encoding
+        break
+    else:
+      response = send_from_directory(static_folder, filename, max_age=0)
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    return response
+
+  def mimetype(self, filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+assets = Assets()
+
+assets_cli = AppGroup('assets', help='Build the static assets.')
+
+@assets_cli.command('build')
+@with_appcontext
+def build_command():
+  """Bundle, minify, fingerprint and precompress the static files into static/dist."""
+  manifest = build(current_app.static_folder, current_app.static_url_path)
+  for name in BUNDLES:
+    click.echo('{0} -> {1}/{2}'.format(name, DIST_FOLDER, manifest[name]))
+  click.echo('{0} files fingerprinted'.format(len(manifest)))
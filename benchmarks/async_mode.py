@@ -0,0 +1,81 @@
+# Compares the sync (WSGI) and async (ASGI, asgi.py) serving modes under 500 concurrent
+# connections, on the venue and artist pages and /shows. Seed the database and start both
+# servers with the same number of workers first:
+#   python -m benchmarks.seed --scale 100k   (with SQLALCHEMY_DATABASE_URI on the seeded database)
+#   gunicorn --workers 4 --threads 8 --bind 127.0.0.1:5000 app:app
+#   uvicorn asgi:application --workers 4 --port 8000
+# Usage: python -m benchmarks.async_mode --sync http://127.0.0.1:5000 --async http://127.0.0.1:8000
+import argparse
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.replay import Connection, Results
+
+CONNECTIONS = 500
+REQUESTS = 20000
+
+
+# The seed gives ids from 1 to n_venues/n_artists, busy venues and artists first
+def request_paths(n, venues, artists, seed=42):
+  rng = random.Random(seed)
+  paths = []
+  for i in range(n):
+    kind = rng.random()
+    if kind < 0.45:
+      paths.append(('show_venue', '/venues/%d' % rng.randint(1, venues)))
+    elif kind < 0.9:
+      paths.append(('show_artist', '/artists/%d' % rng.randint(1, artists)))
+    else:
+      paths.append(('shows', '/shows'))
+  return paths
+
+
+async def run(target, paths, connections):
+  url = urlsplit(target)
+  queue = asyncio.Queue()
+  for path in paths:
+    queue.put_nowait(path)
+  results = Results()
+
+  async def worker():
+    connection = Connection(url.hostname, url.port or 80)
+    while not queue.empty():
+      endpoint, path = queue.get_nowait()
+      start = time.perf_counter()
+      try:
+        status = await connection.request('GET', path)
+      except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+        connection.close()
+        status = None
+      results.add(endpoint, (time.perf_counter() - start) * 1000, status)
+    connection.close()
+
+  started = time.perf_counter()
+  await asyncio.gather(*[worker() for i in range(connections)])
+  return results, time.perf_counter() - started
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Compare the sync and async serving modes.')
+  parser.add_argument('--sync', dest='sync_target', default='http://127.0.0.1:5000')
+  parser.add_argument('--async', dest='async_target', default='http://127.0.0.1:8000')
+  parser.add_argument('--connections', type=int, default=CONNECTIONS)
+  parser.add_argument('--requests', type=int, default=REQUESTS)
+  parser.add_argument('--venues', type=int, default=1000, help='Highest venue id to request.')
+  parser.add_argument('--artists', type=int, default=2000, help='Highest artist id to request.')
+  args = parser.parse_args()
+
+  paths = request_paths(args.requests, args.venues, args.artists)
+  for label, target in [('sync', args.sync_target), ('async', args.async_target)]:
+    # Warms the caches and connection pools of the server up
+    asyncio.run(run(target, paths[:args.connections], args.connections))
+    results, elapsed = asyncio.run(run(target, paths, args.connections))
+    print('== %s (%s), %d connections' % (label, target, args.connections))
+    results.report(elapsed)
+    print()
+
+
+if __name__ == '__main__':
+  main()
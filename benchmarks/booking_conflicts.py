@@ -0,0 +1,169 @@
+# Checks that two shows overlapping across the end of a month can't both be booked, although
+# they fall in different partitions of Show, neither when their transactions run concurrently
+# (the show_booking_check() trigger of bookings.py) nor when two /shows/create race, and that
+# of 50 overlapping shows of one artist (then of one venue) posted at once exactly one is booked.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.booking_conflicts
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from benchmarks.common import setup_app
+from bookings import is_booking_conflict
+from models import db, Venue, Artist, Show
+
+ROUNDS = 20
+# Overlapping shows posted at once
+COLLISIONS = 50
+
+
+# Runs target(*args) in a thread, its exception is re-raised by join()
+class Worker(threading.Thread):
+  def __init__(self, target, *args):
+    super().__init__()
+    self.call = (target, args)
+    self.result = self.error = None
+
+  def run(self):
+    target, args = self.call
+    try:
+      self.result = target(*args)
+    except BaseException as e:
+      self.error = e
+
+  def join(self, timeout=None):
+    super().join(timeout)
+    if self.error is not None:
+      raise self.error
+    return self.result
+
+
+# 23:00 on the last day of the month after the current one, the partitions of both sides of
+# midnight exist
+def month_end(months_ahead=1):
+  first = date.today().replace(day=1)
+  for i in range(months_ahead + 1):
+    first = (first + timedelta(days=32)).replace(day=1)
+  return datetime.combine(first - timedelta(days=1), datetime.min.time()) + timedelta(hours=23)
+
+
+def insert_show(connection, artist_id, venue_id, start_time, duration_minutes):
+  connection.execute(Show.__table__.insert(), {'artist_id': artist_id, 'venue_id': venue_id,
+    'start_time': start_time, 'duration_minutes': duration_minutes})
+
+
+# A transaction books a show until 01:00, a concurrent one the same artist (or venue) at 00:30
+# the next day: the second waits for the first to commit, then fails
+def check_concurrent(label, first, second):
+  end = month_end()
+  with db.engine.connect() as one, db.engine.connect() as two:
+    one.begin()
+    insert_show(one, first[0], first[1], end, 120)
+
+    def book():
+      with two.begin():
+        insert_show(two, second[0], second[1], end + timedelta(minutes=90), 60)
+
+    worker = Worker(book)
+    worker.start()
+    time.sleep(0.5)
+    waited = worker.is_alive()
+    one.commit()
+    try:
+      worker.join()
+      rejected = False
+    except IntegrityError as e:
+      rejected = is_booking_conflict(e)
+  ok = waited and rejected
+  print('%-40s waited %-5s rejected %-5s %s' % (label, waited, rejected, 'ok' if ok else 'FAIL'))
+  return ok
+
+
+# Two requests booking the same artist across midnight, exactly one gets the show. Every
+# round has its own artist and venues.
+def check_route_race(app, artist_ids, venue_ids):
+  ok = True
+  for i, artist_id in enumerate(artist_ids):
+    venues = venue_ids[2 * i:2 * i + 2]
+    end = month_end(1 + i % 6)
+    forms = [
+      {'artist_id': artist_id, 'venue_id': venues[0], 'duration_minutes': 120,
+       'start_time': end.strftime('%Y-%m-%d %H:%M:%S')},
+      {'artist_id': artist_id, 'venue_id': venues[1], 'duration_minutes': 60,
+       'start_time': (end + timedelta(minutes=90)).strftime('%Y-%m-%d %H:%M:%S')},
+    ]
+    barrier = threading.Barrier(len(forms))
+
+    def post(form):
+      client = app.test_client()
+      barrier.wait()
+      return client.post('/shows/create', data=form).status_code
+
+    workers = [Worker(post, form) for form in forms]
+    for worker in workers:
+      worker.start()
+    statuses = [worker.join() for worker in workers]
+    with app.app_context():
+      booked = db.session.query(Show.id).filter(Show.artist_id == artist_id,
+        Show.start_time >= end - timedelta(hours=1), Show.start_time < end + timedelta(hours=3)).count()
+    if booked != 1:
+      print('round %d: %d shows booked, statuses %s  FAIL' % (i, booked, statuses))
+      ok = False
+  print('%-40s %d rounds %s' % ('route race across midnight', len(artist_ids), 'ok' if ok else 'FAIL'))
+  return ok
+
+
+# Posts overlapping shows sharing their artist or their venue, from 23:00 on the last day of a
+# month, one minute apart for two hours: only one may be booked. A conflict is a 409 when
+# find_conflicts() sees the booked show, a 200 with an error message when the database rejects it.
+def check_collisions(app, label, pairs, months_ahead):
+  end = month_end(months_ahead)
+  forms = [{'artist_id': artist_id, 'venue_id': venue_id, 'duration_minutes': 120,
+    'start_time': (end + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S')}
+    for i, (artist_id, venue_id) in enumerate(pairs)]
+  barrier = threading.Barrier(len(forms))
+
+  def post(form):
+    client = app.test_client()
+    barrier.wait()
+    return client.post('/shows/create', data=form).status_code
+
+  workers = [Worker(post, form) for form in forms]
+  for worker in workers:
+    worker.start()
+  statuses = [worker.join() for worker in workers]
+  with app.app_context():
+    booked = db.session.query(Show.id).filter(Show.start_time >= end,
+      Show.start_time < end + timedelta(hours=2)).count()
+  ok = booked == 1 and all(status in (200, 409) for status in statuses)
+  print('%-40s %d posted, %d booked %s' % (label, len(forms), booked, 'ok' if ok else 'FAIL'))
+  return ok
+
+
+def main():
+  app = setup_app()
+  with app.app_context():
+    venues = [Venue(name='Venue %d' % i, city='Austin', state='TX') for i in range(3 + 2 * ROUNDS + COLLISIONS)]
+    artists = [Artist(name='Artist %d' % i, city='Austin', state='TX') for i in range(3 + ROUNDS + COLLISIONS)]
+    db.session.add_all(venues + artists)
+    db.session.commit()
+    v, a = [venue.id for venue in venues], [artist.id for artist in artists]
+    results = [
+      check_concurrent('same artist across midnight', (a[0], v[0]), (a[0], v[1])),
+      check_concurrent('same venue across midnight', (a[1], v[2]), (a[2], v[2])),
+    ]
+  results.append(check_route_race(app, a[3:3 + ROUNDS], v[3:3 + 2 * ROUNDS]))
+  # Entities of their own, months the route race doesn't book
+  artists, venues = a[3 + ROUNDS:], v[3 + 2 * ROUNDS:]
+  results.append(check_collisions(app, '%d bookings of one artist' % COLLISIONS,
+    [(artists[0], venue_id) for venue_id in venues], 8))
+  results.append(check_collisions(app, '%d bookings at one venue' % COLLISIONS,
+    [(artist_id, venues[0]) for artist_id in artists], 9))
+  print('ok' if all(results) else 'FAIL')
+  if not all(results):
+    raise SystemExit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+# Partitions read and latency of the calendars (/shows/calendar, /venues/<id>/calendar) for
+# ranges of a week to a year, on the seeded data set. A range only reads the partitions of its
+# months, "Show_default" included.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.calendars [--scale 100k]
+import argparse
+import json
+import time
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from benchmarks.common import setup_app
+from benchmarks.seed import SCALES, seed
+from cache import cache, NullBackend
+from counters import todays_datetime
+from models import db, Venue
+from partitions import list_partitions
+
+RANGES = [7, 31, 92, 366]
+ITERATIONS = 20
+
+CALENDAR_SQL = '''
+SELECT s.id, s.start_time FROM "Show" s
+WHERE s.start_time >= :start AND s.start_time < :end {0}
+ORDER BY s.start_time, s.id
+'''
+
+
+# Names of the partitions of Show read by a plan
+def scanned(node):
+  names = set()
+  if node.get('Relation Name', '').startswith('Show_'):
+    names.add(node['Relation Name'])
+  for child in node.get('Plans', []):
+    names |= scanned(child)
+  return names
+
+
+def partitions_read(start, end, where=''):
+  row = db.session.execute(text('EXPLAIN (FORMAT JSON) ' + CALENDAR_SQL.format(where)),
+    {'start': start, 'end': end}).scalar()
+  plan = row if isinstance(row, list) else json.loads(row)
+  return len(scanned(plan[0]['Plan']))
+
+
+def latency(client, url):
+  timings = []
+  for i in range(ITERATIONS):
+    start = time.perf_counter()
+    response = client.get(url)
+    timings.append((time.perf_counter() - start) * 1000)
+    assert response.status_code == 200, url
+  timings.sort()
+  return timings[len(timings) // 2]
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scale', choices=sorted(SCALES), default='100k')
+  args = parser.parse_args()
+  app = setup_app()
+  # Every request reads the database
+  cache.backend = NullBackend()
+  client = app.test_client()
+  with app.app_context():
+    seed(SCALES[args.scale])
+    with db.engine.connect() as connection:
+      total = len(list_partitions(connection))
+    venue_id = db.session.query(Venue.id).order_by(Venue.upcoming_shows_count.desc()).limit(1).scalar()
+  today = todays_datetime()
+  print('%d partitions' % total)
+  print('%5s %-18s %10s %10s' % ('days', 'route', 'partitions', 'p50 ms'))
+  for days in RANGES:
+    start, end = today, today + timedelta(days=days)
+    query = 'from=%s&to=%s' % (start.date(), (end - timedelta(days=1)).date())
+    with app.app_context():
+      shows_partitions = partitions_read(start, end)
+      venue_partitions = partitions_read(start, end, 'AND s.venue_id = %d' % venue_id)
+    print('%5d %-18s %10d %10.1f' % (days, '/shows/calendar', shows_partitions,
+      latency(client, '/shows/calendar?' + query)))
+    print('%5d %-18s %10d %10.1f' % (days, '/venues/calendar', venue_partitions,
+      latency(client, '/venues/%d/calendar?%s' % (venue_id, query))))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,75 @@
+# Posts 50 venues, artists and shows from parallel threads and checks that every create
+# succeeds with a distinct id and a constant number of queries.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.concurrent_creates
+import time
+import threading
+from datetime import datetime
+
+from benchmarks.common import setup_app, count_queries
+from models import db, Venue, Artist, Show
+
+N_CREATES = 50
+
+
+def venue_form(i):
+  return {'name': 'Venue %d' % i, 'city': 'Austin', 'state': 'TX', 'address': '%d Main St' % i,
+          'phone': '', 'genres': ['Jazz'], 'seeking_description': '', 'image_link': '',
+          'facebook_link': '', 'website': ''}
+
+
+def artist_form(i):
+  return {'name': 'Artist %d' % i, 'city': 'Austin', 'state': 'TX', 'phone': '', 'genres': ['Jazz'],
+          'seeking_description': '', 'image_link': '', 'facebook_link': '', 'website': ''}
+
+
+# Posts the forms from one thread each, all at once. The exceptions of the threads, failed
+# status checks included, are raised here.
+def run_parallel(app, url, forms):
+  latencies = []
+  errors = []
+  barrier = threading.Barrier(len(forms))
+
+  def post(form):
+    try:
+      client = app.test_client()
+      barrier.wait()
+      start = time.perf_counter()
+      response = client.post(url, data=form)
+      latencies.append((time.perf_counter()-start)*1000)
+      assert response.status_code == 200, '%s: status %d' % (url, response.status_code)
+    except BaseException as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=post, args=(form,)) for form in forms]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  if errors:
+    raise errors[0]
+  return latencies
+
+
+def run(app, label, model, url, forms):
+  with app.app_context():
+    with count_queries() as counter:
+      latencies = run_parallel(app, url, forms)
+    ids = [id for id, in db.session.query(model.id)]
+  assert len(ids) == len(set(ids)) == len(forms), '%s: %d rows, %d distinct ids' % (label, len(ids), len(set(ids)))
+  latencies.sort()
+  print('%-8s %4d created, %5.1f queries/create, p50 %6.1f ms, max %6.1f ms' % (
+    label, len(ids), counter.count/len(forms), latencies[len(latencies)//2], latencies[-1]))
+  return ids
+
+
+def main():
+  app = setup_app()
+  venue_ids = run(app, 'venues', Venue, '/venues/create', [venue_form(i) for i in range(N_CREATES)])
+  artist_ids = run(app, 'artists', Artist, '/artists/create', [artist_form(i) for i in range(N_CREATES)])
+  start_time = datetime.today().strftime('%Y-%m-%d %H:%M:%S')
+  show_forms = [{'artist_id': artist_ids[i], 'venue_id': venue_ids[i], 'start_time': start_time} for i in range(N_CREATES)]
+  run(app, 'shows', Show, '/shows/create', show_forms)
+
+
+if __name__ == '__main__':
+  main()
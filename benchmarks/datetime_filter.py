@@ -0,0 +1,64 @@
+# Per-tile cost of the datetime filter on a 10k show page: the previous implementation
+# (ISO string parsed by dateutil, pattern resolved by Babel on every call) against the
+# current one, called per tile and batched with the datetimes filter.
+# Usage: python -m benchmarks.datetime_filter (no database needed)
+import random
+import time
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+from jinja2 import Environment
+
+from app import format_datetime, format_datetimes
+
+N_SHOWS = 10000
+TILE = "{% for show in shows %}<h4>{{ show.start_time|datetime('full') }}</h4>{% endfor %}"
+BATCHED_TILE = ("{% set start_times = shows|map(attribute='start_time')|datetimes('full') %}"
+  "{% for show in shows %}<h4>{{ start_times[loop.index0] }}</h4>{% endfor %}")
+
+
+def previous_format_datetime(value, format='medium'):
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+    format = "EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+    format = "EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format)
+
+
+def make_shows():
+  random.seed(0)
+  start = datetime(2026, 1, 1, 20, 0)
+  # Shows mostly start on the hour, as in real listings
+  return [{'start_time': start + timedelta(days=random.randint(0, 365), hours=random.randint(0, 3))}
+    for i in range(N_SHOWS)]
+
+
+def time_render(template, shows):
+  start = time.perf_counter()
+  template.render(shows=shows)
+  return (time.perf_counter() - start) / len(shows) * 1e6
+
+
+def main():
+  shows = make_shows()
+  iso_shows = [{'start_time': show['start_time'].isoformat()} for show in shows]
+
+  env = Environment()
+  env.filters['datetime'] = previous_format_datetime
+  previous = time_render(env.from_string(TILE), iso_shows)
+
+  env = Environment()
+  env.filters['datetime'] = format_datetime
+  env.filters['datetimes'] = format_datetimes
+  per_tile = time_render(env.from_string(TILE), shows)
+  batched = time_render(env.from_string(BATCHED_TILE), shows)
+
+  print('%-36s %8.2f us/tile' % ('before (ISO string, per tile)', previous))
+  print('%-36s %8.2f us/tile' % ('after (datetime, per tile)', per_tile))
+  print('%-36s %8.2f us/tile' % ('after (datetime, batched)', batched))
+
+
+if __name__ == '__main__':
+  main()
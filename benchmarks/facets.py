@@ -0,0 +1,96 @@
+# Plans and latency of the filters of /artists and /venues (facets.py) on the seeded data set:
+# the genre filters must use the GIN index of genres, and the facet counts must be the same
+# with the genre_mask bit tests and with the array comparisons, the former being cheaper.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.facets [--scale 1m]
+import argparse
+import json
+import time
+from urllib.parse import urlencode
+
+from sqlalchemy import select, text
+from werkzeug.datastructures import MultiDict
+
+from benchmarks.common import setup_app, count_queries
+from benchmarks.seed import SCALES, seed
+from cache import cache, NullBackend
+from facets import Filters, facet_statement
+from models import db, Venue, Artist
+
+ITERATIONS = 20
+
+# (label, query string) of the filters measured
+CASES = [
+  ('no filter', []),
+  ('rare genre', [('genre', 'Musical Theatre')]),
+  ('two genres, all', [('genre', 'Jazz'), ('genre', 'Blues')]),
+  ('two genres, any', [('genre', 'Jazz'), ('genre', 'Blues'), ('match', 'any')]),
+  ('genre and state', [('genre', 'Rock n Roll'), ('state', 'TX')]),
+]
+
+
+def median_ms(run):
+  timings = []
+  for i in range(ITERATIONS):
+    start = time.perf_counter()
+    run()
+    timings.append((time.perf_counter() - start) * 1000)
+  timings.sort()
+  return timings[len(timings) // 2]
+
+
+# Names of the indexes read by a plan
+def indexes(node):
+  names = set()
+  if 'Index Name' in node:
+    names.add(node['Index Name'])
+  for child in node.get('Plans', []):
+    names |= indexes(child)
+  return names
+
+
+def plan_indexes(statement):
+  sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+  row = db.session.execute(text('EXPLAIN (FORMAT JSON) ' + sql)).scalar()
+  plan = row if isinstance(row, list) else json.loads(row)
+  return indexes(plan[0]['Plan'])
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scale', choices=sorted(SCALES), default='100k')
+  args = parser.parse_args()
+  app = setup_app()
+  # Every request reads the database
+  cache.backend = NullBackend()
+  client = app.test_client()
+  results = []
+  with app.app_context():
+    rows = seed(SCALES[args.scale])
+    print('%d venues, %d artists' % (rows['Venue'], rows['Artist']))
+    print('%-6s %-17s %-28s %9s %9s %9s' % ('', 'filters', 'indexes', 'page ms', 'mask ms', 'array ms'))
+    for model, endpoint in [(Artist, 'artists'), (Venue, 'venues')]:
+      for label, query in CASES:
+        filters = Filters.from_args(model, MultiDict(query))
+        page = select(model.id).where(*filters.conditions()).limit(50)
+        used = plan_indexes(page)
+        # A selective genre is looked up in the GIN index
+        if label == 'rare genre':
+          results.append('ix_%s_genres' % model.__tablename__ in used)
+        mask, array = facet_statement(filters, True), facet_statement(filters, False)
+        results.append(tuple(db.session.execute(mask).one()) == tuple(db.session.execute(array).one()))
+        mask_ms = median_ms(lambda: db.session.execute(mask).one())
+        array_ms = median_ms(lambda: db.session.execute(array).one())
+        url = '/%s?%s' % (endpoint, urlencode(query))
+        with count_queries() as queries:
+          response = client.get(url)
+        results.append(response.status_code == 200)
+        page_ms = median_ms(lambda: client.get(url))
+        print('%-6s %-17s %-28s %9.1f %9.1f %9.1f  (%d queries)' % (model.__tablename__, label,
+          ','.join(sorted(used)) or 'seq scan', page_ms, mask_ms, array_ms, queries.count))
+  print('ok' if all(results) else 'FAIL')
+  if not all(results):
+    raise SystemExit(1)
+
+
+if __name__ == '__main__':
+  main()
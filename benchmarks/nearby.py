@@ -0,0 +1,111 @@
+# Latency of /venues/nearby on 100k venues (--venues) spread around the seeded cities, with the
+# earthdistance GiST index and with the in-process KD-tree (geo.py): both must return the same
+# venues as a brute-force scan. Also geocodes the venues left without coordinates from a
+# gazetteer of the seeded cities.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.nearby [--venues 100000]
+import argparse
+import math
+import random
+import time
+
+from sqlalchemy import text
+
+from benchmarks.common import setup_app, count_queries
+from benchmarks.seed import CITIES, CITY_LOCATIONS, VENUE_LOCATION_COLUMNS, venue_row, load
+from geo import Gazetteer, geocode_venues, nearby_index, to_xyz, chord_to_km, LOCATION_INDEX
+from importer import VENUE_COLUMNS
+from models import db, Venue
+
+QUERIES = 200
+# (radius km, limit) of the measured requests
+CASES = [(5, 10), (25, 50), (200, 50)]
+# Share of the venues left for the geocoder
+UNGEOCODED = 0.05
+
+
+def brute_force(points, latitude, longitude, radius_km, limit):
+  target = to_xyz(latitude, longitude)
+  found = []
+  for id, point in points:
+    distance = chord_to_km(math.sqrt(sum((a - b) ** 2 for a, b in zip(point, target))))
+    if distance <= radius_km:
+      found.append((distance, id))
+  return [id for distance, id in sorted(found)[:limit]]
+
+
+def percentile(timings, p):
+  timings = sorted(timings)
+  return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--venues', type=int, default=100000)
+  args = parser.parse_args()
+  app = setup_app()
+  rng = random.Random(42)
+  client = app.test_client()
+  results = []
+  with app.app_context():
+    counts = dict((i, (rng.randint(0, 20), 0)) for i in range(args.venues))
+    rows = [venue_row(rng, i, counts) for i in range(args.venues)]
+    for row in rows:
+      if rng.random() < UNGEOCODED:
+        row['latitude'] = row['longitude'] = None
+    load(Venue, VENUE_COLUMNS + ['upcoming_shows_count', 'past_shows_count'] + VENUE_LOCATION_COLUMNS, rows)
+
+    gazetteer = Gazetteer()
+    for city, state, weight in CITIES:
+      gazetteer.add(city, state, *CITY_LOCATIONS[city])
+    start = time.perf_counter()
+    updated, unknown = geocode_venues(gazetteer)
+    print('geocoded %d venues in %.2fs, %d cities not found' % (updated, time.perf_counter() - start, len(unknown)))
+    results.append(not unknown and db.session.query(Venue.id).filter(Venue.latitude.is_(None)).count() == 0)
+    db.session.execute(text('ANALYZE "Venue"'))
+    db.session.commit()
+
+    points = [(id, to_xyz(latitude, longitude)) for id, latitude, longitude in
+      db.session.query(Venue.id, Venue.latitude, Venue.longitude)]
+    has_index = db.session.execute(text('SELECT to_regclass(:name)'),
+      {'name': '"%s"' % LOCATION_INDEX}).scalar() is not None
+  backends = ['earthdistance', 'kdtree'] if has_index else ['kdtree']
+  if not has_index:
+    print('no %s (cube/earthdistance not available), measuring the KD-tree only' % LOCATION_INDEX)
+
+  # Around the cities, where the venues are
+  queries = []
+  for i in range(QUERIES):
+    city, state, weight = rng.choices(CITIES, [c[2] for c in CITIES])[0]
+    latitude, longitude = CITY_LOCATIONS[city]
+    queries.append((latitude + rng.gauss(0, 0.1), longitude + rng.gauss(0, 0.1)))
+
+  print('%-14s %7s %6s %9s %9s %8s' % ('backend', 'radius', 'limit', 'p50 ms', 'p99 ms', 'queries'))
+  for backend in backends:
+    nearby_index.backend = backend
+    with app.app_context():
+      start = time.perf_counter()
+      if backend == 'kdtree':
+        nearby_index.get_tree()
+        print('KD-tree of %d venues built in %.2fs' % (len(nearby_index.tree), time.perf_counter() - start))
+    for radius, limit in CASES:
+      timings = []
+      for index, (latitude, longitude) in enumerate(queries):
+        url = '/venues/nearby?lat=%f&lng=%f&radius=%d&limit=%d' % (latitude, longitude, radius, limit)
+        with app.app_context(), count_queries() as counter:
+          start = time.perf_counter()
+          response = client.get(url)
+          timings.append((time.perf_counter() - start) * 1000)
+        if index < 10:
+          ids = [venue['id'] for venue in response.get_json()['venues']]
+          expected = brute_force(points, latitude, longitude, radius, limit)
+          # Venues at the same distance may come in any order at the end of the page
+          results.append(response.status_code == 200 and set(ids[:-1]) <= set(expected) and len(ids) == len(expected))
+      print('%-14s %7d %6d %9.2f %9.2f %8d' % (backend, radius, limit, percentile(timings, 0.5),
+        percentile(timings, 0.99), counter.count))
+  print('ok' if all(results) else 'FAIL')
+  if not all(results):
+    raise SystemExit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,189 @@
+# Fires the requests recorded with TRACE_REQUESTS (see tracing.py) at a running server, keeping
+# their original spacing divided by --rate, with at most --concurrency requests in flight.
+# Reports throughput, error rate, a latency histogram and the latency of every endpoint.
+# Writes go to the target's database, point it at a staging copy or pass --read-only to replay
+# only the GETs and the search POSTs.
+# Usage: python -m benchmarks.replay request_traces.jsonl --target http://localhost:5000 --rate 4 --concurrency 100
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit, urlencode
+
+# Upper bounds of the latency histogram buckets, in ms
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def load_traces(path, read_only=False, limit=None):
+  traces = []
+  with open(path, encoding='utf-8') as f:
+    for line in f:
+      if not line.strip():
+        continue
+      trace = json.loads(line)
+      if read_only and trace['method'] != 'GET' and not trace['path'].endswith('/search'):
+        continue
+      traces.append(trace)
+  traces.sort(key=lambda trace: trace['t'])
+  return traces[:limit] if limit else traces
+
+
+class Connection:
+  # Minimal HTTP/1.1 client over asyncio streams, keeping the connection alive between requests
+
+  def __init__(self, host, port):
+    self.host = host
+    self.port = port
+    self.reader = None
+    self.writer = None
+
+  async def request(self, method, target, body=b'', headers=None):
+    if self.writer is None:
+      self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+    lines = ['%s %s HTTP/1.1' % (method, target), 'Host: %s:%d' % (self.host, self.port),
+             'Content-Length: %d' % len(body)]
+    lines.extend('%s: %s' % item for item in (headers or {}).items())
+    self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+    await self.writer.drain()
+    status_line = await self.reader.readline()
+    if not status_line:
+      raise ConnectionError('connection closed by the server')
+    status = int(status_line.split()[1])
+    response_headers = {}
+    while True:
+      line = await self.reader.readline()
+      if line in (b'\r\n', b'\n', b''):
+        break
+      name, value = line.decode('latin-1').split(':', 1)
+      response_headers[name.strip().lower()] = value.strip()
+    if 'content-length' in response_headers:
+      await self.reader.readexactly(int(response_headers['content-length']))
+    elif response_headers.get('transfer-encoding') == 'chunked':
+      while True:
+        size = int((await self.reader.readline()).split(b';')[0], 16)
+        await self.reader.readexactly(size + 2)
+        if size == 0:
+          break
+    else:
+      await self.reader.read()
+      self.close()
+    if response_headers.get('connection', '').lower() == 'close':
+      self.close()
+    return status
+
+  def close(self):
+    if self.writer is not None:
+      self.writer.close()
+    self.reader = self.writer = None
+
+
+def encode(trace):
+  target = trace['path']
+  if trace.get('query'):
+    target += '?' + urlencode(trace['query'], doseq=True)
+  body = b''
+  headers = {}
+  if trace.get('form'):
+    body = urlencode(trace['form'], doseq=True).encode('utf-8')
+    headers['Content-Type'] = 'application/x-www-form-urlencoded'
+  return trace['method'], target, body, headers
+
+
+class Results:
+  def __init__(self):
+    # (endpoint, latency ms, status or None on connection errors)
+    self.samples = []
+
+  def add(self, endpoint, latency, status):
+    self.samples.append((endpoint, latency, status))
+
+  def report(self, elapsed):
+    total = len(self.samples)
+    errors = sum(1 for endpoint, latency, status in self.samples if status is None or status >= 500)
+    latencies = sorted(latency for endpoint, latency, status in self.samples)
+    print('%d requests in %.1fs, %.1f req/s, %d errors (%.2f%%)' % (
+      total, elapsed, total / elapsed if elapsed else 0, errors, errors * 100.0 / total if total else 0))
+    if not total:
+      return
+    print('p50 %.1f ms, p90 %.1f ms, p99 %.1f ms, max %.1f ms' % (
+      percentile(latencies, 0.5), percentile(latencies, 0.9), percentile(latencies, 0.99), latencies[-1]))
+    print()
+    counts = [0] * (len(BUCKETS) + 1)
+    for latency in latencies:
+      counts[next((i for i, bound in enumerate(BUCKETS) if latency <= bound), len(BUCKETS))] += 1
+    widest = max(counts)
+    for i, count in enumerate(counts):
+      label = '<= %d ms' % BUCKETS[i] if i < len(BUCKETS) else '> %d ms' % BUCKETS[-1]
+      print('%12s %7d %s' % (label, count, '#' * int(round(count * 50.0 / widest))))
+    print()
+    print('%-28s %7s %9s %9s %7s' % ('endpoint', 'count', 'p50 ms', 'p99 ms', 'errors'))
+    by_endpoint = {}
+    for endpoint, latency, status in self.samples:
+      by_endpoint.setdefault(endpoint, []).append((latency, status))
+    for endpoint, samples in sorted(by_endpoint.items(), key=lambda item: -len(item[1])):
+      endpoint_latencies = sorted(latency for latency, status in samples)
+      print('%-28s %7d %9.1f %9.1f %7d' % (endpoint, len(samples), percentile(endpoint_latencies, 0.5),
+        percentile(endpoint_latencies, 0.99), sum(1 for latency, status in samples if status is None or status >= 500)))
+
+
+def percentile(values, q):
+  return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def replay(traces, target, rate, concurrency):
+  url = urlsplit(target)
+  connections = asyncio.Queue()
+  for i in range(concurrency):
+    connections.put_nowait(Connection(url.hostname, url.port or 80))
+  results = Results()
+
+  async def send(trace):
+    connection = await connections.get()
+    start = time.perf_counter()
+    try:
+      status = await connection.request(*encode(trace))
+    except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+      connection.close()
+      status = None
+    results.add(trace.get('endpoint') or trace['path'], (time.perf_counter() - start) * 1000, status)
+    connections.put_nowait(connection)
+
+  started = time.perf_counter()
+  first = traces[0]['t'] if traces else 0
+  tasks = []
+  for trace in traces:
+    if rate:
+      delay = (trace['t'] - first) / rate - (time.perf_counter() - started)
+      if delay > 0:
+        await asyncio.sleep(delay)
+    tasks.append(asyncio.ensure_future(send(trace)))
+  await asyncio.gather(*tasks)
+  elapsed = time.perf_counter() - started
+  while not connections.empty():
+    connections.get_nowait().close()
+  return results, elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Replay recorded request traces against a server.')
+  parser.add_argument('traces', help='JSONL file written with TRACE_REQUESTS.')
+  parser.add_argument('--target', default='http://localhost:5000')
+  parser.add_argument('--rate', type=float, default=1.0,
+    help='Speed multiplier of the recorded traffic, 0 sends everything as fast as possible.')
+  parser.add_argument('--concurrency', type=int, default=20, help='Maximum requests in flight.')
+  parser.add_argument('--repeat', type=int, default=1, help='Replay the traces that many times back to back.')
+  parser.add_argument('--limit', type=int, help='Only replay the first requests.')
+  parser.add_argument('--read-only', action='store_true', help='Skip the writes, keeping the GETs and search POSTs.')
+  args = parser.parse_args()
+
+  traces = load_traces(args.traces, args.read_only, args.limit)
+  if traces and args.repeat > 1:
+    # Every repetition starts where the previous one ended
+    span = traces[-1]['t'] - traces[0]['t'] + 1
+    traces = [dict(trace, t=trace['t'] + span * i) for i in range(args.repeat) for trace in traces]
+  results, elapsed = asyncio.run(replay(traces, args.target, args.rate, args.concurrency))
+  results.report(elapsed)
+
+
+if __name__ == '__main__':
+  main()
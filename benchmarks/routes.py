@@ -0,0 +1,197 @@
+# Drives every route of app.py through the test client against the seeded scratch database and
+# reports p50/p99 latency, queries per request and the peak RSS of the process. Results can be
+# saved and compared with a previous run:
+#   python -m benchmarks.routes --scale 100k --output before.json
+#   ... change something ...
+#   python -m benchmarks.routes --scale 100k --compare before.json
+# Queries are read from the per-endpoint counters of metrics.py, so the ones of the feed
+# refresher thread are not counted. --no-cache turns the view and fragment caches off.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.routes [--scale 1k]
+import argparse
+import io
+import json
+import resource
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import setup_app
+from benchmarks.seed import SCALES, seed
+from cache import cache, NullBackend
+from metrics import metrics
+from models import db, Venue, Artist
+
+ITERATIONS = 50
+WARMUP = 3
+
+
+def venue_form(i):
+  return {'name': 'Bench Venue %d' % i, 'city': 'Austin', 'state': 'TX', 'address': '%d Main St' % i,
+          'phone': '', 'genres': ['Jazz'], 'seeking_description': '', 'image_link': '',
+          'facebook_link': '', 'website': ''}
+
+
+def artist_form(i):
+  return {'name': 'Bench Artist %d' % i, 'city': 'Austin', 'state': 'TX', 'phone': '', 'genres': ['Jazz'],
+          'seeking_description': '', 'image_link': '', 'facebook_link': '', 'website': ''}
+
+
+IMPORT_CSV = (b'name,city,state,genres,image_link,facebook_link,website\n'
+  b'Imported %d,Austin,TX,Jazz,https://example.com/a.jpg,https://www.facebook.com/a,https://example.com\n')
+
+
+# (name, endpoint, request(client, i, ids)) of every route, ids holds a busy venue and artist
+# and the venues created by the create_venue route (deleted by the delete_venue route)
+ROUTES = [
+  ('index', 'index', lambda client, i, ids: client.get('/')),
+  ('venues', 'venues', lambda client, i, ids: client.get('/venues')),
+  ('search_venues', 'search_venues', lambda client, i, ids: client.post('/venues/search', data={'search_term': 'blue'})),
+  ('search_suggest', 'search_suggest', lambda client, i, ids: client.get('/search/suggest?q=mid')),
+  ('nearby_venues', 'nearby_venues', lambda client, i, ids: client.get('/venues/nearby?lat=30.27&lng=-97.74&radius=25')),
+  ('show_venue', 'show_venue', lambda client, i, ids: client.get('/venues/%d' % ids['venue'])),
+  ('create_venue_form', 'create_venue_form', lambda client, i, ids: client.get('/venues/create')),
+  ('create_venue', 'create_venue_submission', lambda client, i, ids: client.post('/venues/create', data=venue_form(i))),
+  ('edit_venue', 'edit_venue', lambda client, i, ids: client.get('/venues/%d/edit' % ids['venue'])),
+  ('edit_venue_submission', 'edit_venue_submission',
+    lambda client, i, ids: client.post('/venues/%d/edit' % ids['venue'], data=ids['venue_form'])),
+  ('artists', 'artists', lambda client, i, ids: client.get('/artists')),
+  ('search_artists', 'search_artists', lambda client, i, ids: client.post('/artists/search', data={'search_term': 'owls'})),
+  ('show_artist', 'show_artist', lambda client, i, ids: client.get('/artists/%d' % ids['artist'])),
+  ('edit_artist', 'edit_artist', lambda client, i, ids: client.get('/artists/%d/edit' % ids['artist'])),
+  ('edit_artist_submission', 'edit_artist_submission',
+    lambda client, i, ids: client.post('/artists/%d/edit' % ids['artist'], data=ids['artist_form'])),
+  ('create_artist_form', 'create_artist_form', lambda client, i, ids: client.get('/artists/create')),
+  ('create_artist', 'create_artist_submission', lambda client, i, ids: client.post('/artists/create', data=artist_form(i))),
+  ('shows', 'shows', lambda client, i, ids: client.get('/shows')),
+  ('shows_calendar', 'shows_calendar', lambda client, i, ids: client.get('/shows/calendar')),
+  ('venue_calendar', 'venue_calendar', lambda client, i, ids: client.get('/venues/%d/calendar' % ids['venue'])),
+  ('artist_calendar', 'artist_calendar', lambda client, i, ids: client.get('/artists/%d/calendar' % ids['artist'])),
+  ('create_shows', 'create_shows', lambda client, i, ids: client.get('/shows/create')),
+  ('create_show', 'create_show_submission', lambda client, i, ids: client.post('/shows/create', data={
+    'artist_id': ids['artist'], 'venue_id': ids['venue'], 'start_time': show_start(i)})),
+  ('cache_stats', 'cache_stats', lambda client, i, ids: client.get('/cache/stats')),
+  ('metrics', 'metrics_export', lambda client, i, ids: client.get('/metrics')),
+  ('import_artists', 'import_submission', lambda client, i, ids: client.post('/import/artists',
+    data={'file': (io.BytesIO(IMPORT_CSV % i), 'artists.csv')},
+    headers={'Authorization': 'Bearer bench'})),
+  ('export_venues', 'export', lambda client, i, ids: client.get('/export/venues.ndjson')),
+  ('delete_venue', 'delete_venue', lambda client, i, ids: client.delete('/venues/%d' % ids['created'].pop())),
+]
+
+
+# A free evening for the busy artist and venue every iteration, after the seeded shows
+def show_start(i):
+  return (datetime(2030, 1, 1, 20) + timedelta(days=i)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def percentile(values, q):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+  # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def endpoint_queries(endpoint):
+  return metrics.endpoints.get(endpoint, {}).get('queries_total', 0)
+
+
+def busiest(model):
+  return db.session.query(model.id).order_by(model.upcoming_shows_count.desc(), model.id).limit(1).scalar()
+
+
+def entity_form(model, id):
+  entity = db.session.query(model).get(id)
+  form = {column: getattr(entity, column) or '' for column in
+    ['name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link', 'website', 'seeking_description']
+    if hasattr(entity, column)}
+  form['genres'] = entity.genres or ['Jazz']
+  return form
+
+
+def run(app, iterations):
+  client = app.test_client()
+  with app.app_context():
+    ids = {'venue': busiest(Venue), 'artist': busiest(Artist), 'created': []}
+    ids['venue_form'] = entity_form(Venue, ids['venue'])
+    ids['artist_form'] = entity_form(Artist, ids['artist'])
+  results = {}
+  for name, endpoint, send in ROUTES:
+    latencies = []
+    queries = []
+    for i in range(WARMUP + iterations):
+      before = endpoint_queries(endpoint)
+      start = time.perf_counter()
+      response = send(client, i, ids)
+      # Consumes streamed bodies inside the measure
+      response.get_data()
+      elapsed = (time.perf_counter() - start) * 1000
+      assert response.status_code < 400, '%s: HTTP %d' % (name, response.status_code)
+      if name == 'create_venue':
+        with app.app_context():
+          ids['created'].append(db.session.query(Venue.id).filter(Venue.name == 'Bench Venue %d' % i).scalar())
+      if i >= WARMUP:
+        latencies.append(elapsed)
+        queries.append(endpoint_queries(endpoint) - before)
+    results[name] = {
+      'p50_ms': round(percentile(latencies, 0.5), 2),
+      'p99_ms': round(percentile(latencies, 0.99), 2),
+      'queries': round(sum(queries) / float(len(queries)), 1),
+      'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+  return results
+
+
+def report(results, baseline=None):
+  header = '%-24s %10s %10s %8s %10s' % ('route', 'p50 ms', 'p99 ms', 'queries', 'rss MB')
+  print(header + ('   %10s %10s %8s' % ('p50 diff', 'p99 diff', 'queries') if baseline else ''))
+  for name, result in results.items():
+    line = '%-24s %10.2f %10.2f %8.1f %10.1f' % (
+      name, result['p50_ms'], result['p99_ms'], result['queries'], result['peak_rss_mb'])
+    before = (baseline or {}).get(name)
+    if before:
+      line += '   %+9.0f%% %+9.0f%% %+8.1f' % (
+        change(before['p50_ms'], result['p50_ms']), change(before['p99_ms'], result['p99_ms']),
+        result['queries'] - before['queries'])
+    print(line)
+
+
+def change(before, after):
+  return (after - before) * 100.0 / before if before else 0.0
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark every route of app.py.')
+  parser.add_argument('--scale', choices=sorted(SCALES), default='1k', help='Seed the database with that many shows.')
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--iterations', type=int, default=ITERATIONS)
+  parser.add_argument('--no-cache', action='store_true', help='Turn the view and fragment caches off.')
+  parser.add_argument('--output', help='Save the results to a JSON file.')
+  parser.add_argument('--compare', help='Compare with the results saved by a previous run.')
+  args = parser.parse_args()
+
+  app = setup_app()
+  app.config['IMPORT_API_TOKEN'] = 'bench'
+  if args.no_cache:
+    cache.backend = NullBackend()
+    app.jinja_env.fragment_cache = None
+  with app.app_context():
+    seed(SCALES[args.scale], args.seed)
+  results = run(app, args.iterations)
+
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)['routes']
+  report(results, baseline)
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({'scale': args.scale, 'seed': args.seed, 'iterations': args.iterations,
+        'cache': not args.no_cache, 'routes': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,205 @@
+# Fills the scratch database with venues, artists and shows at a given scale. The data only
+# depends on --seed: cities follow their population, genres their popularity, a few venues and
+# artists get most of the shows, and shows start in the evening from a year ago to six months
+# ahead (relative to today, so the upcoming/past split is the same every day).
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.seed [--scale 100k] [--seed 42]
+import argparse
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from benchmarks.common import setup_app
+from counters import todays_datetime
+from feed import refresh_feed
+from forms import genres_choices
+from importer import load_chunk, VENUE_COLUMNS, ARTIST_COLUMNS, SHOW_COLUMNS
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_MINUTES
+from bookings import IntervalTree
+
+# Number of shows of each scale, venues and artists are a fraction of them
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+SHOWS_PER_VENUE = 20
+SHOWS_PER_ARTIST = 10
+CHUNK_SIZE = 10000
+
+# (city, state, weight), the weight is roughly the population in 100k
+CITIES = [
+  ('New York', 'NY', 84), ('Los Angeles', 'CA', 39), ('Chicago', 'IL', 27), ('Houston', 'TX', 23),
+  ('Phoenix', 'AZ', 16), ('Philadelphia', 'PA', 16), ('San Antonio', 'TX', 15), ('San Diego', 'CA', 14),
+  ('Dallas', 'TX', 13), ('Austin', 'TX', 10), ('San Francisco', 'CA', 9), ('Seattle', 'WA', 8),
+  ('Denver', 'CO', 7), ('Washington', 'DC', 7), ('Nashville', 'TN', 7), ('Boston', 'MA', 7),
+  ('Portland', 'OR', 6), ('Las Vegas', 'NV', 6), ('Detroit', 'MI', 6), ('Memphis', 'TN', 6),
+  ('Atlanta', 'GA', 5), ('Miami', 'FL', 5), ('Minneapolis', 'MN', 4), ('New Orleans', 'LA', 4),
+  ('Cleveland', 'OH', 4), ('Pittsburgh', 'PA', 3), ('Salt Lake City', 'UT', 2), ('Boise', 'ID', 2),
+  ('Burlington', 'VT', 1), ('Missoula', 'MT', 1),
+]
+
+# (latitude, longitude) of the cities, venues are spread around them like geocoded addresses
+CITY_LOCATIONS = {
+  'New York': (40.7128, -74.0060), 'Los Angeles': (34.0522, -118.2437), 'Chicago': (41.8781, -87.6298),
+  'Houston': (29.7604, -95.3698), 'Phoenix': (33.4484, -112.0740), 'Philadelphia': (39.9526, -75.1652),
+  'San Antonio': (29.4241, -98.4936), 'San Diego': (32.7157, -117.1611), 'Dallas': (32.7767, -96.7970),
+  'Austin': (30.2672, -97.7431), 'San Francisco': (37.7749, -122.4194), 'Seattle': (47.6062, -122.3321),
+  'Denver': (39.7392, -104.9903), 'Washington': (38.9072, -77.0369), 'Nashville': (36.1627, -86.7816),
+  'Boston': (42.3601, -71.0589), 'Portland': (45.5152, -122.6784), 'Las Vegas': (36.1699, -115.1398),
+  'Detroit': (42.3314, -83.0458), 'Memphis': (35.1495, -90.0490), 'Atlanta': (33.7490, -84.3880),
+  'Miami': (25.7617, -80.1918), 'Minneapolis': (44.9778, -93.2650), 'New Orleans': (29.9511, -90.0715),
+  'Cleveland': (41.4993, -81.6944), 'Pittsburgh': (40.4406, -79.9959), 'Salt Lake City': (40.7608, -111.8910),
+  'Boise': (43.6150, -116.2023), 'Burlington': (44.4759, -73.2121), 'Missoula': (46.8721, -113.9940),
+}
+# Columns of the venue rows beside VENUE_COLUMNS
+VENUE_LOCATION_COLUMNS = ['latitude', 'longitude']
+
+GENRE_WEIGHTS = {
+  'Rock n Roll': 20, 'Pop': 18, 'Hip-Hop': 15, 'Jazz': 12, 'Alternative': 12, 'Electronic': 10,
+  'Country': 9, 'R&B': 8, 'Blues': 7, 'Folk': 7, 'Soul': 6, 'Punk': 6, 'Heavy Metal': 5,
+  'Funk': 5, 'Reggae': 4, 'Classical': 4, 'Instrumental': 3, 'Musical Theatre': 2, 'Other': 2,
+}
+GENRES = [genre for genre, label in genres_choices]
+
+VENUE_WORDS = (['The', 'Old', 'Blue', 'Red', 'Golden', 'Velvet', 'Silver', 'Little', 'Grand', 'Hidden'],
+  ['Note', 'Room', 'Hall', 'Tavern', 'Lounge', 'Garage', 'Theatre', 'Cellar', 'Ballroom', 'Saloon', 'Pavilion'])
+ARTIST_WORDS = (['Electric', 'Midnight', 'Wild', 'Lonesome', 'Crimson', 'Neon', 'Broken', 'Howling', 'Quiet', 'Brass'],
+  ['Owls', 'Rivers', 'Kings', 'Ghosts', 'Strangers', 'Machines', 'Horses', 'Saints', 'Echoes', 'Pilots', 'Tigers'])
+
+
+# Cumulative weights of n items, the item of rank r weighs 1/(r+1)^skew
+def zipf_weights(n, skew=0.8):
+  return list(itertools.accumulate(1.0 / (rank + 1) ** skew for rank in range(n)))
+
+
+def pick_genres(rng):
+  weights = [GENRE_WEIGHTS.get(genre, 1) for genre in GENRES]
+  genres = set(rng.choices(GENRES, weights, k=rng.choice([1, 1, 2, 2, 3])))
+  return sorted(genres)
+
+
+def name(rng, words, i):
+  first, second = words
+  return '{0} {1} {2}'.format(rng.choice(first), rng.choice(second), i)
+
+
+def venue_row(rng, i, counts):
+  city, state, weight = rng.choices(CITIES, [c[2] for c in CITIES])[0]
+  seeking = rng.random() < 0.3
+  upcoming, past = counts.get(i, (0, 0))
+  latitude, longitude = CITY_LOCATIONS[city]
+  return {
+    'name': name(rng, VENUE_WORDS, i), 'city': city, 'state': state,
+    'address': '{0} {1} St'.format(rng.randint(1, 9999), rng.choice(['Main', 'Oak', 'Pine', 'Elm', 'Market'])),
+    'phone': '{0:03d}-{1:03d}-{2:04d}'.format(rng.randint(200, 999), rng.randint(200, 999), rng.randint(0, 9999)),
+    'image_link': 'https://images.example.com/venues/{0}.jpg'.format(i),
+    'facebook_link': 'https://www.facebook.com/venue{0}'.format(i),
+    'genres': pick_genres(rng), 'website': 'https://venue{0}.example.com'.format(i),
+    'seeking_talent': seeking, 'seeking_description': 'Looking for local bands' if seeking else None,
+    'upcoming_shows_count': upcoming, 'past_shows_count': past,
+    'latitude': latitude + rng.gauss(0, 0.1), 'longitude': longitude + rng.gauss(0, 0.1),
+  }
+
+
+def artist_row(rng, i, counts):
+  city, state, weight = rng.choices(CITIES, [c[2] for c in CITIES])[0]
+  seeking = rng.random() < 0.4
+  upcoming, past = counts.get(i, (0, 0))
+  return {
+    'name': name(rng, ARTIST_WORDS, i), 'city': city, 'state': state,
+    'phone': '{0:03d}-{1:03d}-{2:04d}'.format(rng.randint(200, 999), rng.randint(200, 999), rng.randint(0, 9999)),
+    'genres': pick_genres(rng), 'image_link': 'https://images.example.com/artists/{0}.jpg'.format(i),
+    'facebook_link': 'https://www.facebook.com/artist{0}'.format(i),
+    'seeking_venue': seeking, 'seeking_description': 'Touring next season' if seeking else None,
+    'website': 'https://artist{0}.example.com'.format(i),
+    'upcoming_shows_count': upcoming, 'past_shows_count': past,
+  }
+
+
+# [(artist index, venue index, start_time)], busy venues and artists first. A show can't
+# overlap another show of its artist or venue (bookings.py): it is moved to another evening,
+# then to another artist and venue once five evenings were taken.
+def generate_shows(rng, n_shows, n_venues, n_artists):
+  today = todays_datetime()
+  venue_weights = zipf_weights(n_venues)
+  artist_weights = zipf_weights(n_artists)
+  duration = timedelta(minutes=DEFAULT_SHOW_MINUTES)
+  # ('artist' or 'venue', index) -> IntervalTree of its shows
+  booked = {}
+  shows = []
+  while len(shows) < n_shows:
+    artist = rng.choices(range(n_artists), cum_weights=artist_weights)[0]
+    venue = rng.choices(range(n_venues), cum_weights=venue_weights)[0]
+    trees = [booked.setdefault(key, IntervalTree(seed=len(booked))) for key in [('artist', artist), ('venue', venue)]]
+    for attempt in range(5):
+      day = rng.randint(-365, 180)
+      start_time = today + timedelta(days=day, hours=rng.choice([18, 19, 20, 20, 21, 21, 22]),
+        minutes=rng.choice([0, 0, 30]))
+      if not any(tree.overlapping(start_time, start_time + duration) for tree in trees):
+        for tree in trees:
+          tree.add(start_time, start_time + duration)
+        shows.append((artist, venue, start_time))
+        break
+  return shows
+
+
+# {index: (upcoming, past)} of the venues (position 1) or artists (position 0) of shows
+def count_shows(shows, position):
+  today = todays_datetime()
+  counts = {}
+  for show in shows:
+    upcoming, past = counts.get(show[position], (0, 0))
+    if show[2] >= today:
+      upcoming += 1
+    else:
+      past += 1
+    counts[show[position]] = (upcoming, past)
+  return counts
+
+
+def load(model, columns, rows):
+  for start in range(0, len(rows), CHUNK_SIZE):
+    load_chunk(model, columns, rows[start:start+CHUNK_SIZE])
+  db.session.commit()
+
+
+# Seeds the (empty) tables, returns {table: rows}
+def seed(n_shows, seed=42):
+  rng = random.Random(seed)
+  n_venues = max(n_shows // SHOWS_PER_VENUE, 10)
+  n_artists = max(n_shows // SHOWS_PER_ARTIST, 20)
+  shows = generate_shows(rng, n_shows, n_venues, n_artists)
+
+  counter_columns = ['upcoming_shows_count', 'past_shows_count']
+  venue_counts = count_shows(shows, 1)
+  load(Venue, VENUE_COLUMNS + counter_columns + VENUE_LOCATION_COLUMNS, [venue_row(rng, i, venue_counts) for i in range(n_venues)])
+  artist_counts = count_shows(shows, 0)
+  load(Artist, ARTIST_COLUMNS + counter_columns, [artist_row(rng, i, artist_counts) for i in range(n_artists)])
+
+  # Rows are copied in order, so the i-th id belongs to the i-th row
+  venue_ids = [id for id, in db.session.query(Venue.id).order_by(Venue.id)]
+  artist_ids = [id for id, in db.session.query(Artist.id).order_by(Artist.id)]
+  load(Show, SHOW_COLUMNS, [
+    {'artist_id': artist_ids[artist], 'venue_id': venue_ids[venue], 'start_time': start_time,
+     'duration_minutes': DEFAULT_SHOW_MINUTES}
+    for artist, venue, start_time in shows])
+  refresh_feed(concurrently=False)
+  db.session.execute(text('ANALYZE'))
+  db.session.commit()
+  return {'Venue': n_venues, 'Artist': n_artists, 'Show': n_shows}
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Seed the benchmark database.')
+  parser.add_argument('--scale', choices=sorted(SCALES), default='1k', help='Number of shows.')
+  parser.add_argument('--seed', type=int, default=42)
+  args = parser.parse_args()
+  app = setup_app()
+  with app.app_context():
+    start = time.perf_counter()
+    rows = seed(SCALES[args.scale], args.seed)
+    elapsed = time.perf_counter() - start
+  print(', '.join('%s: %d' % item for item in rows.items()) + ' rows in %.1fs' % elapsed)
+
+
+if __name__ == '__main__':
+  main()
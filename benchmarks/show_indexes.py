@@ -0,0 +1,78 @@
+# Compares the query plans and latency of the Show queries with and without the indexes
+# declared in Show.__table_args__, on a table seeded with 1M shows.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.show_indexes [n_shows]
+import sys
+import json
+from datetime import datetime
+
+from sqlalchemy import text
+
+from benchmarks.common import setup_app
+from models import db, Show
+
+N_VENUES = 5000
+N_ARTISTS = 20000
+
+QUERIES = {
+  'venue timeline': 'SELECT * FROM "Show" WHERE venue_id = 42 ORDER BY start_time',
+  'artist timeline': 'SELECT * FROM "Show" WHERE artist_id = 42 ORDER BY start_time',
+  'venue upcoming count': 'SELECT count(*) FROM "Show" WHERE venue_id = 42 AND start_time >= :today',
+  'upcoming feed': 'SELECT * FROM "Show" WHERE start_time >= :today ORDER BY start_time LIMIT 50',
+}
+
+
+def seed(n_shows):
+  db.session.execute(text('''
+    INSERT INTO "Venue" (id, name, city, state)
+    SELECT i, 'Venue ' || i, 'City ' || (i % 300), 'CA' FROM generate_series(1, :n) i
+  '''), {'n': N_VENUES})
+  db.session.execute(text('''
+    INSERT INTO "Artist" (id, name, city, state)
+    SELECT i, 'Artist ' || i, 'City ' || (i % 300), 'CA' FROM generate_series(1, :n) i
+  '''), {'n': N_ARTISTS})
+  # Shows overlapping another show of their artist or venue are left out (bookings.py)
+  db.session.execute(text('''
+    INSERT INTO "Show" (artist_id, venue_id, start_time)
+    SELECT 1 + (random() * (:artists - 1))::int, 1 + (random() * (:venues - 1))::int,
+           now() - interval '2 years' + random() * interval '3 years'
+    FROM generate_series(1, :n)
+    ON CONFLICT DO NOTHING
+  '''), {'n': n_shows, 'artists': N_ARTISTS, 'venues': N_VENUES})
+  db.session.commit()
+
+
+def explain(sql):
+  today = datetime(datetime.today().year, datetime.today().month, datetime.today().day)
+  row = db.session.execute(text('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql), {'today': today}).scalar()
+  plan = row if isinstance(row, list) else json.loads(row)
+  plan = plan[0]
+  node = plan['Plan']
+  # The interesting node is the one reading "Show"
+  while 'Plans' in node and 'Relation Name' not in node:
+    node = node['Plans'][0]
+  return node['Node Type'], plan['Execution Time']
+
+
+def run(label):
+  db.session.execute(text('ANALYZE "Show"'))
+  for name, sql in QUERIES.items():
+    node_type, ms = explain(sql)
+    print('%-8s %-22s %-28s %10.2f ms' % (label, name, node_type, ms))
+
+
+def main():
+  n_shows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+  app = setup_app()
+  with app.app_context():
+    seed(n_shows)
+    indexes = list(Show.__table__.indexes)
+    for index in indexes:
+      index.drop(bind=db.engine)
+    run('before')
+    for index in indexes:
+      index.create(bind=db.engine)
+    run('after')
+
+
+if __name__ == '__main__':
+  main()
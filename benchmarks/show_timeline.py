@@ -0,0 +1,49 @@
+# Shows that /venues/<id> and /artists/<id> issue the same number of queries whatever the
+# number of shows of the venue or artist.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.show_timeline
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import setup_app, count_queries
+from models import db, Venue, Artist, Show
+
+SIZES = [10, 200, 2000]
+
+
+def seed(n_shows):
+  db.session.query(Show).delete()
+  db.session.query(Venue).delete()
+  db.session.query(Artist).delete()
+  venue = Venue(name='Bench Venue', city='Austin', state='TX')
+  artists = [Artist(name='Artist %d' % i, city='Austin', state='TX') for i in range(50)]
+  db.session.add(venue)
+  db.session.add_all(artists)
+  db.session.flush()
+  now = datetime.today()
+  db.session.add_all([
+    Show(artist_id=artists[i % len(artists)].id, venue_id=venue.id, start_time=now+timedelta(days=i-n_shows//2))
+    for i in range(n_shows)
+  ])
+  db.session.commit()
+  return venue.id, artists[0].id
+
+
+def main():
+  app = setup_app()
+  client = app.test_client()
+  print('%8s %-22s %8s %10s' % ('shows', 'route', 'queries', 'ms'))
+  for size in SIZES:
+    with app.app_context():
+      venue_id, artist_id = seed(size)
+    for url in ['/venues/%d' % venue_id, '/artists/%d' % artist_id]:
+      with app.app_context():
+        with count_queries() as counter:
+          start = time.perf_counter()
+          response = client.get(url)
+          elapsed = (time.perf_counter()-start)*1000
+      assert response.status_code == 200
+      print('%8d %-22s %8d %10.1f' % (size, url, counter.count, elapsed))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,51 @@
+# Shows that /venues issues the same number of queries whatever the number of venues.
+# Usage: FYYUR_BENCH_DATABASE_URI=postgresql://... python -m benchmarks.venue_directory
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import setup_app, count_queries
+from models import db, Venue, Artist, Show
+
+SIZES = [100, 1000, 5000]
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Seattle', 'WA'), ('Chicago', 'IL')]
+
+
+def seed(n_venues):
+  db.session.query(Show).delete()
+  db.session.query(Venue).delete()
+  db.session.query(Artist).delete()
+  artist = Artist(name='Bench Artist', city='Austin', state='TX')
+  db.session.add(artist)
+  db.session.flush()
+  venues = []
+  for i in range(n_venues):
+    city, state = CITIES[i % len(CITIES)]
+    venues.append(Venue(name='Venue %d' % i, city=city, state=state))
+  db.session.add_all(venues)
+  db.session.flush()
+  now = datetime.today()
+  # Three hours apart, the artist can't play two shows at once (bookings.py)
+  db.session.add_all([
+    Show(artist_id=artist.id, venue_id=venue.id, start_time=now+timedelta(hours=3 * (i - n_venues // 2)))
+    for i, venue in enumerate(venues)
+  ])
+  db.session.commit()
+
+
+def main():
+  app = setup_app()
+  client = app.test_client()
+  print('%8s %8s %10s' % ('venues', 'queries', 'ms'))
+  for size in SIZES:
+    with app.app_context():
+      seed(size)
+      with count_queries() as counter:
+        start = time.perf_counter()
+        response = client.get('/venues')
+        elapsed = (time.perf_counter()-start)*1000
+    assert response.status_code == 200
+    print('%8d %8d %10.1f' % (size, counter.count, elapsed))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,207 @@
+import random
+from datetime import timedelta
+from sqlalchemy import DDL, event, func, or_
+from sqlalchemy.exc import IntegrityError
+from models import db, Show, MAX_SHOW_MINUTES
+
+#----------------------------------------------------------------------------#
+# Booking conflicts.
+#----------------------------------------------------------------------------#
+
+# A show books its artist and its venue from start_time for duration_minutes, and two shows
+# of an artist, or at a venue, can't overlap. Every partition of the Show table (see
+# partitions.py) enforces it with an exclusion constraint per column on Show.period, each backed
+# by a GiST index. Those can't see the other partitions, so the show_booking_check() trigger
+# of "Show" also looks for overlaps across months, after taking a transaction advisory lock per
+# artist and per venue: concurrent bookings of an artist or a venue wait for each other and the
+# second one sees the first. Both report an exclusion_violation. find_conflicts() uses the same
+# GiST indexes to list the shows overlapping a new one in logarithmic time. Its start_time
+# bounds (no show lasts more than MAX_SHOW_MINUTES, a CHECK constraint) let the planner read
+# only the partitions of those months. Bulk imports check their rows against an in-memory
+# IntervalTree per artist and venue instead (BookingIndex), loaded with one query per chunk,
+# and report every conflicting row.
+
+# SQLSTATE of exclusion_violation
+EXCLUSION_VIOLATION = '23P01'
+
+def show_end(start_time, duration_minutes):
+  return start_time + timedelta(minutes=duration_minutes)
+
+# Conditions of the shows overlapping [start, end), start_time ones for partition pruning
+def overlapping(start, end):
+  return [Show.start_time < end, Show.start_time > start - timedelta(minutes=MAX_SHOW_MINUTES),
+    Show.period.op('&&')(func.tsrange(start, end))]
+
+def conflict_message(kind, id, start, end, label):
+  return '{0} {1} is booked from {2:%Y-%m-%d %H:%M} to {3:%Y-%m-%d %H:%M} ({4})'.format(
+    kind.capitalize(), id, start, end, label)
+
+def is_booking_conflict(error):
+  return isinstance(error, IntegrityError) and getattr(error.orig, 'pgcode', None) == EXCLUSION_VIOLATION
+
+# Rejects a show overlapping another show of its artist or venue, in any partition. The
+# artist lock is always taken before the venue lock; a transaction inserting many shows (a
+# bulk import chunk) can still deadlock with another one, and Postgres then aborts one of them.
+BOOKING_CHECK_FUNCTION = DDL('''
+CREATE OR REPLACE FUNCTION show_booking_check() RETURNS trigger AS $$
+DECLARE
+  conflict record;
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('Show.artist_id'), NEW.artist_id);
+  PERFORM pg_advisory_xact_lock(hashtext('Show.venue_id'), NEW.venue_id);
+  SELECT id, artist_id, venue_id INTO conflict FROM "Show"
+  WHERE (artist_id = NEW.artist_id OR venue_id = NEW.venue_id)
+    AND start_time < upper(NEW.period) AND start_time > NEW.start_time - interval '{0} minutes'
+    AND period && NEW.period AND id <> NEW.id
+  LIMIT 1;
+  IF FOUND THEN
+    RAISE EXCEPTION 'show % overlaps show % of artist % at venue %', NEW.id, conflict.id,
+      conflict.artist_id, conflict.venue_id USING ERRCODE = 'exclusion_violation';
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''.format(MAX_SHOW_MINUTES))
+# Cloned to every partition, present and future
+BOOKING_CHECK_TRIGGER = DDL('''
+CREATE TRIGGER "Show_booking_check" AFTER INSERT OR UPDATE OF start_time, duration_minutes, artist_id, venue_id
+ON "Show" FOR EACH ROW EXECUTE FUNCTION show_booking_check()
+''')
+
+event.listen(Show.__table__, 'before_create', BOOKING_CHECK_FUNCTION)
+event.listen(Show.__table__, 'after_create', BOOKING_CHECK_TRIGGER)
+
+class IntervalNode:
+  __slots__ = ('start', 'end', 'value', 'priority', 'max_end', 'left', 'right')
+
+  def __init__(self, start, end, value, priority):
+    self.start = start
+    self.end = end
+    self.value = value
+    self.priority = priority
+    self.max_end = end
+    self.left = None
+    self.right = None
+
+  def update(self):
+    self.max_end = self.end
+    for child in (self.left, self.right):
+      if child is not None and child.max_end > self.max_end:
+        self.max_end = child.max_end
+
+# Half-open intervals [start, end) in a treap ordered by start, every node keeping the
+# largest end of its subtree: inserts and overlap lookups take O(log n) (plus the number
+# of overlaps found) on average.
+class IntervalTree:
+  def __init__(self, seed=None):
+    self.root = None
+    self.size = 0
+    self.random = random.Random(seed)
+
+  def add(self, start, end, value=None):
+    self.root = self.insert(self.root, IntervalNode(start, end, value, self.random.random()))
+    self.size += 1
+
+  def insert(self, node, new):
+    if node is None:
+      return new
+    if new.start < node.start:
+      node.left = self.insert(node.left, new)
+      if node.left.priority > node.priority:
+        node = self.rotate_right(node)
+    else:
+      node.right = self.insert(node.right, new)
+      if node.right.priority > node.priority:
+        node = self.rotate_left(node)
+    node.update()
+    return node
+
+  def rotate_right(self, node):
+    left = node.left
+    node.left = left.right
+    left.right = node
+    node.update()
+    left.update()
+    return left
+
+  def rotate_left(self, node):
+    right = node.right
+    node.right = right.left
+    right.left = node
+    node.update()
+    right.update()
+    return right
+
+  # [(start, end, value)] of the intervals overlapping [start, end), ordered by start
+  def overlapping(self, start, end):
+    found = []
+    stack = [self.root]
+    while stack:
+      node = stack.pop()
+      # Nothing in this subtree ends after start
+      if node is None or node.max_end <= start:
+        continue
+      # The right subtree starts at or after node.start
+      if node.start < end:
+        stack.append(node.right)
+        if node.end > start:
+          found.append((node.start, node.end, node.value))
+      stack.append(node.left)
+    return sorted(found, key=lambda interval: interval[0])
+
+  def __len__(self):
+    return self.size
+
+# Shows (with their id, artist, venue, start and end) of the artist or the venue overlapping
+# [start_time, start_time + duration_minutes)
+def find_conflicts(artist_id, venue_id, start_time, duration_minutes):
+  return db.session.query(Show.id, Show.artist_id, Show.venue_id, Show.start_time, Show.duration_minutes)\
+    .filter(or_(Show.artist_id==artist_id, Show.venue_id==venue_id),
+      *overlapping(start_time, show_end(start_time, duration_minutes)))\
+    .order_by(Show.start_time).all()
+
+# One message per conflict of find_conflicts()
+def conflict_messages(artist_id, venue_id, conflicts):
+  messages = []
+  for show in conflicts:
+    end = show_end(show.start_time, show.duration_minutes)
+    for kind, id in [('artist', artist_id), ('venue', venue_id)]:
+      if getattr(show, kind + '_id') == int(id):
+        messages.append(conflict_message(kind, id, show.start_time, end, 'show {0}'.format(show.id)))
+  return messages
+
+# Interval trees of the bookings of a set of artists and venues, for checking many shows
+# at once: the shows already in the table, then every show added
+class BookingIndex:
+  def __init__(self):
+    # ('artist' or 'venue', id) -> IntervalTree
+    self.trees = {}
+
+  def tree(self, kind, id):
+    tree = self.trees.get((kind, id))
+    if tree is None:
+      tree = self.trees[(kind, id)] = IntervalTree(seed=id)
+    return tree
+
+  # Loads the shows of artist_ids or venue_ids overlapping [start, end) with one query
+  def load(self, artist_ids, venue_ids, start, end):
+    if not artist_ids and not venue_ids:
+      return
+    shows = db.session.query(Show.id, Show.artist_id, Show.venue_id, Show.start_time, Show.duration_minutes)\
+      .filter(or_(Show.artist_id.in_(artist_ids), Show.venue_id.in_(venue_ids)), *overlapping(start, end))
+    for show in shows:
+      self.add(show.artist_id, show.venue_id, show.start_time, show_end(show.start_time, show.duration_minutes),
+        'show {0}'.format(show.id))
+
+  def add(self, artist_id, venue_id, start, end, label):
+    self.tree('artist', artist_id).add(start, end, label)
+    self.tree('venue', venue_id).add(start, end, label)
+
+  # Messages of the bookings the show would overlap, empty when it can be added
+  def conflicts(self, artist_id, venue_id, start, end):
+    messages = []
+    for kind, id in [('artist', artist_id), ('venue', venue_id)]:
+      tree = self.trees.get((kind, id))
+      for booked_start, booked_end, label in tree.overlapping(start, end) if tree else []:
+        messages.append(conflict_message(kind, id, booked_start, booked_end, label))
+    return messages
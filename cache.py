@@ -0,0 +1,287 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import g, has_request_context
+
+#----------------------------------------------------------------------------#
+# View cache.
+#----------------------------------------------------------------------------#
+
+# Caches the data the listing and detail views pass to their templates. Every entry is tagged
+# with the entities it was built from ("venue:1", "artist-shows:4", "venue-list", ...) and the
+# create/edit/delete handlers invalidate the tags they touch. Entries never outlive the local
+# midnight, when upcoming shows become past shows.
+#
+# CACHE_TYPE selects the backend: 'memory' (in-process LRU, the default), 'redis' (needs the
+# redis package and CACHE_REDIS_URL) or 'null' (no caching).
+#
+# The cache also keeps version counters, bumped when tags are invalidated: with redis they are
+# shared by every worker like the entries, otherwise they are in-process. The entries use them
+# to not store a value when one of its tags was invalidated while it was being built (from
+# rows read before the write), and so do the caches built from the same entities outside of
+# it, the template fragments (fragment_cache.py) and the KD-tree of /venues/nearby (geo.py).
+# With read replicas, the entries built from a replica are not stored either for
+# REPLICA_READ_YOUR_WRITES_SECONDS after an invalidation, the replica may not have the write.
+
+# Seconds left until the next local midnight
+def seconds_until_midnight(now=None):
+  now = now or datetime.now()
+  midnight = datetime(now.year, now.month, now.day) + timedelta(days=1)
+  return max(int((midnight - now).total_seconds()), 1)
+
+class CacheStats:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.counters = dict.fromkeys(['hits', 'misses', 'sets', 'stale_sets', 'invalidations'], 0)
+
+  def incr(self, name, amount=1):
+    with self.lock:
+      self.counters[name] += amount
+
+  def to_dict(self):
+    with self.lock:
+      return dict(self.counters)
+
+class NullBackend:
+  def get(self, key):
+    return None
+
+  def set(self, key, value, ttl, tags):
+    pass
+
+  def invalidate(self, tags):
+    return 0
+
+  def clear(self):
+    pass
+
+  def __len__(self):
+    return 0
+
+class MemoryBackend:
+  def __init__(self, max_entries=1000):
+    self.max_entries = max_entries
+    self.lock = threading.Lock()
+    # key -> (expires, value, tags), least recently used first
+    self.entries = OrderedDict()
+    # tag -> set of keys
+    self.tags = {}
+    self.evictions = 0
+    # name -> version counter, never evicted nor cleared, so a version is never reused
+    self.counters = {}
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      if entry[0] <= time.monotonic():
+        self.delete_locked(key)
+        return None
+      self.entries.move_to_end(key)
+      return entry[1]
+
+  def set(self, key, value, ttl, tags):
+    with self.lock:
+      self.delete_locked(key)
+      self.entries[key] = (time.monotonic() + ttl, value, tags)
+      for tag in tags:
+        self.tags.setdefault(tag, set()).add(key)
+      while len(self.entries) > self.max_entries:
+        self.delete_locked(next(iter(self.entries)))
+        self.evictions += 1
+
+  def invalidate(self, tags):
+    count = 0
+    with self.lock:
+      for tag in tags:
+        for key in list(self.tags.get(tag, ())):
+          self.delete_locked(key)
+          count += 1
+    return count
+
+  def delete_locked(self, key):
+    entry = self.entries.pop(key, None)
+    if entry is None:
+      return
+    for tag in entry[2]:
+      keys = self.tags.get(tag)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del self.tags[tag]
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.tags.clear()
+
+  def incr(self, name):
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + 1
+      return self.counters[name]
+
+  def get_counters(self, names):
+    with self.lock:
+      return [self.counters.get(name, 0) for name in names]
+
+  def __len__(self):
+    return len(self.entries)
+
+class RedisBackend:
+  def __init__(self, url, prefix='fyyur:'):
+    import redis
+    self.client = redis.Redis.from_url(url)
+    self.prefix = prefix
+
+  def get(self, key):
+    data = self.client.get(self.prefix + key)
+    return pickle.loads(data) if data is not None else None
+
+  def set(self, key, value, ttl, tags):
+    pipe = self.client.pipeline()
+    pipe.setex(self.prefix + key, ttl, pickle.dumps(value))
+    for tag in tags:
+      pipe.sadd(self.prefix + 'tag:' + tag, key)
+      pipe.expire(self.prefix + 'tag:' + tag, ttl)
+    pipe.execute()
+
+  def invalidate(self, tags):
+    keys = set()
+    for tag in tags:
+      keys.update(key.decode('utf-8') for key in self.client.smembers(self.prefix + 'tag:' + tag))
+    pipe = self.client.pipeline()
+    for key in keys:
+      pipe.delete(self.prefix + key)
+    for tag in tags:
+      pipe.delete(self.prefix + 'tag:' + tag)
+    pipe.execute()
+    return len(keys)
+
+  # The counters survive, so a version is never reused
+  def clear(self):
+    counters = (self.prefix + 'counter:').encode('utf-8')
+    for key in self.client.scan_iter(self.prefix + '*'):
+      if not key.startswith(counters):
+        self.client.delete(key)
+
+  def incr(self, name):
+    return self.client.incr(self.prefix + 'counter:' + name)
+
+  def get_counters(self, names):
+    return [int(value or 0) for value in self.client.mget([self.prefix + 'counter:' + name for name in names])]
+
+  def __len__(self):
+    return sum(1 for key in self.client.scan_iter(self.prefix + '*') if b':tag:' not in key and b':counter:' not in key)
+
+class ViewCache:
+  def __init__(self):
+    self.backend = NullBackend()
+    self.default_ttl = 300
+    self.stats = CacheStats()
+    # Called with the invalidated tags, or None when the cache is cleared
+    self.on_invalidate = []
+    # Backend of the version counters
+    self.versions = MemoryBackend()
+    # Seconds after an invalidation during which the entries built from a replica are stale
+    self.replica_window = 0
+
+  def init_app(self, app):
+    cache_type = app.config.get('CACHE_TYPE', 'memory')
+    if cache_type == 'memory':
+      self.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', 1000))
+    elif cache_type == 'redis':
+      self.backend = RedisBackend(app.config['CACHE_REDIS_URL'], app.config.get('CACHE_KEY_PREFIX', 'fyyur:'))
+    else:
+      self.backend = NullBackend()
+    self.versions = self.backend if cache_type == 'redis' else MemoryBackend()
+    self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', 300)
+    if app.config.get('REPLICA_DATABASE_URIS'):
+      self.replica_window = app.config.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5)
+
+  # Names and values of the version counters of tags, read before building an entry. The tags
+  # known after the build only (a function) are covered by the counter of every invalidation.
+  def versions_before(self, tags):
+    if callable(tags):
+      names = ['view:any']
+    else:
+      names = ['view:clear'] + ['view:' + tag for tag in set(tags)]
+    return names, self.get_versions(names)
+
+  # Stores a built value, unless its tags were invalidated since versions_before() or it was
+  # read from a replica that may not have the last write yet
+  def store(self, key, value, tags, versions):
+    names, before = versions
+    stale = self.get_versions(names) != before
+    if not stale and self.replica_window and has_request_context() and g.get('replica_bind_key'):
+      stale = self.versions.get('view:written') is not None
+    if stale:
+      self.stats.incr('stale_sets')
+      return
+    if callable(tags):
+      tags = tags(value)
+    self.backend.set(key, value, min(self.default_ttl, seconds_until_midnight()), list(set(tags)))
+    self.stats.incr('sets')
+
+  # Returns the cached value of key, or builds it with builder() and caches it under tags.
+  # tags may be a function of the built value, for entries depending on what they contain.
+  def get_or_build(self, key, tags, builder):
+    value = self.backend.get(key)
+    if value is not None:
+      self.stats.incr('hits')
+      return value
+    self.stats.incr('misses')
+    versions = self.versions_before(tags)
+    value = builder()
+    self.store(key, value, tags, versions)
+    return value
+
+  # get_or_build for the async views (asgi.py), builder() returns an awaitable
+  async def get_or_build_async(self, key, tags, builder):
+    value = self.backend.get(key)
+    if value is not None:
+      self.stats.incr('hits')
+      return value
+    self.stats.incr('misses')
+    versions = self.versions_before(tags)
+    value = await builder()
+    self.store(key, value, tags, versions)
+    return value
+
+  # The versions are bumped before the entries are dropped, a build that read the old rows
+  # sees them moved either way
+  def invalidate(self, *tags):
+    self.bump_versions(['view:' + tag for tag in set(tags)])
+    self.stats.incr('invalidations', self.backend.invalidate(tags))
+    for listener in self.on_invalidate:
+      listener(tags)
+
+  def clear(self):
+    self.bump_versions(['view:clear'])
+    self.backend.clear()
+    for listener in self.on_invalidate:
+      listener(None)
+
+  def bump_versions(self, names):
+    for name in names + ['view:any']:
+      self.versions.incr(name)
+    if self.replica_window:
+      self.versions.set('view:written', True, self.replica_window, [])
+
+  # Bumps the version counter name, returns its new value
+  def incr_version(self, name):
+    return self.versions.incr(name)
+
+  # The current values of the version counters names, 0 for the ones never bumped
+  def get_versions(self, names):
+    return self.versions.get_counters(names)
+
+  def to_dict(self):
+    data = self.stats.to_dict()
+    data['evictions'] = getattr(self.backend, 'evictions', 0)
+    data['entries'] = len(self.backend)
+    return data
+
+cache = ViewCache()
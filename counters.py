@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, bindparam
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+# Venue and Artist carry denormalized upcoming_shows_count/past_shows_count columns so the
+# listing pages don't count shows per row. They are updated in the transaction that creates or
+# deletes shows, moved from upcoming to past by "flask counters rollover" (run it from cron
+# right after midnight) and checked against the Show table by "flask counters reconcile".
+# Creates add deltas; deletes recount their venues and artists from the table, see
+# record_deleted_shows().
+
+def todays_datetime():
+  today = datetime.today()
+  return datetime(today.year, today.month, today.day)
+
+# Adds delta to the counters of the venues and artists of shows, a list of
+# (artist_id, venue_id, start_time). One executemany per table, in the caller's transaction.
+def update_counters(shows, delta=1):
+  today = todays_datetime()
+  for model, index in [(Artist, 0), (Venue, 1)]:
+    counts = {}
+    for show in shows:
+      upcoming, past = counts.get(int(show[index]), (0, 0))
+      if show[2] >= today:
+        upcoming += delta
+      else:
+        past += delta
+      counts[int(show[index])] = (upcoming, past)
+    if not counts:
+      continue
+    table = model.__table__
+    db.session.execute(
+      table.update().where(table.c.id==bindparam('counted_id')).values(
+        upcoming_shows_count=table.c.upcoming_shows_count + bindparam('upcoming'),
+        past_shows_count=table.c.past_shows_count + bindparam('past')),
+      [{'counted_id': id, 'upcoming': upcoming, 'past': past} for id, (upcoming, past) in counts.items()])
+
+def record_created_shows(shows):
+  update_counters(shows, 1)
+
+# Recounts the venues and artists of shows, a list of (artist_id, venue_id, start_time), once
+# the shows are deleted. A delta would classify a show of yesterday against today when the
+# rollover hasn't run yet, and the rollover only recounts from the remaining shows, so the
+# upcoming counter would stay one too high. The rows are locked first (in id order), so a
+# concurrent create either is counted or adds its delta after the recount.
+def record_deleted_shows(shows):
+  for model, fk, index in [(Artist, Show.artist_id, 0), (Venue, Show.venue_id, 1)]:
+    ids = sorted(set(int(show[index]) for show in shows))
+    if ids:
+      db.session.query(model.id).filter(model.id.in_(ids)).order_by(model.id).with_for_update().all()
+      recount(model, fk, ids)
+
+# The true counters of model for ids: {id: (upcoming, past)}
+def count_shows(model, fk, ids):
+  today = todays_datetime()
+  rows = db.session.query(
+      fk,
+      func.count(Show.id).filter(Show.start_time>=today),
+      func.count(Show.id).filter(Show.start_time<today)
+    ).filter(fk.in_(ids)).group_by(fk).all()
+  counts = dict.fromkeys(ids, (0, 0))
+  for id, upcoming, past in rows:
+    counts[id] = (upcoming, past)
+  return counts
+
+# Writes the true counters of model for ids
+def recount(model, fk, ids):
+  for id, (upcoming, past) in count_shows(model, fk, ids).items():
+    db.session.query(model).filter(model.id==id).update({
+      model.upcoming_shows_count: upcoming,
+      model.past_shows_count: past
+    }, synchronize_session=False)
+
+# Recounts the venues and artists having shows that started in the last days, i.e. that
+# went from upcoming to past since the last rollover. Idempotent, so running it twice or
+# with more days than needed is harmless.
+def rollover(days=1):
+  today = todays_datetime()
+  since = today - timedelta(days=days)
+  recounted = {}
+  for model, fk in [(Venue, Show.venue_id), (Artist, Show.artist_id)]:
+    ids = [id for id, in db.session.query(fk).distinct()
+      .filter(Show.start_time>=since, Show.start_time<today)]
+    if ids:
+      recount(model, fk, ids)
+    recounted[model.__tablename__] = len(ids)
+  db.session.commit()
+  return recounted
+
+# Compares the counters of model with the Show table in batches of batch_size ids.
+# Returns the mismatches [(id, stored, true)], fixing them when fix is set.
+def reconcile(model, fk, batch_size=1000, fix=False):
+  mismatches = []
+  last_id = 0
+  while True:
+    batch = db.session.query(model.id, model.upcoming_shows_count, model.past_shows_count)\
+      .filter(model.id>last_id).order_by(model.id).limit(batch_size).all()
+    if not batch:
+      break
+    last_id = batch[-1][0]
+    true_counts = count_shows(model, fk, [id for id, upcoming, past in batch])
+    wrong = []
+    for id, upcoming, past in batch:
+      if true_counts[id] != (upcoming, past):
+        mismatches.append((id, (upcoming, past), true_counts[id]))
+        wrong.append(id)
+    if fix and wrong:
+      recount(model, fk, wrong)
+      db.session.commit()
+  return mismatches
+
+counters_cli = AppGroup('counters', help='Maintain the show counters of venues and artists.')
+
+@counters_cli.command('rollover')
+@click.option('--days', default=1, show_default=True, help='Recount entities with shows in the last days.')
+def rollover_command(days):
+  """Move the shows of the last days from upcoming to past."""
+  for table, count in rollover(days).items():
+    click.echo('{0}: {1} recounted'.format(table, count))
+
+@counters_cli.command('reconcile')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--fix', is_flag=True, help='Overwrite the wrong counters.')
+def reconcile_command(batch_size, fix):
+  """Check the counters against the Show table."""
+  for model, fk in [(Venue, Show.venue_id), (Artist, Show.artist_id)]:
+    mismatches = reconcile(model, fk, batch_size, fix)
+    for id, stored, true in mismatches:
+      click.echo('{0} {1}: upcoming/past {2[0]}/{2[1]}, expected {3[0]}/{3[1]}'.format(
+        model.__tablename__, id, stored, true))
+    click.echo('{0}: {1} wrong{2}'.format(model.__tablename__, len(mismatches), ', fixed' if fix and mismatches else ''))
@@ -0,0 +1,114 @@
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+import click
+import dateutil.parser
+from flask.cli import with_appcontext
+from models import db, Venue, Artist, Show
+from importer import VENUE_COLUMNS, ARTIST_COLUMNS, SHOW_COLUMNS
+
+#----------------------------------------------------------------------------#
+# Export.
+#----------------------------------------------------------------------------#
+
+# Dumps venues, artists or shows as NDJSON or CSV. Rows are read with a server-side cursor
+# (stream_results) in batches of chunk_size and written out as they arrive, so memory stays
+# flat whatever the size of the table. The columns match the ones read by importer.py.
+
+ENTITIES = {
+  'venues': (Venue, ['id'] + VENUE_COLUMNS),
+  'artists': (Artist, ['id'] + ARTIST_COLUMNS),
+  'shows': (Show, ['id'] + SHOW_COLUMNS),
+}
+FORMATS = {
+  'ndjson': 'application/x-ndjson',
+  'csv': 'text/csv',
+}
+
+# Parses the since filter, returns None when empty. Raises ValueError when invalid.
+def parse_since(since):
+  if not since:
+    return None
+  return dateutil.parser.parse(since)
+
+# Yields the rows of entity as dicts, ordered by id. since filters shows on start_time.
+def export_rows(entity, since=None, chunk_size=1000):
+  model, columns = ENTITIES[entity]
+  query = db.session.query(*[getattr(model, column) for column in columns])
+  if entity == 'shows' and since is not None:
+    query = query.filter(Show.start_time>=since)
+  query = query.order_by(model.id).execution_options(stream_results=True).yield_per(chunk_size)
+  for row in query:
+    yield dict(zip(columns, row))
+
+def json_value(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  return value
+
+def csv_value(value):
+  if isinstance(value, datetime):
+    return value.isoformat(' ')
+  if isinstance(value, list):
+    return ';'.join(value)
+  return value
+
+# Yields the rows as NDJSON text, one string per chunk_size rows
+def generate_ndjson(entity, rows, chunk_size=1000):
+  lines = []
+  for row in rows:
+    lines.append(json.dumps({key: json_value(value) for key, value in row.items()}))
+    if len(lines) >= chunk_size:
+      yield '\n'.join(lines) + '\n'
+      lines = []
+  if lines:
+    yield '\n'.join(lines) + '\n'
+
+# Yields the rows as CSV text with a header, one string per chunk_size rows
+def generate_csv(entity, rows, chunk_size=1000):
+  model, columns = ENTITIES[entity]
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(columns)
+  count = 0
+  for row in rows:
+    writer.writerow([csv_value(row[column]) for column in columns])
+    count += 1
+    if count % chunk_size == 0:
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate()
+  yield buffer.getvalue()
+
+GENERATORS = {
+  'ndjson': generate_ndjson,
+  'csv': generate_csv,
+}
+
+# Yields the export of entity in format as text chunks
+def generate_export(entity, format, since=None, chunk_size=1000):
+  rows = export_rows(entity, since, chunk_size)
+  return GENERATORS[format](entity, rows, chunk_size)
+
+@click.command('export')
+@click.argument('entity', type=click.Choice(sorted(ENTITIES)))
+@click.option('--format', 'format', type=click.Choice(sorted(FORMATS)), default='ndjson', show_default=True)
+@click.option('--since', help='Only shows starting at or after this date.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), help='Defaults to stdout.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows fetched per round trip.')
+@with_appcontext
+def export_command(entity, format, since, output, chunk_size):
+  """Export venues, artists or shows as NDJSON or CSV."""
+  try:
+    since = parse_since(since)
+  except (ValueError, OverflowError):
+    raise click.BadParameter('not a date: {0}'.format(since), param_hint='--since')
+  stream = open(output, 'w', newline='', encoding='utf-8') if output else sys.stdout
+  try:
+    for data in generate_export(entity, format, since, chunk_size):
+      stream.write(data)
+  finally:
+    if output:
+      stream.close()
@@ -0,0 +1,167 @@
+from flask import current_app
+from sqlalchemy import DDL, event, func, select, cast
+from sqlalchemy.dialects.postgresql import ARRAY
+from forms import genres_choices, state_choices
+from models import db, Venue, Artist
+
+#----------------------------------------------------------------------------#
+# Genre, state and seeking filters.
+#----------------------------------------------------------------------------#
+
+# /venues and /artists take ?genre=Jazz&genre=Blues&match=all|any&state=CA&seeking_talent=1
+# (seeking_venue=1 for artists). The genre filters are array containment (match=all, @>) or
+# overlap (match=any, &&) on the genres column, both answered by its GIN index, the state one
+# by the (state, city) btree index.
+#
+# Beside the results the pages show the count of every genre: how many results there would
+# be with the genre added to the selection. They are computed in one pass over the rows of
+# the other filters, one count(*) FILTER (...) per genre. With GENRE_MASK_FACETS the filters
+# of that aggregate are bit tests on genre_mask, an integer with one bit per genre of
+# genres_choices (computed by the database from genres, see genre_mask() below), instead of
+# array comparisons: "has all of Jazz and Blues" is genre_mask & 1034 = 1034, "any of" is
+# genre_mask & 1034 <> 0.
+
+GENRES = [genre for genre, label in genres_choices]
+STATES = set(state for state, label in state_choices)
+# Bit of every genre in genre_mask. New genres go at the end of genres_choices; renaming,
+# removing or reordering them changes the bits of the existing rows and needs a migration
+# replacing genre_mask() and recomputing the column. At most 31 genres fit.
+GENRE_BITS = dict((genre, 1 << index) for index, genre in enumerate(GENRES))
+
+# Query parameter and column of the seeking filter of each model
+SEEKING = {
+  Venue: 'seeking_talent',
+  Artist: 'seeking_venue',
+}
+MATCHES = ('all', 'any')
+TRUE_VALUES = ('1', 'true', 'y', 'on')
+
+def quote(value):
+  return "'{0}'".format(value.replace("'", "''"))
+
+# genre_mask(genres): the bits of GENRE_BITS of the genres in the array, unknown ones ignored.
+# IMMUTABLE so that Venue.genre_mask and Artist.genre_mask can be generated columns.
+GENRE_MASK_FUNCTION = DDL('''
+CREATE OR REPLACE FUNCTION genre_mask(genres varchar[]) RETURNS integer AS $$
+  SELECT coalesce(bit_or(1 << (array_position(ARRAY[{0}]::varchar[], genre) - 1)), 0)::integer
+  FROM unnest(genres) AS genre
+$$ LANGUAGE sql IMMUTABLE
+'''.format(', '.join(quote(genre) for genre in GENRES)))
+
+event.listen(db.metadata, 'before_create', GENRE_MASK_FUNCTION)
+
+def genre_bits(genres):
+  bits = 0
+  for genre in genres:
+    bits |= GENRE_BITS[genre]
+  return bits
+
+# Rows having all (or any) of genres
+def genre_condition(model, genres, match='all', use_mask=False):
+  if use_mask:
+    bits = genre_bits(genres)
+    masked = model.genre_mask.op('&')(bits)
+    return masked == bits if match == 'all' else masked != 0
+  # varchar[] like the column, the GIN index doesn't serve text[] operands
+  genres = cast(genres, ARRAY(db.String))
+  return model.genres.op('@>')(genres) if match == 'all' else model.genres.op('&&')(genres)
+
+class Filters:
+  # Options of the state select of the filter form
+  states = sorted(STATES)
+
+  def __init__(self, model, genres=(), match='all', state=None, seeking=False):
+    self.model = model
+    # In the order of genres_choices, so equal selections share their cache entries
+    self.genres = [genre for genre in GENRES if genre in genres]
+    self.match = match
+    self.state = state
+    self.seeking = seeking
+
+  # Filters of the query string, values that can't match anything are dropped
+  @classmethod
+  def from_args(cls, model, args):
+    match = args.get('match', 'all')
+    state = args.get('state', '').upper()
+    return cls(model,
+      genres=set(args.getlist('genre')),
+      match=match if match in MATCHES else 'all',
+      state=state if state in STATES else None,
+      seeking=args.get(SEEKING[model], '').lower() in TRUE_VALUES)
+
+  # Query parameter of the seeking filter
+  @property
+  def seeking_arg(self):
+    return SEEKING[self.model]
+
+  @property
+  def active(self):
+    return bool(self.genres or self.state or self.seeking)
+
+  # Conditions of the state and seeking filters
+  def other_conditions(self):
+    conditions = []
+    if self.state:
+      conditions.append(self.model.state == self.state)
+    if self.seeking:
+      conditions.append(getattr(self.model, self.seeking_arg).is_(True))
+    return conditions
+
+  # Conditions of every filter, for the queries of the pages
+  def conditions(self):
+    conditions = self.other_conditions()
+    if self.genres:
+      conditions.append(genre_condition(self.model, self.genres, self.match))
+    return conditions
+
+  # Part of the view cache keys
+  def key(self):
+    return '{0}|{1}|{2}|{3}'.format(','.join(self.genres), self.match, self.state or '', int(self.seeking))
+
+  # Query string arguments of the filters for url_for(), with toggle added to (or removed
+  # from) the selected genres
+  def args(self, toggle=None):
+    genres = list(self.genres)
+    if toggle in genres:
+      genres.remove(toggle)
+    elif toggle:
+      genres.append(toggle)
+    args = {}
+    if genres:
+      args['genre'] = genres
+    if self.match != 'all':
+      args['match'] = self.match
+    if self.state:
+      args['state'] = self.state
+    if self.seeking:
+      args[self.seeking_arg] = 1
+    return args
+
+  def selected(self, genre):
+    return genre in self.genres
+
+# The aggregate of the facet counts: the number of results, then for every genre of GENRES
+# the number of results with the genre added to the selection
+def facet_statement(filters, use_mask=None):
+  if use_mask is None:
+    use_mask = current_app.config.get('GENRE_MASK_FACETS', True)
+  model = filters.model
+  total = func.count()
+  if filters.genres:
+    total = total.filter(genre_condition(model, filters.genres, filters.match, use_mask))
+  counts = [total]
+  for genre in GENRES:
+    genres = filters.genres if genre in filters.genres else filters.genres + [genre]
+    counts.append(func.count().filter(genre_condition(model, genres, filters.match, use_mask)))
+  return select(*counts).select_from(model).where(*filters.other_conditions())
+
+# {'total': n, 'genres': [{'genre', 'count', 'selected'}]} of the row of facet_statement()
+def facet_counts(filters, row):
+  return {
+    'total': row[0],
+    'genres': [{'genre': genre, 'count': count, 'selected': filters.selected(genre)}
+      for genre, count in zip(GENRES, row[1:])],
+  }
+
+def get_facets(filters):
+  return facet_counts(filters, db.session.execute(facet_statement(filters)).one())
@@ -0,0 +1,77 @@
+import threading
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+from models import db
+
+#----------------------------------------------------------------------------#
+# Upcoming shows feed.
+#----------------------------------------------------------------------------#
+
+# /shows reads from the upcoming_show_feed materialized view (see models.py), which holds the
+# upcoming shows already joined with their venue and artist. It has to be refreshed after
+# shows are written or venues/artists renamed, and at midnight ("flask feed refresh" from cron).
+# Refreshes requested by the web handlers run in a background thread, so a burst of writes
+# costs one REFRESH and the requests don't wait for it.
+
+def refresh_feed(concurrently=True):
+  db.session.execute(text('REFRESH MATERIALIZED VIEW {0}upcoming_show_feed'.format(
+    'CONCURRENTLY ' if concurrently else '')))
+  db.session.commit()
+
+class FeedRefresher:
+  def __init__(self):
+    self.app = None
+    self.requested = threading.Event()
+    self.thread = None
+    self.lock = threading.Lock()
+    self.on_refresh = []
+
+  def init_app(self, app):
+    self.app = app
+
+  # Asks for a refresh, the background thread coalesces the requests made while it refreshes
+  def request_refresh(self):
+    if self.app is None or not self.app.config.get('FEED_REFRESH_ASYNC', True):
+      refresh_feed()
+      self.refreshed()
+      return
+    self.requested.set()
+    with self.lock:
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run, name='feed-refresher', daemon=True)
+        self.thread.start()
+
+  def run(self):
+    while True:
+      self.requested.wait(timeout=60)
+      with self.lock:
+        # Idle for a minute, request_refresh() starts a new thread when needed
+        if not self.requested.is_set():
+          self.thread = None
+          return
+        self.requested.clear()
+      with self.app.app_context():
+        try:
+          refresh_feed()
+        except Exception:
+          db.session.rollback()
+          self.app.logger.exception('upcoming_show_feed refresh failed')
+        finally:
+          db.session.remove()
+      self.refreshed()
+
+  def refreshed(self):
+    for callback in self.on_refresh:
+      callback()
+
+feed_refresher = FeedRefresher()
+
+feed_cli = AppGroup('feed', help='Maintain the upcoming shows feed.')
+
+@feed_cli.command('refresh')
+@click.option('--blocking', is_flag=True, help='Plain REFRESH, locking out readers (needed on an unpopulated view).')
+def refresh_command(blocking):
+  """Refresh the upcoming shows feed, run it after midnight."""
+  refresh_feed(concurrently=not blocking)
+  click.echo('upcoming_show_feed refreshed')
@@ -0,0 +1,116 @@
+import threading
+import time
+from flask import g, before_render_template, template_rendered
+from jinja2 import nodes
+from jinja2.ext import Extension
+from cache import MemoryBackend, ViewCache
+
+#----------------------------------------------------------------------------#
+# Template fragment cache.
+#----------------------------------------------------------------------------#
+
+# {% cache key, ttl %}...{% endcache %} keeps the rendered HTML of a block in memory.
+# key is a list of parts, entity parts ("venue:1", "artist:4") add their version stamp to the
+# key, and the version of an entity is bumped whenever the view cache invalidates its tag
+# (cache.invalidate in the create/edit handlers), so edited entities get fresh fragments and
+# the stale ones age out of the LRU. The versions are counters of the view cache, shared by
+# the workers with redis: the fragments stay in each process, but an edit served by one
+# worker gives new keys to the fragments of all of them. Clearing the view cache bumps a
+# version of every key. ttl is in seconds and optional.
+#
+#   {% cache ['venue-card', 'venue:' ~ venue.id], 3600 %} ... {% endcache %}
+
+class TemplateStats:
+  def __init__(self):
+    self.lock = threading.Lock()
+    # template -> {'renders', 'render_seconds', 'fragment_hits', 'fragment_misses'}
+    self.templates = {}
+
+  def incr(self, template, name, amount=1):
+    with self.lock:
+      counters = self.templates.setdefault(template, dict.fromkeys(
+        ['renders', 'render_seconds', 'fragment_hits', 'fragment_misses'], 0))
+      counters[name] += amount
+
+  def to_dict(self):
+    with self.lock:
+      return {template: dict(counters) for template, counters in self.templates.items()}
+
+class FragmentCache:
+  def __init__(self):
+    self.backend = MemoryBackend()
+    self.default_ttl = 3600
+    self.stats = TemplateStats()
+    # Keeps the version counters, "fragver:<tag>" and "fragver:*" for all the keys
+    self.view_cache = ViewCache()
+
+  def init_app(self, app, view_cache=None):
+    self.backend = MemoryBackend(app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000))
+    self.default_ttl = app.config.get('FRAGMENT_CACHE_DEFAULT_TTL', 3600)
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = self
+    if view_cache is not None:
+      self.view_cache = view_cache
+      view_cache.on_invalidate.append(self.bump)
+    before_render_template.connect(self.render_started, app)
+    template_rendered.connect(self.render_finished, app)
+
+  # Gives a new version to the fragments of the entity tags, None to every fragment
+  def bump(self, tags):
+    if tags is None:
+      self.backend.clear()
+      self.view_cache.incr_version('fragver:*')
+      return
+    for tag in tags:
+      self.view_cache.incr_version('fragver:' + tag)
+
+  # One read of the versions per fragment
+  def make_key(self, template, parts):
+    if not isinstance(parts, (list, tuple)):
+      parts = [parts]
+    parts = [str(part) for part in parts]
+    versions = self.view_cache.get_versions(['fragver:*'] + ['fragver:' + part for part in parts])
+    return '{0}@{1}|'.format(template, versions[0]) + '|'.join(
+      '{0}@{1}'.format(part, version) for part, version in zip(parts, versions[1:]))
+
+  def render_started(self, sender, template, context, **extra):
+    g.setdefault('template_render_starts', []).append(time.perf_counter())
+
+  def render_finished(self, sender, template, context, **extra):
+    starts = g.get('template_render_starts')
+    if starts:
+      self.stats.incr(template.name, 'render_seconds', time.perf_counter() - starts.pop())
+    self.stats.incr(template.name, 'renders')
+
+class FragmentCacheExtension(Extension):
+  tags = {'cache'}
+
+  def __init__(self, environment):
+    super(FragmentCacheExtension, self).__init__(environment)
+    environment.extend(fragment_cache=None)
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    args = [nodes.Const(parser.name), parser.parse_expression()]
+    if parser.stream.skip_if('comma'):
+      args.append(parser.parse_expression())
+    else:
+      args.append(nodes.Const(None))
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    return nodes.CallBlock(self.call_method('render_fragment', args), [], [], body).set_lineno(lineno)
+
+  def render_fragment(self, template, key, ttl, caller):
+    fragment_cache = self.environment.fragment_cache
+    if fragment_cache is None:
+      return caller()
+    key = fragment_cache.make_key(template, key)
+    rv = fragment_cache.backend.get(key)
+    if rv is not None:
+      fragment_cache.stats.incr(template, 'fragment_hits')
+      return rv
+    fragment_cache.stats.incr(template, 'fragment_misses')
+    rv = caller()
+    fragment_cache.backend.set(key, rv, ttl or fragment_cache.default_ttl, [])
+    return rv
+
+fragment_cache = FragmentCache()
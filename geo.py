@@ -0,0 +1,297 @@
+import csv
+import heapq
+import math
+import threading
+import time
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, event, func, text
+from models import db, Venue
+from suggest import normalize
+from cache import cache
+
+#----------------------------------------------------------------------------#
+# Venue locations.
+#----------------------------------------------------------------------------#
+
+# Venues get their latitude/longitude from "flask geocode", an offline step matching their
+# city and state against a local gazetteer file (a GeoNames dump such as US.txt or
+# cities500.txt, or a city,state,latitude,longitude CSV), so coordinates are those of the
+# city. Moved venues lose theirs and are geocoded again by the next run.
+#
+# /venues/nearby answers from a GiST index on ll_to_earth(latitude, longitude) (the cube and
+# earthdistance extensions): the radius is a box lookup, and ORDER BY <-> walks the index
+# nearest first, so a page costs the same in a dense city as in the countryside. Without the
+# extensions the index isn't created and the venues are looked up in an in-process KD-tree
+# of their points instead. Every worker keeps its own tree and rebuilds it when the "nearby"
+# version counter of the view cache moved (bumped by every venue change, shared by the workers
+# with redis), or NEARBY_INDEX_TTL seconds after it was built.
+
+EARTH_RADIUS_KM = 6371.0088
+LOCATION_INDEX = 'ix_Venue_location'
+
+#----------------------------------------------------------------------------#
+# Geocoding.
+#----------------------------------------------------------------------------#
+
+# Columns of a GeoNames dump (tab separated, no header)
+GEONAMES_NAME = 1
+GEONAMES_ASCII_NAME = 2
+GEONAMES_LATITUDE = 4
+GEONAMES_LONGITUDE = 5
+GEONAMES_FEATURE_CLASS = 6
+GEONAMES_COUNTRY = 8
+GEONAMES_ADMIN1 = 10
+GEONAMES_POPULATION = 14
+
+# Coordinates of (city, state) pairs, the most populated place wins when names repeat
+class Gazetteer:
+  def __init__(self):
+    # (normalized city, state) -> (latitude, longitude, population)
+    self.places = {}
+
+  def add(self, city, state, latitude, longitude, population=0):
+    key = (normalize(city), state.strip().upper())
+    place = self.places.get(key)
+    if place is None or population > place[2]:
+      self.places[key] = (latitude, longitude, population)
+
+  # (latitude, longitude) or None
+  def lookup(self, city, state):
+    place = self.places.get((normalize(city), (state or '').strip().upper()))
+    return place[:2] if place else None
+
+  def __len__(self):
+    return len(self.places)
+
+  # Reads a CSV with a header (city, state, latitude, longitude and optionally population)
+  # or the populated places of country in a GeoNames dump
+  @classmethod
+  def load(cls, path, country='US'):
+    gazetteer = cls()
+    with open(path, newline='', encoding='utf-8') as stream:
+      if path.endswith('.csv'):
+        for row in csv.DictReader(stream):
+          gazetteer.add(row['city'], row['state'], float(row['latitude']), float(row['longitude']),
+            int(row.get('population') or 0))
+      else:
+        for line in stream:
+          fields = line.rstrip('\n').split('\t')
+          if len(fields) <= GEONAMES_POPULATION or fields[GEONAMES_FEATURE_CLASS] != 'P' or \
+              fields[GEONAMES_COUNTRY] != country:
+            continue
+          latitude, longitude = float(fields[GEONAMES_LATITUDE]), float(fields[GEONAMES_LONGITUDE])
+          population = int(fields[GEONAMES_POPULATION] or 0)
+          for name in set([fields[GEONAMES_NAME], fields[GEONAMES_ASCII_NAME]]):
+            gazetteer.add(name, fields[GEONAMES_ADMIN1], latitude, longitude, population)
+    return gazetteer
+
+# Sets the coordinates of the venues without any (or of every venue with redo) with one
+# UPDATE per city, returns (venues updated, [(city, state, venues)] of the unknown cities)
+def geocode_venues(gazetteer, redo=False):
+  areas = db.session.query(Venue.city, Venue.state, func.count()).group_by(Venue.city, Venue.state)
+  if not redo:
+    areas = areas.filter(Venue.latitude.is_(None))
+  updates = []
+  updated = 0
+  unknown = []
+  for city, state, venues in areas.all():
+    location = gazetteer.lookup(city, state)
+    if location is None:
+      unknown.append((city, state, venues))
+      continue
+    updates.append({'city': city, 'state': state, 'latitude': location[0], 'longitude': location[1]})
+    updated += venues
+  if updates:
+    # Served by ix_Venue_state_city
+    db.session.execute(text('UPDATE "Venue" SET latitude = :latitude, longitude = :longitude '
+      'WHERE city = :city AND state = :state' + ('' if redo else ' AND latitude IS NULL')), updates)
+  db.session.commit()
+  return updated, sorted(unknown, key=lambda area: -area[2])
+
+@click.command('geocode')
+@click.argument('gazetteer', type=click.Path(exists=True, dir_okay=False))
+@click.option('--all', 'redo', is_flag=True, help='Geocode every venue, not only those without coordinates.')
+@click.option('--country', default='US', show_default=True, help='Country of the places read from a GeoNames dump.')
+@with_appcontext
+def geocode_command(gazetteer, redo, country):
+  """Fill the coordinates of the venues from a GAZETTEER file (GeoNames dump or CSV)."""
+  started = time.perf_counter()
+  places = Gazetteer.load(gazetteer, country)
+  updated, unknown = geocode_venues(places, redo)
+  # Drops the cached pages and bumps the "nearby" version: with a redis cache every worker
+  # rebuilds its KD-tree on its next lookup, with the memory cache they wait for the TTL
+  cache.invalidate('venue-list')
+  click.echo('{0} places read, {1} venues geocoded, {2} cities not found ({3} venues) in {4:.1f}s'.format(
+    len(places), updated, len(unknown), sum(area[2] for area in unknown), time.perf_counter() - started))
+  for city, state, venues in unknown[:20]:
+    click.echo('  {0}, {1}: {2} venues'.format(city, state, venues))
+
+#----------------------------------------------------------------------------#
+# Nearby venues.
+#----------------------------------------------------------------------------#
+
+# Point of the unit sphere, the straight-line (chord) distance between two of them grows with
+# their great-circle distance, so nearest by chord is nearest on the globe
+def to_xyz(latitude, longitude):
+  phi, lam = math.radians(latitude), math.radians(longitude)
+  return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+def chord_to_km(chord):
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+def km_to_chord(km):
+  return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+# Static 3-d tree of (id, latitude, longitude) points. Points are stored in one list ordered
+# so that every range [lo, hi) is a subtree split at its middle point, on x, y then z.
+class KDTree:
+  def __init__(self, points):
+    items = [(to_xyz(latitude, longitude), id) for id, latitude, longitude in points]
+    stack = [(0, len(items), 0)]
+    while stack:
+      lo, hi, axis = stack.pop()
+      if hi - lo <= 1:
+        continue
+      items[lo:hi] = sorted(items[lo:hi], key=lambda item: item[0][axis])
+      mid = (lo + hi) // 2
+      stack.append((lo, mid, (axis + 1) % 3))
+      stack.append((mid + 1, hi, (axis + 1) % 3))
+    self.points = [item[0] for item in items]
+    self.ids = [item[1] for item in items]
+
+  # [(distance_km, id)] of the k points nearest to (latitude, longitude) within radius_km,
+  # nearest first
+  def nearest(self, latitude, longitude, radius_km, k):
+    target = to_xyz(latitude, longitude)
+    limit = km_to_chord(radius_km) ** 2
+    # Max-heap of (-squared chord, -id) of the k best so far
+    best = []
+    stack = [(0, len(self.points), 0, 0.0)]
+    while stack:
+      lo, hi, axis, plane = stack.pop()
+      bound = -best[0][0] if len(best) == k else limit
+      if lo >= hi or plane > bound:
+        continue
+      mid = (lo + hi) // 2
+      point = self.points[mid]
+      distance = (point[0] - target[0]) ** 2 + (point[1] - target[1]) ** 2 + (point[2] - target[2]) ** 2
+      if distance <= bound:
+        entry = (-distance, -self.ids[mid])
+        if len(best) < k:
+          heapq.heappush(best, entry)
+        elif entry > best[0]:
+          heapq.heapreplace(best, entry)
+      diff = target[axis] - point[axis]
+      below, above = (lo, mid), (mid + 1, hi)
+      near, far = (below, above) if diff < 0 else (above, below)
+      # The far side is only searched when the splitting plane is closer than the kth point
+      stack.append((far[0], far[1], (axis + 1) % 3, diff * diff))
+      stack.append((near[0], near[1], (axis + 1) % 3, 0.0))
+    return [(chord_to_km(math.sqrt(-distance)), -id) for distance, id in sorted(best, reverse=True)]
+
+  def __len__(self):
+    return len(self.ids)
+
+def venue_json(row, distance_km):
+  return {
+    'id': row.id,
+    'name': row.name,
+    'city': row.city,
+    'state': row.state,
+    'distance_km': round(distance_km, 3),
+    'num_upcoming_shows': row.upcoming_shows_count,
+  }
+
+VENUE_COLUMNS = [Venue.id, Venue.name, Venue.city, Venue.state, Venue.upcoming_shows_count]
+
+# Venues within radius_km of (latitude, longitude), nearest first, from the GiST index
+def query_nearby(latitude, longitude, radius_km, limit):
+  origin = func.ll_to_earth(latitude, longitude)
+  location = func.ll_to_earth(Venue.latitude, Venue.longitude)
+  meters = radius_km * 1000
+  rows = db.session.query(*VENUE_COLUMNS, func.earth_distance(origin, location).label('distance'))\
+    .filter(func.earth_box(origin, meters).op('@>')(location), func.earth_distance(origin, location) <= meters)\
+    .order_by(location.op('<->')(origin), Venue.id).limit(limit).all()
+  return [venue_json(row, row.distance / 1000) for row in rows]
+
+class NearbyIndex:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.backend = 'auto'
+    self.ttl = 300
+    self.tree = None
+    self.built_at = 0.0
+    # Value of the "nearby" version counter of the view cache when the tree was built
+    self.version = None
+    self.builds = 0
+
+  def init_app(self, app):
+    self.backend = app.config.get('NEARBY_BACKEND', 'auto')
+    self.ttl = app.config.get('NEARBY_INDEX_TTL', 300)
+
+  # Listener of cache.on_invalidate: bumps the version of the KD-tree when a venue changes. The
+  # counter is shared by the workers with the redis cache, so all of them rebuild their tree.
+  def invalidate(self, tags):
+    if tags is None or 'venue-list' in tags:
+      cache.incr_version('nearby')
+
+  # 'earthdistance' when the database has the location index, 'kdtree' otherwise
+  def resolve_backend(self):
+    if self.backend == 'auto':
+      exists = db.engine.dialect.name == 'postgresql' and db.session.execute(
+        text('SELECT to_regclass(:name)'), {'name': '"{0}"'.format(LOCATION_INDEX)}).scalar() is not None
+      self.backend = 'earthdistance' if exists else 'kdtree'
+    return self.backend
+
+  def get_tree(self):
+    version = cache.get_versions(['nearby'])[0]
+    with self.lock:
+      if self.tree is None or version != self.version or time.monotonic() - self.built_at > self.ttl:
+        points = db.session.query(Venue.id, Venue.latitude, Venue.longitude)\
+          .filter(Venue.latitude.isnot(None), Venue.longitude.isnot(None)).all()
+        self.tree = KDTree(points)
+        self.built_at = time.monotonic()
+        self.version = version
+        self.builds += 1
+      return self.tree
+
+  # Venues within radius_km of (latitude, longitude), nearest first, with their distance and
+  # upcoming shows count
+  def nearby(self, latitude, longitude, radius_km, limit):
+    if self.resolve_backend() == 'earthdistance':
+      return query_nearby(latitude, longitude, radius_km, limit)
+    found = self.get_tree().nearest(latitude, longitude, radius_km, limit)
+    if not found:
+      return []
+    rows = dict((row.id, row) for row in
+      db.session.query(*VENUE_COLUMNS).filter(Venue.id.in_([id for distance, id in found])))
+    # Venues deleted since the tree was built are skipped
+    return [venue_json(rows[id], distance) for distance, id in found if id in rows]
+
+  def to_dict(self):
+    return {
+      'backend': self.backend,
+      'points': len(self.tree) if self.tree is not None else None,
+      'builds': self.builds,
+    }
+
+nearby_index = NearbyIndex()
+
+#----------------------------------------------------------------------------#
+# Database objects created alongside the tables by db.create_all(), when the server has
+# the extensions. Existing databases get them from the migrations.
+#----------------------------------------------------------------------------#
+
+def earthdistance_available(ddl, target, bind, **kw):
+  return bind.execute(text('''
+    SELECT count(*) FROM pg_available_extensions WHERE name IN ('cube', 'earthdistance')
+  ''')).scalar() == 2
+
+event.listen(db.metadata, 'before_create', DDL('''
+CREATE EXTENSION IF NOT EXISTS cube;
+CREATE EXTENSION IF NOT EXISTS earthdistance
+''').execute_if(dialect='postgresql', callable_=earthdistance_available))
+event.listen(Venue.__table__, 'after_create', DDL('''
+CREATE INDEX "{0}" ON "Venue" USING gist (ll_to_earth(latitude, longitude))
+'''.format(LOCATION_INDEX)).execute_if(dialect='postgresql', callable_=earthdistance_available))
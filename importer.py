@@ -0,0 +1,319 @@
+import csv
+import io
+import json
+import time
+import click
+from flask.cli import with_appcontext
+from werkzeug.datastructures import MultiDict
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_MINUTES
+from bookings import BookingIndex, show_end
+from cache import cache
+from counters import record_created_shows
+from feed import refresh_feed
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#----------------------------------------------------------------------------#
+
+# Loads venues, artists or shows from CSV or JSONL. Rows are read as a stream, validated with
+# the same forms used by the create pages and loaded in chunks with COPY (executemany when the
+# driver has no COPY support). Shows may reference their artist and venue by id or by name,
+# references are resolved in bulk once per chunk, and checked for booking conflicts with the
+# shows already in the table and the previous rows, see bookings.py.
+
+VENUE_COLUMNS = ['name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+  'genres', 'website', 'seeking_talent', 'seeking_description']
+ARTIST_COLUMNS = ['name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link',
+  'seeking_venue', 'seeking_description', 'website']
+SHOW_COLUMNS = ['artist_id', 'venue_id', 'start_time', 'duration_minutes']
+
+ENTITIES = {
+  'venues': (Venue, VenueForm, VENUE_COLUMNS),
+  'artists': (Artist, ArtistForm, ARTIST_COLUMNS),
+  'shows': (Show, ShowForm, SHOW_COLUMNS),
+}
+
+BOOLEAN_COLUMNS = ['seeking_talent', 'seeking_venue']
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y', 'on')
+
+class ImportReport:
+  def __init__(self, entity):
+    self.entity = entity
+    self.read = 0
+    self.inserted = 0
+    # [(line, [messages])]
+    self.errors = []
+    self.started = time.perf_counter()
+    self.elapsed = 0.0
+
+  def reject(self, line, messages):
+    self.errors.append((line, messages))
+
+  def finish(self):
+    self.elapsed = time.perf_counter() - self.started
+    return self
+
+  @property
+  def rows_per_second(self):
+    return self.inserted / self.elapsed if self.elapsed else 0.0
+
+  def to_dict(self):
+    return {
+      'entity': self.entity,
+      'read': self.read,
+      'inserted': self.inserted,
+      'rejected': len(self.errors),
+      'errors': [{'line': line, 'messages': messages} for line, messages in self.errors],
+      'seconds': round(self.elapsed, 3),
+      'rows_per_second': round(self.rows_per_second, 1)
+    }
+
+  def __str__(self):
+    lines = ['{0}: {1} read, {2} inserted, {3} rejected in {4:.2f}s ({5:.0f} rows/sec)'.format(
+      self.entity, self.read, self.inserted, len(self.errors), self.elapsed, self.rows_per_second)]
+    for line, messages in self.errors:
+      lines.append('  line {0}: {1}'.format(line, '; '.join(messages)))
+    return '\n'.join(lines)
+
+# Streams are decoded with this error handler: the bytes that aren't UTF-8 become lone
+# surrogates, which valid UTF-8 never decodes to, and their rows are rejected by read_rows()
+ENCODING_ERRORS = 'surrogateescape'
+
+def has_undecodable(values):
+  return any(isinstance(value, str) and any('\udc80' <= char <= '\udcff' for char in value)
+    for value in values)
+
+# Yields (line, dict, errors) from a text stream of CSV (with a header) or JSONL. Lines that
+# can't be read come with errors instead of a dict, the following ones are still read.
+def read_rows(stream, format):
+  if format == 'csv':
+    reader = csv.DictReader(stream)
+    while True:
+      try:
+        row = next(reader)
+      except StopIteration:
+        return
+      except csv.Error as e:
+        yield reader.line_num, None, ['malformed CSV: {0}'.format(e)]
+        continue
+      if has_undecodable(row.values()) or has_undecodable(row):
+        yield reader.line_num, None, ['not valid UTF-8']
+      else:
+        yield reader.line_num, row, []
+  else:
+    for line, data in enumerate(stream, 1):
+      if not data.strip():
+        continue
+      if has_undecodable([data]):
+        yield line, None, ['not valid UTF-8']
+        continue
+      try:
+        row = json.loads(data)
+      except ValueError as e:
+        yield line, None, ['malformed JSON: {0}'.format(e)]
+        continue
+      if isinstance(row, dict):
+        yield line, row, []
+      else:
+        yield line, None, ['expected a JSON object, got {0}'.format(type(row).__name__)]
+
+# Builds the formdata of a row: genres may be a list or a "Jazz;Blues" string
+def row_formdata(row):
+  formdata = MultiDict()
+  for key, value in row.items():
+    if key == 'genres':
+      if isinstance(value, str):
+        value = [genre.strip() for genre in value.split(';') if genre.strip()]
+      for genre in value or []:
+        formdata.add('genres', str(genre))
+    elif key in BOOLEAN_COLUMNS:
+      if str(value).strip().lower() in TRUE_VALUES or value is True:
+        formdata.add(key, 'y')
+    elif value is not None:
+      formdata.add(key, str(value))
+  return formdata
+
+# Validates a row with the form of the entity, returns (values, errors)
+def validate_row(form_class, columns, row):
+  if not isinstance(row.get('genres'), (list, str, type(None))):
+    return None, ['genres: expected a list or a "Jazz;Blues" string']
+  # The form would fill it with its default, the time the app started
+  if 'start_time' in columns and not str(row.get('start_time') or '').strip():
+    return None, ['start_time: This field is required.']
+  form = form_class(formdata=row_formdata(row), meta={'csrf': False})
+  if not form.validate():
+    return None, ['{0}: {1}'.format(field, ', '.join(messages)) for field, messages in form.errors.items()]
+  values = {}
+  for column in columns:
+    if column in ('artist_id', 'venue_id'):
+      values[column] = row.get(column) or None
+    else:
+      values[column] = getattr(form, column).data
+  if 'phone' in values and not values['phone']:
+    values['phone'] = None
+  if 'duration_minutes' in values and not values['duration_minutes']:
+    values['duration_minutes'] = DEFAULT_SHOW_MINUTES
+  return values, []
+
+# Resolves the artist/venue of a chunk of shows with one query per referenced table.
+# References are either an id (artist_id) or an exact name (artist_name).
+def resolve_show_references(chunk, report):
+  resolved = []
+  lookups = {}
+  for kind, model in [('artist', Artist), ('venue', Venue)]:
+    ids = set()
+    names = set()
+    for line, row, values in chunk:
+      if values[kind + '_id']:
+        try:
+          ids.add(int(values[kind + '_id']))
+        except ValueError:
+          pass
+      elif row.get(kind + '_name'):
+        names.add(row[kind + '_name'])
+    found_ids = set()
+    if ids:
+      found_ids = {id for id, in db.session.query(model.id).filter(model.id.in_(ids))}
+    found_names = {}
+    if names:
+      for id, name in db.session.query(model.id, model.name).filter(model.name.in_(names)):
+        # Ambiguous names are marked with None
+        found_names[name] = None if name in found_names else id
+    lookups[kind] = (found_ids, found_names)
+
+  for line, row, values in chunk:
+    errors = []
+    for kind in ['artist', 'venue']:
+      found_ids, found_names = lookups[kind]
+      if values[kind + '_id']:
+        try:
+          id = int(values[kind + '_id'])
+        except ValueError:
+          id = None
+        if id not in found_ids:
+          errors.append('{0}_id: no {0} with id {1}'.format(kind, values[kind + '_id']))
+        values[kind + '_id'] = id
+      elif row.get(kind + '_name'):
+        name = row[kind + '_name']
+        if name not in found_names:
+          errors.append('{0}_name: no {0} named {1}'.format(kind, name))
+        elif found_names[name] is None:
+          errors.append('{0}_name: several {0}s are named {1}'.format(kind, name))
+        values[kind + '_id'] = found_names.get(name)
+      else:
+        errors.append('{0}_id: a {0}_id or {0}_name is required'.format(kind))
+    if errors:
+      report.reject(line, errors)
+    else:
+      resolved.append((line, row, values))
+  return resolved
+
+# Rejects the shows of a chunk overlapping another show of their artist or venue, in the
+# table or earlier in the chunk. Every conflict is reported, with one query for the chunk.
+def reject_booking_conflicts(chunk, report):
+  if not chunk:
+    return chunk
+  index = BookingIndex()
+  periods = [(values['start_time'], show_end(values['start_time'], values['duration_minutes']))
+    for line, row, values in chunk]
+  index.load({values['artist_id'] for line, row, values in chunk}, {values['venue_id'] for line, row, values in chunk},
+    min(start for start, end in periods), max(end for start, end in periods))
+  accepted = []
+  for (line, row, values), (start, end) in zip(chunk, periods):
+    errors = index.conflicts(values['artist_id'], values['venue_id'], start, end)
+    if errors:
+      report.reject(line, errors)
+      continue
+    index.add(values['artist_id'], values['venue_id'], start, end, 'line {0}'.format(line))
+    accepted.append((line, row, values))
+  return accepted
+
+# Formats a value for the text format of COPY
+def copy_value(value):
+  if value is None:
+    return '\\N'
+  if isinstance(value, bool):
+    value = 't' if value else 'f'
+  elif isinstance(value, (list, tuple)):
+    value = '{' + ','.join('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in value) + '}'
+  else:
+    value = str(value)
+  return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+# Inserts a chunk of rows with COPY, or with executemany when the driver has no COPY
+def load_chunk(model, columns, rows):
+  connection = db.session.connection()
+  cursor = connection.connection.cursor()
+  if hasattr(cursor, 'copy_expert'):
+    buffer = io.StringIO()
+    for values in rows:
+      buffer.write('\t'.join(copy_value(values[column]) for column in columns))
+      buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert('COPY "{0}" ({1}) FROM STDIN'.format(
+      model.__tablename__, ', '.join(columns)), buffer)
+  else:
+    connection.execute(model.__table__.insert(), rows)
+
+# Imports the rows of a text stream into entity ('venues', 'artists' or 'shows').
+# Every chunk is committed on its own, rejected rows are reported and skipped.
+def import_rows(entity, stream, format='csv', chunk_size=5000):
+  model, form_class, columns = ENTITIES[entity]
+  report = ImportReport(entity)
+  chunk = []
+
+  def flush():
+    rows = chunk
+    if entity == 'shows':
+      rows = reject_booking_conflicts(resolve_show_references(rows, report), report)
+    if rows:
+      load_chunk(model, columns, [values for line, row, values in rows])
+      if entity == 'shows':
+        record_created_shows([(values['artist_id'], values['venue_id'], values['start_time'])
+          for line, row, values in rows])
+      db.session.commit()
+      report.inserted += len(rows)
+    del chunk[:]
+
+  try:
+    for line, row, errors in read_rows(stream, format):
+      report.read += 1
+      if not errors:
+        values, errors = validate_row(form_class, columns, row)
+      if errors:
+        report.reject(line, errors)
+        continue
+      chunk.append((line, row, values))
+      if len(chunk) >= chunk_size:
+        flush()
+    if chunk:
+      flush()
+  except Exception:
+    db.session.rollback()
+    raise
+  return report.finish()
+
+# Guesses csv or jsonl from a file name
+def guess_format(filename):
+  if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+    return 'jsonl'
+  return 'csv'
+
+@click.command('import')
+@click.argument('entity', type=click.Choice(sorted(ENTITIES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows per COPY and commit.')
+@with_appcontext
+def import_command(entity, path, format, chunk_size):
+  """Bulk import venues, artists or shows from a CSV or JSONL file."""
+  with open(path, newline='', encoding='utf-8', errors=ENCODING_ERRORS) as stream:
+    report = import_rows(entity, stream, format or guess_format(path), chunk_size)
+  if entity == 'shows':
+    refresh_feed()
+  else:
+    cache.incr_version('suggest')
+  # Only reaches the web workers when they share a redis cache
+  cache.clear()
+  click.echo(str(report))
@@ -0,0 +1,193 @@
+import hashlib
+import threading
+import time
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Request metrics.
+#----------------------------------------------------------------------------#
+
+# Records, for every request, the number of SQL statements, the SQL time, the template render
+# time and the statements executed over and over (the N+1 pattern: one query per row of a
+# previous query). Totals are kept per endpoint and exported in the Prometheus text format
+# at /metrics. With METRICS_SERVER_TIMING set, every response gets a Server-Timing header:
+#
+#   Server-Timing: sql;dur=4.2;desc="6 queries", render;dur=1.3, total;dur=8.0
+#
+# A statement repeated METRICS_N_PLUS_ONE_THRESHOLD times in one request is logged once per
+# endpoint with its signature, the first 12 hex digits of the sha1 of its SQL.
+
+# Total of a request for every endpoint counter
+COUNTERS = [
+  ('requests_total', 'Requests served.'),
+  ('request_seconds_total', 'Time spent serving requests.'),
+  ('queries_total', 'SQL statements executed.'),
+  ('sql_seconds_total', 'Time spent in SQL statements.'),
+  ('render_seconds_total', 'Time spent rendering templates.'),
+  ('n_plus_one_requests_total', 'Requests that repeated a statement N+1 style.'),
+]
+
+def statement_signature(statement):
+  return hashlib.sha1(' '.join(statement.split()).encode('utf-8')).hexdigest()[:12]
+
+# Escapes a Prometheus label value
+def label_value(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class RequestMetrics:
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.queries = 0
+    self.sql_seconds = 0.0
+    self.render_seconds = 0.0
+    self.render_starts = []
+    # statement -> executions
+    self.statements = {}
+
+  def record_query(self, statement, seconds):
+    self.queries += 1
+    self.sql_seconds += seconds
+    self.statements[statement] = self.statements.get(statement, 0) + 1
+
+  # [(signature, statement, executions)] of the statements repeated threshold times or more
+  def repeated_statements(self, threshold):
+    return [(statement_signature(statement), statement, count)
+      for statement, count in self.statements.items() if count >= threshold]
+
+class Metrics:
+  def __init__(self):
+    self.app = None
+    self.lock = threading.Lock()
+    # endpoint -> {counter: total}
+    self.endpoints = {}
+    # (endpoint, signature) -> requests repeating the statement
+    self.repeated = {}
+    self.n_plus_one_threshold = 5
+    self.server_timing = False
+    # Extra text appended to /metrics, functions returning lines
+    self.collectors = []
+
+  def init_app(self, app):
+    self.app = app
+    self.n_plus_one_threshold = app.config.get('METRICS_N_PLUS_ONE_THRESHOLD', 5)
+    self.server_timing = app.config.get('METRICS_SERVER_TIMING', False)
+    # Every engine, so the metrics don't need an app context to find db.engine
+    event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+    before_render_template.connect(self.render_started, app)
+    template_rendered.connect(self.render_finished, app)
+    app.before_request(self.request_started)
+    app.after_request(self.request_finished)
+
+  def current(self):
+    if not has_request_context():
+      return None
+    return g.get('request_metrics')
+
+  # The start time goes on the execution context of the statement, which a failing statement
+  # leaves behind with it, rather than on the (pooled) connection
+  def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+      context.metrics_started = time.perf_counter()
+
+  def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    metrics = self.current()
+    if metrics is not None and started is not None:
+      metrics.record_query(statement, time.perf_counter() - started)
+
+  def render_started(self, sender, template, context, **extra):
+    metrics = self.current()
+    if metrics is not None:
+      metrics.render_starts.append(time.perf_counter())
+
+  def render_finished(self, sender, template, context, **extra):
+    metrics = self.current()
+    if metrics is not None and metrics.render_starts:
+      metrics.render_seconds += time.perf_counter() - metrics.render_starts.pop()
+
+  def request_started(self):
+    g.request_metrics = RequestMetrics()
+
+  def request_finished(self, response):
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+      return response
+    elapsed = time.perf_counter() - metrics.started
+    endpoint = request.endpoint or 'unmatched'
+    repeated = metrics.repeated_statements(self.n_plus_one_threshold)
+    with self.lock:
+      totals = self.endpoints.setdefault(endpoint, dict.fromkeys([name for name, help in COUNTERS], 0))
+      totals['requests_total'] += 1
+      totals['request_seconds_total'] += elapsed
+      totals['queries_total'] += metrics.queries
+      totals['sql_seconds_total'] += metrics.sql_seconds
+      totals['render_seconds_total'] += metrics.render_seconds
+      if repeated:
+        totals['n_plus_one_requests_total'] += 1
+      first_seen = []
+      for signature, statement, count in repeated:
+        if (endpoint, signature) not in self.repeated:
+          first_seen.append((signature, statement, count))
+        self.repeated[(endpoint, signature)] = self.repeated.get((endpoint, signature), 0) + 1
+    for signature, statement, count in first_seen:
+      self.app.logger.warning('N+1 in %s: statement %s executed %d times in one request: %s',
+        endpoint, signature, count, ' '.join(statement.split()))
+    if self.server_timing:
+      response.headers['Server-Timing'] = 'sql;dur={0:.1f};desc="{1} queries", render;dur={2:.1f}, total;dur={3:.1f}'.format(
+        metrics.sql_seconds * 1000, metrics.queries, metrics.render_seconds * 1000, elapsed * 1000)
+    return response
+
+  # The metrics in the Prometheus text exposition format
+  def render(self):
+    lines = []
+    with self.lock:
+      endpoints = sorted(self.endpoints.items())
+      repeated = sorted(self.repeated.items())
+    for name, help in COUNTERS:
+      lines.append('# HELP fyyur_{0} {1}'.format(name, help))
+      lines.append('# TYPE fyyur_{0} counter'.format(name))
+      for endpoint, totals in endpoints:
+        lines.append('fyyur_{0}{{endpoint="{1}"}} {2}'.format(name, label_value(endpoint), totals[name]))
+    lines.append('# HELP fyyur_repeated_statement_requests_total Requests repeating a statement, by statement signature.')
+    lines.append('# TYPE fyyur_repeated_statement_requests_total counter')
+    for (endpoint, signature), count in repeated:
+      lines.append('fyyur_repeated_statement_requests_total{{endpoint="{0}",signature="{1}"}} {2}'.format(
+        label_value(endpoint), signature, count))
+    for collector in self.collectors:
+      lines.extend(collector())
+    return '\n'.join(lines) + '\n'
+
+# Collector of the view cache counters (cache.py)
+def view_cache_lines(view_cache):
+  lines = []
+  for name, value in sorted(view_cache.to_dict().items()):
+    kind = 'gauge' if name == 'entries' else 'counter'
+    metric = 'fyyur_view_cache_{0}{1}'.format(name, '_total' if kind == 'counter' else '')
+    lines.append('# TYPE {0} {1}'.format(metric, kind))
+    lines.append('{0} {1}'.format(metric, value))
+  return lines
+
+# Collector of the render and fragment cache counters per template (fragment_cache.py)
+def template_lines(template_stats):
+  lines = []
+  templates = sorted(template_stats.to_dict().items())
+  for name in ['renders', 'render_seconds', 'fragment_hits', 'fragment_misses']:
+    lines.append('# TYPE fyyur_template_{0}_total counter'.format(name))
+    for template, counters in templates:
+      lines.append('fyyur_template_{0}_total{{template="{1}"}} {2}'.format(name, label_value(template), counters[name]))
+  return lines
+
+# Collector of the thumbnail counters and disk cache size (thumbnails.py)
+def thumbnail_lines(thumbnails):
+  lines = []
+  for name, value in sorted(thumbnails.to_dict().items()):
+    kind = 'gauge' if name in ('entries', 'bytes') else 'counter'
+    metric = 'fyyur_thumbnail_{0}{1}'.format(name, '_total' if kind == 'counter' else '')
+    lines.append('# TYPE {0} {1}'.format(metric, kind))
+    lines.append('{0} {1}'.format(metric, value))
+  return lines
+
+metrics = Metrics()
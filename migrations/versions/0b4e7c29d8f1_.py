@@ -0,0 +1,118 @@
+"""partition the Show table by month of start_time
+
+Revision ID: 0b4e7c29d8f1
+Revises: f27b9d3c1a58
+Create Date: 2026-10-18 20:41:07.260918
+
+"""
+from datetime import date
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b4e7c29d8f1'
+down_revision = 'f27b9d3c1a58'
+branch_labels = None
+depends_on = None
+
+# Partitions are created for every month with shows and the next MONTHS_AHEAD months
+MONTHS_AHEAD = 12
+
+COLUMNS = 'id, start_time, duration_minutes, artist_id, venue_id'
+
+UPCOMING_SHOW_FEED = '''
+CREATE MATERIALIZED VIEW upcoming_show_feed AS
+SELECT s.id AS show_id, s.start_time, s.venue_id, v.name AS venue_name,
+       s.artist_id, a.name AS artist_name, a.image_link AS artist_image_link
+FROM "Show" s
+JOIN "Venue" v ON v.id = s.venue_id
+JOIN "Artist" a ON a.id = s.artist_id
+WHERE s.start_time >= date_trunc('day', localtimestamp)
+'''
+
+INDEXES = [
+    'CREATE INDEX "ix_Show_venue_id_start_time" ON "Show" (venue_id, start_time)',
+    'CREATE INDEX "ix_Show_artist_id_start_time" ON "Show" (artist_id, start_time)',
+    'CREATE INDEX "ix_Show_start_time_id" ON "Show" (start_time, id)',
+]
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def add_exclusion_constraints(name):
+    for column in ['artist_id', 'venue_id']:
+        op.execute('ALTER TABLE "{0}" ADD CONSTRAINT "{0}_{1}_period_excl" '
+            'EXCLUDE USING gist ({1} WITH =, period WITH &&)'.format(name, column))
+
+
+def drop_feed():
+    op.execute('DROP MATERIALIZED VIEW upcoming_show_feed')
+
+
+def create_feed():
+    op.execute(UPCOMING_SHOW_FEED)
+    op.execute('CREATE UNIQUE INDEX ix_upcoming_show_feed_show_id ON upcoming_show_feed (show_id)')
+    op.execute('CREATE INDEX ix_upcoming_show_feed_start_time_show_id ON upcoming_show_feed (start_time, show_id)')
+
+
+# Replaces "Show" by "Show_new" (same columns, filled with its rows), keeping the id sequence
+def swap_tables():
+    op.execute('INSERT INTO "Show_new" ({0}) SELECT {0} FROM "Show"'.format(COLUMNS))
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY NONE')
+    op.execute('DROP TABLE "Show"')
+    op.execute('ALTER TABLE "Show_new" RENAME TO "Show"')
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
+    op.execute('ALTER TABLE "Show" RENAME CONSTRAINT "Show_new_pkey" TO "Show_pkey"')
+    op.execute('ALTER TABLE "Show" RENAME CONSTRAINT "Show_new_artist_id_fkey" TO "Show_artist_id_fkey"')
+    op.execute('ALTER TABLE "Show" RENAME CONSTRAINT "Show_new_venue_id_fkey" TO "Show_venue_id_fkey"')
+    for index in INDEXES:
+        op.execute(index)
+
+
+def create_show_new(partitioned):
+    op.execute('''
+    CREATE TABLE "Show_new" (
+        id integer NOT NULL DEFAULT nextval('"Show_id_seq"'::regclass),
+        start_time timestamp without time zone NOT NULL,
+        duration_minutes integer NOT NULL DEFAULT 120,
+        period tsrange GENERATED ALWAYS AS (tsrange(start_time, start_time + duration_minutes * interval '1 minute')) STORED,
+        artist_id integer NOT NULL REFERENCES "Artist" (id),
+        venue_id integer NOT NULL REFERENCES "Venue" (id),
+        PRIMARY KEY ({0})
+    ){1}
+    '''.format('id, start_time' if partitioned else 'id', ' PARTITION BY RANGE (start_time)' if partitioned else ''))
+
+
+def upgrade():
+    # The view depends on the table being replaced
+    drop_feed()
+    create_show_new(partitioned=True)
+    op.execute('CREATE TABLE "Show_default" PARTITION OF "Show_new" DEFAULT')
+    add_exclusion_constraints('Show_default')
+    first = op.get_bind().execute(sa.text('SELECT min(start_time) FROM "Show"')).scalar()
+    today = date.today()
+    month = date(first.year, first.month, 1) if first else date(today.year, today.month, 1)
+    last = add_months(date(today.year, today.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        name = 'Show_{0:04d}_{1:02d}'.format(month.year, month.month)
+        op.execute('CREATE TABLE "{0}" PARTITION OF "Show_new" FOR VALUES FROM (\'{1}\') TO (\'{2}\')'.format(
+            name, month.isoformat(), add_months(month, 1).isoformat()))
+        add_exclusion_constraints(name)
+        month = add_months(month, 1)
+    swap_tables()
+    create_feed()
+
+
+def downgrade():
+    drop_feed()
+    create_show_new(partitioned=False)
+    add_exclusion_constraints('Show_new')
+    # Detached (archived) partitions are left where they are
+    swap_tables()
+    op.execute('ALTER TABLE "Show" RENAME CONSTRAINT "Show_new_artist_id_period_excl" TO "Show_artist_id_period_excl"')
+    op.execute('ALTER TABLE "Show" RENAME CONSTRAINT "Show_new_venue_id_period_excl" TO "Show_venue_id_period_excl"')
+    create_feed()
@@ -0,0 +1,46 @@
+"""add the genre GIN indexes and the genre_mask columns of the filters
+
+Revision ID: 5e8a1f4c7b29
+Revises: 0b4e7c29d8f1
+Create Date: 2026-10-18 22:14:36.508127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a1f4c7b29'
+down_revision = '0b4e7c29d8f1'
+branch_labels = None
+depends_on = None
+
+# genres_choices of forms.py when this revision was written, the bit of a genre is its position
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop',
+    'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae',
+    'Rock n Roll', 'Soul', 'Other']
+
+GENRE_MASK_FUNCTION = '''
+CREATE OR REPLACE FUNCTION genre_mask(genres varchar[]) RETURNS integer AS $$
+  SELECT coalesce(bit_or(1 << (array_position(ARRAY[{0}]::varchar[], genre) - 1)), 0)::integer
+  FROM unnest(genres) AS genre
+$$ LANGUAGE sql IMMUTABLE
+'''.format(', '.join("'{0}'".format(genre) for genre in GENRES))
+
+
+def upgrade():
+    op.execute(GENRE_MASK_FUNCTION)
+    for table in ['Venue', 'Artist']:
+        # Computed for the existing rows as the column is added
+        op.execute('ALTER TABLE "{0}" ADD COLUMN genre_mask integer GENERATED ALWAYS AS (genre_mask(genres)) STORED'
+            .format(table))
+        op.create_index('ix_{0}_genres'.format(table), table, ['genres'], postgresql_using='gin')
+    op.create_index('ix_Artist_state_city', 'Artist', ['state', 'city'])
+
+
+def downgrade():
+    op.drop_index('ix_Artist_state_city', 'Artist')
+    for table in ['Venue', 'Artist']:
+        op.drop_index('ix_{0}_genres'.format(table), table)
+        op.drop_column(table, 'genre_mask')
+    op.execute('DROP FUNCTION genre_mask(varchar[])')
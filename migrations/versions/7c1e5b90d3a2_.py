@@ -0,0 +1,53 @@
+"""add search_vector columns, full-text and trigram indexes on Venue and Artist
+
+Revision ID: 7c1e5b90d3a2
+Revises: 3f9c2a7d41b8
+Create Date: 2026-10-18 10:03:17.540921
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e5b90d3a2'
+down_revision = '3f9c2a7d41b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.add_column('Venue', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.add_column('Artist', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.execute('''
+    CREATE OR REPLACE FUNCTION search_vector_update() RETURNS trigger AS $$
+    BEGIN
+      NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'C');
+      RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''')
+    for table in ['Venue', 'Artist']:
+        op.execute('''
+        CREATE TRIGGER "{0}_search_vector_update" BEFORE INSERT OR UPDATE ON "{0}"
+        FOR EACH ROW EXECUTE PROCEDURE search_vector_update()
+        '''.format(table))
+        # Fills search_vector of the existing rows through the trigger
+        op.execute('UPDATE "{0}" SET name = name'.format(table))
+        op.create_index('ix_{0}_search_vector'.format(table), table, ['search_vector'], unique=False, postgresql_using='gin')
+        op.create_index('ix_{0}_name_trgm'.format(table), table, ['name'], unique=False, postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    for table in ['Artist', 'Venue']:
+        op.drop_index('ix_{0}_name_trgm'.format(table), table_name=table)
+        op.drop_index('ix_{0}_search_vector'.format(table), table_name=table)
+        op.execute('DROP TRIGGER "{0}_search_vector_update" ON "{0}"'.format(table))
+        op.drop_column(table, 'search_vector')
+    op.execute('DROP FUNCTION search_vector_update()')
@@ -0,0 +1,37 @@
+"""add the venue coordinates and their earthdistance index
+
+Revision ID: 9d2c6b8e4a13
+Revises: 5e8a1f4c7b29
+Create Date: 2026-10-18 23:37:52.184630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2c6b8e4a13'
+down_revision = '5e8a1f4c7b29'
+branch_labels = None
+depends_on = None
+
+
+def earthdistance_available():
+    return op.get_bind().execute(sa.text(
+        "SELECT count(*) FROM pg_available_extensions WHERE name IN ('cube', 'earthdistance')")).scalar() == 2
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    # Without the extensions /venues/nearby uses its in-process KD-tree
+    if earthdistance_available():
+        op.execute('CREATE EXTENSION IF NOT EXISTS cube')
+        op.execute('CREATE EXTENSION IF NOT EXISTS earthdistance')
+        op.execute('CREATE INDEX "ix_Venue_location" ON "Venue" USING gist (ll_to_earth(latitude, longitude))')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS "ix_Venue_location"')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
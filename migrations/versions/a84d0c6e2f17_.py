@@ -0,0 +1,30 @@
+"""add indexes for the keyset pagination of artists, venues and shows
+
+Revision ID: a84d0c6e2f17
+Revises: 7c1e5b90d3a2
+Create Date: 2026-10-18 11:26:02.731590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a84d0c6e2f17'
+down_revision = '7c1e5b90d3a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Artist_name_id', 'Artist', ['name', 'id'], unique=False)
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city'], unique=False)
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+    op.drop_index('ix_Show_start_time', table_name='Show')
+
+
+def downgrade():
+    op.create_index('ix_Show_start_time', 'Show', ['start_time'], unique=False)
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
+    op.drop_index('ix_Artist_name_id', table_name='Artist')
@@ -0,0 +1,34 @@
+"""bound the show duration, for the partition pruning of the booking conflict lookups
+
+Revision ID: b6f04d9e2c71
+Revises: 9d2c6b8e4a13
+Create Date: 2026-10-19 09:12:44.905316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6f04d9e2c71'
+down_revision = '9d2c6b8e4a13'
+branch_labels = None
+depends_on = None
+
+# MAX_SHOW_MINUTES of models.py
+MAX_SHOW_MINUTES = 24 * 60
+
+
+def upgrade():
+    invalid = op.get_bind().execute(sa.text(
+        'SELECT id, duration_minutes FROM "Show" WHERE duration_minutes NOT BETWEEN 1 AND :max ORDER BY id LIMIT 20'),
+        {'max': MAX_SHOW_MINUTES}).all()
+    if invalid:
+        raise RuntimeError('These shows last less than a minute or more than {0}, fix them first:\n  '.format(
+            MAX_SHOW_MINUTES) + '\n  '.join('show {0} ({1} minutes)'.format(id, minutes) for id, minutes in invalid))
+    op.create_check_constraint('Show_duration_minutes_check', 'Show',
+        'duration_minutes BETWEEN 1 AND {0}'.format(MAX_SHOW_MINUTES))
+
+
+def downgrade():
+    op.drop_constraint('Show_duration_minutes_check', 'Show')
@@ -0,0 +1,41 @@
+"""resync the id sequences of Venue, Artist and Show
+
+Revision ID: c52b7e19a6d4
+Revises: a84d0c6e2f17
+Create Date: 2026-10-18 12:04:51.208377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52b7e19a6d4'
+down_revision = 'a84d0c6e2f17'
+branch_labels = None
+depends_on = None
+
+
+# Ids used to be picked by the app as MAX(id)+1, so the sequences behind the serial id
+# columns never advanced. Make sure each table owns a sequence, used as the column default,
+# and move it past the highest existing id.
+def upgrade():
+    for table in ['Venue', 'Artist', 'Show']:
+        op.execute('''
+        DO $$
+        BEGIN
+          IF pg_get_serial_sequence('"{0}"', 'id') IS NULL THEN
+            CREATE SEQUENCE "{0}_id_seq" OWNED BY "{0}".id;
+            ALTER TABLE "{0}" ALTER COLUMN id SET DEFAULT nextval('"{0}_id_seq"');
+          END IF;
+        END
+        $$
+        '''.format(table))
+        op.execute('''
+        SELECT setval(pg_get_serial_sequence('"{0}"', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM "{0}"
+        '''.format(table))
+
+
+def downgrade():
+    # The sequences stay in sync, nothing to undo
+    pass
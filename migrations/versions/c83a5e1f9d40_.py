@@ -0,0 +1,67 @@
+"""check the show bookings across partitions with a trigger
+
+Revision ID: c83a5e1f9d40
+Revises: b6f04d9e2c71
+Create Date: 2026-10-19 10:03:27.671254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c83a5e1f9d40'
+down_revision = 'b6f04d9e2c71'
+branch_labels = None
+depends_on = None
+
+# MAX_SHOW_MINUTES of models.py
+MAX_SHOW_MINUTES = 24 * 60
+
+BOOKING_CHECK_FUNCTION = '''
+CREATE OR REPLACE FUNCTION show_booking_check() RETURNS trigger AS $$
+DECLARE
+  conflict record;
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('Show.artist_id'), NEW.artist_id);
+  PERFORM pg_advisory_xact_lock(hashtext('Show.venue_id'), NEW.venue_id);
+  SELECT id, artist_id, venue_id INTO conflict FROM "Show"
+  WHERE (artist_id = NEW.artist_id OR venue_id = NEW.venue_id)
+    AND start_time < upper(NEW.period) AND start_time > NEW.start_time - interval '{0} minutes'
+    AND period && NEW.period AND id <> NEW.id
+  LIMIT 1;
+  IF FOUND THEN
+    RAISE EXCEPTION 'show % overlaps show % of artist % at venue %', NEW.id, conflict.id,
+      conflict.artist_id, conflict.venue_id USING ERRCODE = 'exclusion_violation';
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''.format(MAX_SHOW_MINUTES)
+
+# Shows overlapping the last shows of the previous month of their artist or venue, which the
+# per partition constraints let through
+OVERLAPS = '''
+SELECT a.id, b.id FROM "Show" a JOIN "Show" b
+  ON (a.artist_id = b.artist_id OR a.venue_id = b.venue_id) AND a.id < b.id
+  AND b.start_time < upper(a.period) AND b.start_time > a.start_time - interval '{0} minutes'
+  AND a.period && b.period
+LIMIT 20
+'''.format(MAX_SHOW_MINUTES)
+
+
+def upgrade():
+    overlaps = op.get_bind().execute(sa.text(OVERLAPS)).all()
+    if overlaps:
+        raise RuntimeError('These shows overlap, move or delete one of each pair first:\n  ' +
+            '\n  '.join('shows {0} and {1}'.format(a, b) for a, b in overlaps))
+    op.execute(BOOKING_CHECK_FUNCTION)
+    op.execute('''
+    CREATE TRIGGER "Show_booking_check" AFTER INSERT OR UPDATE OF start_time, duration_minutes, artist_id, venue_id
+    ON "Show" FOR EACH ROW EXECUTE FUNCTION show_booking_check()
+    ''')
+
+
+def downgrade():
+    op.execute('DROP TRIGGER "Show_booking_check" ON "Show"')
+    op.execute('DROP FUNCTION show_booking_check()')
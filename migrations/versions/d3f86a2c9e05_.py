@@ -0,0 +1,38 @@
+"""add upcoming_shows_count and past_shows_count to Venue and Artist
+
+Revision ID: d3f86a2c9e05
+Revises: c52b7e19a6d4
+Create Date: 2026-10-18 13:40:09.662815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f86a2c9e05'
+down_revision = 'c52b7e19a6d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table, fk in [('Venue', 'venue_id'), ('Artist', 'artist_id')]:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.execute('''
+        UPDATE "{0}" SET upcoming_shows_count = s.upcoming, past_shows_count = s.past
+        FROM (
+          SELECT {1},
+                 count(*) FILTER (WHERE start_time >= date_trunc('day', localtimestamp)) AS upcoming,
+                 count(*) FILTER (WHERE start_time < date_trunc('day', localtimestamp)) AS past
+          FROM "Show" GROUP BY {1}
+        ) s
+        WHERE "{0}".id = s.{1}
+        '''.format(table, fk))
+
+
+def downgrade():
+    for table in ['Artist', 'Venue']:
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
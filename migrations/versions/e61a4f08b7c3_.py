@@ -0,0 +1,35 @@
+"""add the upcoming_show_feed materialized view
+
+Revision ID: e61a4f08b7c3
+Revises: d3f86a2c9e05
+Create Date: 2026-10-18 14:52:36.093417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61a4f08b7c3'
+down_revision = 'd3f86a2c9e05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+    CREATE MATERIALIZED VIEW upcoming_show_feed AS
+    SELECT s.id AS show_id, s.start_time, s.venue_id, v.name AS venue_name,
+           s.artist_id, a.name AS artist_name, a.image_link AS artist_image_link
+    FROM "Show" s
+    JOIN "Venue" v ON v.id = s.venue_id
+    JOIN "Artist" a ON a.id = s.artist_id
+    WHERE s.start_time >= date_trunc('day', localtimestamp)
+    ''')
+    # The unique index is required by REFRESH MATERIALIZED VIEW CONCURRENTLY
+    op.execute('CREATE UNIQUE INDEX ix_upcoming_show_feed_show_id ON upcoming_show_feed (show_id)')
+    op.execute('CREATE INDEX ix_upcoming_show_feed_start_time_show_id ON upcoming_show_feed (start_time, show_id)')
+
+
+def downgrade():
+    op.execute('DROP MATERIALIZED VIEW upcoming_show_feed')
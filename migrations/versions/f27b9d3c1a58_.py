@@ -0,0 +1,55 @@
+"""add the show duration and the booking exclusion constraints
+
+Revision ID: f27b9d3c1a58
+Revises: e61a4f08b7c3
+Create Date: 2026-10-18 18:05:12.417305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f27b9d3c1a58'
+down_revision = 'e61a4f08b7c3'
+branch_labels = None
+depends_on = None
+
+# Shows starting before an earlier show of the same artist (or venue) has ended
+OVERLAPS = '''
+SELECT id, {0}, start_time FROM (
+  SELECT id, {0}, start_time, max(upper(period)) OVER (
+    PARTITION BY {0} ORDER BY start_time, id ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS booked_until
+  FROM "Show") s
+WHERE booked_until > start_time
+ORDER BY {0}, start_time
+LIMIT 20
+'''
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.add_column('Show', sa.Column('duration_minutes', sa.Integer(), server_default='120', nullable=False))
+    op.execute('''
+    ALTER TABLE "Show" ADD COLUMN period tsrange
+    GENERATED ALWAYS AS (tsrange(start_time, start_time + duration_minutes * interval '1 minute')) STORED
+    ''')
+    connection = op.get_bind()
+    overlaps = []
+    for column in ['artist_id', 'venue_id']:
+        for id, key, start_time in connection.execute(sa.text(OVERLAPS.format(column))):
+            overlaps.append('show {0} ({1} {2}, {3})'.format(id, column, key, start_time))
+    if overlaps:
+        raise RuntimeError('These shows overlap an earlier show of their artist or venue, move or delete '
+            'them first:\n  ' + '\n  '.join(overlaps))
+    op.execute('ALTER TABLE "Show" ADD CONSTRAINT "Show_artist_id_period_excl" '
+        'EXCLUDE USING gist (artist_id WITH =, period WITH &&)')
+    op.execute('ALTER TABLE "Show" ADD CONSTRAINT "Show_venue_id_period_excl" '
+        'EXCLUDE USING gist (venue_id WITH =, period WITH &&)')
+
+
+def downgrade():
+    op.drop_constraint('Show_venue_id_period_excl', 'Show')
+    op.drop_constraint('Show_artist_id_period_excl', 'Show')
+    op.drop_column('Show', 'period')
+    op.drop_column('Show', 'duration_minutes')
@@ -1,9 +1,13 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import event, DDL, table, column
+from sqlalchemy.dialects.postgresql import TSVECTOR, TSRANGE
+from routing import RoutingSession
 
 app = Flask(__name__)
-db = SQLAlchemy()
+# Sends the queries of the read-only views to the read replicas, see routing.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate(app, db)
 
 #----------------------------------------------------------------------------#
@@ -16,6 +20,13 @@ migrate = Migrate(app, db)
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    # Indexes serving search.py, the keyset pagination and the filters of /venues (facets.py)
+    __table_args__ = (
+        db.Index('ix_Venue_state_city', 'state', 'city'),
+        db.Index('ix_Venue_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_Venue_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String, nullable=False)
@@ -29,6 +40,17 @@ class Venue(db.Model):
     website = db.Column(db.String)
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String)
+    # City coordinates filled by "flask geocode" from a gazetteer, and their GiST index when the
+    # database has the earthdistance extension, see geo.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # name, city, state and genres, filled by the search_vector_update() trigger
+    search_vector = db.Column(TSVECTOR)
+    # One bit per genre of genres, see facets.py
+    genre_mask = db.Column(db.Integer, db.Computed('genre_mask(genres)', persisted=True))
+    # Maintained by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     shows = db.relationship("Show", back_populates='venue', lazy=True)
 
@@ -51,6 +73,14 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    # Indexes serving search.py, the keyset pagination and the filters of /artists (facets.py)
+    __table_args__ = (
+        db.Index('ix_Artist_name_id', 'name', 'id'),
+        db.Index('ix_Artist_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_Artist_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_Artist_state_city', 'state', 'city'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String, nullable=False)
@@ -63,6 +93,13 @@ class Artist(db.Model):
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String)
     website = db.Column(db.String)
+    # name, city, state and genres, filled by the search_vector_update() trigger
+    search_vector = db.Column(TSVECTOR)
+    # One bit per genre of genres, see facets.py
+    genre_mask = db.Column(db.Integer, db.Computed('genre_mask(genres)', persisted=True))
+    # Maintained by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     shows = db.relationship("Show", back_populates ='artist')
 
@@ -81,14 +118,92 @@ class Artist(db.Model):
         'seeking_venue':self.seeking_venue,
         'seeking_description':self.seeking_description
       })
+# Minutes a show books its artist and venue for, when not given, and at most
+DEFAULT_SHOW_MINUTES = 120
+MAX_SHOW_MINUTES = 24 * 60
+
 class Show(db.Model):
   __tablename__ = 'Show'
+  # Indexes serving the venue/artist timelines and the upcoming shows feed. The table is
+  # partitioned by month of start_time (see partitions.py), every partition has the exclusion
+  # constraints (GiST, needs btree_gist) keeping the shows of an artist, and those of a
+  # venue, from overlapping (see bookings.py).
+  __table_args__ = (
+    db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+    # Bounds the start_time range of the shows overlapping a period, see bookings.py
+    db.CheckConstraint('duration_minutes BETWEEN 1 AND {0}'.format(MAX_SHOW_MINUTES), name='Show_duration_minutes_check'),
+    {'postgresql_partition_by': 'RANGE (start_time)'},
+  )
 
   id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-  start_time = db.Column(db.DateTime(), nullable=False)
+  # Part of the primary key, as the partition key must be
+  start_time = db.Column(db.DateTime(), primary_key=True, nullable=False)
+  duration_minutes = db.Column(db.Integer, nullable=False, default=DEFAULT_SHOW_MINUTES,
+    server_default=str(DEFAULT_SHOW_MINUTES))
+  # [start_time, start_time + duration_minutes), start_time has no time zone
+  period = db.Column(TSRANGE, db.Computed("tsrange(start_time, start_time + duration_minutes * interval '1 minute')",
+    persisted=True))
   
   artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
   venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
 
   artist = db.relationship("Artist", back_populates="shows")
   venue = db.relationship("Venue", back_populates="shows")
+
+# Materialized view of the upcoming shows joined with their venue and artist, read by /shows
+# and refreshed by feed.py. Not part of db.metadata, it is created by the migrations (or the
+# DDL events below).
+upcoming_show_feed = table('upcoming_show_feed',
+  column('show_id'),
+  column('start_time'),
+  column('venue_id'),
+  column('venue_name'),
+  column('artist_id'),
+  column('artist_name'),
+  column('artist_image_link'),
+)
+
+#----------------------------------------------------------------------------#
+# Database objects created alongside the tables by db.create_all().
+# Existing databases get them from the migrations.
+#----------------------------------------------------------------------------#
+
+# Fills search_vector from name (weight A), city and state (B) and genres (C)
+SEARCH_VECTOR_FUNCTION = DDL('''
+CREATE OR REPLACE FUNCTION search_vector_update() RETURNS trigger AS $$
+BEGIN
+  NEW.search_vector :=
+    setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'C');
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+''')
+SEARCH_VECTOR_TRIGGER = '''
+CREATE TRIGGER "{0}_search_vector_update" BEFORE INSERT OR UPDATE ON "{0}"
+FOR EACH ROW EXECUTE PROCEDURE search_vector_update()
+'''
+
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+event.listen(db.metadata, 'before_create', SEARCH_VECTOR_FUNCTION)
+event.listen(Venue.__table__, 'after_create', DDL(SEARCH_VECTOR_TRIGGER.format('Venue')))
+event.listen(Artist.__table__, 'after_create', DDL(SEARCH_VECTOR_TRIGGER.format('Artist')))
+
+UPCOMING_SHOW_FEED = DDL('''
+CREATE MATERIALIZED VIEW upcoming_show_feed AS
+SELECT s.id AS show_id, s.start_time, s.venue_id, v.name AS venue_name,
+       s.artist_id, a.name AS artist_name, a.image_link AS artist_image_link
+FROM "Show" s
+JOIN "Venue" v ON v.id = s.venue_id
+JOIN "Artist" a ON a.id = s.artist_id
+WHERE s.start_time >= date_trunc('day', localtimestamp);
+CREATE UNIQUE INDEX ix_upcoming_show_feed_show_id ON upcoming_show_feed (show_id);
+CREATE INDEX ix_upcoming_show_feed_start_time_show_id ON upcoming_show_feed (start_time, show_id)
+''')
+
+event.listen(db.metadata, 'after_create', UPCOMING_SHOW_FEED)
+event.listen(db.metadata, 'before_drop', DDL('DROP MATERIALIZED VIEW IF EXISTS upcoming_show_feed'))
@@ -0,0 +1,95 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+#----------------------------------------------------------------------------#
+# Keyset pagination.
+#----------------------------------------------------------------------------#
+
+# A page is requested with an opaque cursor holding the direction and the sort key of the
+# row it starts after, so every page is an index range scan of per_page+1 rows whatever its
+# depth. Cursors look like: base64({"d": "next", "k": ["The Musical Hop", 1]}).
+
+def encode_cursor(direction, key):
+  values = []
+  for value in key:
+    if isinstance(value, datetime):
+      value = {'dt': value.isoformat()}
+    values.append(value)
+  data = json.dumps({'d': direction, 'k': values}, separators=(',', ':'))
+  return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+# Returns (direction, key), or ('next', None) for the first page or an invalid cursor
+def decode_cursor(cursor):
+  if not cursor:
+    return 'next', None
+  try:
+    data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    key = []
+    for value in data['k']:
+      if isinstance(value, dict):
+        value = datetime.fromisoformat(value['dt'])
+      key.append(value)
+    if data['d'] not in ('next', 'prev'):
+      raise ValueError(data['d'])
+    return data['d'], tuple(key)
+  except (ValueError, KeyError, TypeError):
+    return 'next', None
+
+# Whether a decoded key has a value of the type of each column. Keys of another listing, or
+# edited by hand, would otherwise reach the database as comparisons it can't run.
+def valid_key(columns, key):
+  if len(key) != len(columns):
+    return False
+  for column, value in zip(columns, key):
+    try:
+      python_type = column.type.python_type
+    except NotImplementedError:
+      continue
+    if value is None:
+      continue
+    # bool is an int, but never a sort key
+    if isinstance(value, bool) and python_type is not bool:
+      return False
+    if not isinstance(value, python_type):
+      return False
+  return True
+
+# Restricts query to the page after cursor, ordered by columns (ascending, the last one unique)
+# and fetching one extra row to know if there are more. Returns (query, direction, after).
+# Cursors whose key doesn't fit the columns give the first page.
+def keyset_query(query, columns, cursor=None, per_page=20):
+  direction, after = decode_cursor(cursor)
+  if after is not None and not valid_key(columns, after):
+    direction, after = 'next', None
+  if direction == 'next':
+    if after is not None:
+      query = query.filter(tuple_(*columns) > after)
+    query = query.order_by(*columns)
+  else:
+    query = query.filter(tuple_(*columns) < after)
+    query = query.order_by(*[column.desc() for column in columns])
+  return query.limit(per_page+1), direction, after
+
+# Turns the rows fetched by keyset_query (in fetch order) into (rows, next_cursor, prev_cursor),
+# key(row) gives the values of the sort columns for a row.
+def keyset_result(rows, key, direction, after, per_page=20):
+  has_more = len(rows) > per_page
+  rows = list(rows[:per_page])
+  if direction == 'prev':
+    rows.reverse()
+
+  next_cursor = None
+  prev_cursor = None
+  if rows:
+    if has_more or direction == 'prev':
+      next_cursor = encode_cursor('next', key(rows[-1]))
+    if (has_more and direction == 'prev') or (direction == 'next' and after is not None):
+      prev_cursor = encode_cursor('prev', key(rows[0]))
+  return rows, next_cursor, prev_cursor
+
+# Returns one page of query as (rows, next_cursor, prev_cursor)
+def keyset_page(query, columns, key, cursor=None, per_page=20):
+  query, direction, after = keyset_query(query, columns, cursor, per_page)
+  return keyset_result(query.all(), key, direction, after, per_page)
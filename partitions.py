@@ -0,0 +1,157 @@
+from datetime import date, datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import event, text
+from models import db, Show
+from cache import cache
+
+#----------------------------------------------------------------------------#
+# Show partitions.
+#----------------------------------------------------------------------------#
+
+# The Show table is range partitioned on start_time by month: "Show_2026_10" holds the shows
+# of October 2026 and "Show_default" those of the months without a partition, so the queries
+# on a range of start_time (the calendars, the timelines, the upcoming shows) only read the
+# partitions of that range. Partitions are created ahead of time by "flask partitions create"
+# (from cron, like the counters rollover), the rows of the default partition falling in a new
+# month move to it. "flask partitions archive" detaches the months before a date into the
+# archive schema, out of every query of the app.
+#
+# Postgres can't have an exclusion constraint on a partitioned table, so every partition
+# has its own pair, and the show_booking_check() trigger of "Show" (cloned to every partition
+# when it is attached) catches the overlaps between the shows of two months, see bookings.py.
+
+DEFAULT_PARTITION = 'Show_default'
+ARCHIVE_SCHEMA = 'archive'
+# Columns of the partitions, period is generated
+COLUMNS = 'id, start_time, duration_minutes, artist_id, venue_id'
+
+EXCLUSION_CONSTRAINT = 'ALTER TABLE "{0}" ADD CONSTRAINT "{0}_{1}_period_excl" EXCLUDE USING gist ({1} WITH =, period WITH &&)'
+
+def month_start(day):
+  return date(day.year, day.month, 1)
+
+def add_months(month, months):
+  index = month.year * 12 + month.month - 1 + months
+  return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+  return 'Show_{0:04d}_{1:02d}'.format(month.year, month.month)
+
+def execute(connection, sql, **params):
+  return connection.execute(text(sql), params)
+
+def add_exclusion_constraints(connection, name):
+  for column in ['artist_id', 'venue_id']:
+    execute(connection, EXCLUSION_CONSTRAINT.format(name, column))
+
+def exists(connection, name, schema='public'):
+  return execute(connection, 'SELECT to_regclass(:name)', name='"{0}"."{1}"'.format(schema, name)).scalar() is not None
+
+# Creates the default partition of a new Show table
+def create_default_partition(connection):
+  execute(connection, 'CREATE TABLE "{0}" PARTITION OF "Show" DEFAULT'.format(DEFAULT_PARTITION))
+  add_exclusion_constraints(connection, DEFAULT_PARTITION)
+
+# Creates the partition of a month, moving its rows out of the default partition. Returns
+# False when it already exists.
+def create_partition(connection, month):
+  name = partition_name(month)
+  if exists(connection, name):
+    return False
+  start, end = month, add_months(month, 1)
+  # ATTACH wants the CHECK constraints of "Show" on the partition
+  execute(connection, 'CREATE TABLE "{0}" (LIKE "Show" INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS)'
+    .format(name))
+  execute(connection, '''
+    WITH moved AS (DELETE FROM "{0}" WHERE start_time >= :start AND start_time < :end RETURNING {2})
+    INSERT INTO "{1}" ({2}) SELECT {2} FROM moved
+  '''.format(DEFAULT_PARTITION, name, COLUMNS), start=start, end=end)
+  add_exclusion_constraints(connection, name)
+  # The indexes of "Show" are created on the partition when it is attached
+  execute(connection, 'ALTER TABLE "Show" ATTACH PARTITION "{0}" FOR VALUES FROM (\'{1}\') TO (\'{2}\')'.format(
+    name, start.isoformat(), end.isoformat()))
+  return True
+
+# Creates the missing partitions from months_back months ago to months_ahead months ahead,
+# returns the names of the created ones
+def ensure_partitions(connection, months_back=0, months_ahead=12, today=None):
+  first = month_start(today or date.today())
+  created = []
+  for offset in range(-months_back, months_ahead + 1):
+    month = add_months(first, offset)
+    if create_partition(connection, month):
+      created.append(partition_name(month))
+  return created
+
+# [(name, bounds, rows)] of the partitions of Show, rows is the planner's estimate
+def list_partitions(connection):
+  return execute(connection, '''
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = '"Show"'::regclass
+    ORDER BY c.relname
+  ''').all()
+
+# Detaches the month partitions before a month and moves them to the archive schema, without
+# their foreign keys (so venues and artists stay deletable). Returns their names.
+def archive_partitions(connection, before):
+  execute(connection, 'CREATE SCHEMA IF NOT EXISTS {0}'.format(ARCHIVE_SCHEMA))
+  archived = []
+  for name, bounds, rows in list_partitions(connection):
+    if name == DEFAULT_PARTITION or name >= partition_name(before):
+      continue
+    execute(connection, 'ALTER TABLE "Show" DETACH PARTITION "{0}"'.format(name))
+    for constraint, in execute(connection, '''
+        SELECT conname FROM pg_constraint WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'
+      ''', name='"{0}"'.format(name)):
+      execute(connection, 'ALTER TABLE "{0}" DROP CONSTRAINT "{1}"'.format(name, constraint))
+    execute(connection, 'ALTER TABLE "{0}" SET SCHEMA {1}'.format(name, ARCHIVE_SCHEMA))
+    archived.append(name)
+  return archived
+
+# db.create_all() creates the default partition and a year of months on each side of today
+@event.listens_for(Show.__table__, 'after_create')
+def create_initial_partitions(target, connection, **kw):
+  create_default_partition(connection)
+  ensure_partitions(connection, 12, 12)
+
+def parse_month(value):
+  try:
+    return month_start(datetime.strptime(value, '%Y-%m'))
+  except ValueError:
+    raise click.BadParameter('expected YYYY-MM, got {0}'.format(value))
+
+partitions_cli = AppGroup('partitions', help='Maintain the monthly partitions of the Show table.')
+
+@partitions_cli.command('create')
+@click.option('--months', type=int, help='Months ahead, defaults to SHOW_PARTITION_MONTHS_AHEAD.')
+@with_appcontext
+def create_command(months):
+  """Create the partitions of the coming months, run it monthly."""
+  if months is None:
+    months = current_app.config.get('SHOW_PARTITION_MONTHS_AHEAD', 12)
+  with db.engine.begin() as connection:
+    created = ensure_partitions(connection, 0, months)
+  click.echo('{0} partitions created{1}'.format(len(created), ': ' + ', '.join(created) if created else ''))
+
+@partitions_cli.command('list')
+@with_appcontext
+def list_command():
+  """List the partitions of the Show table with their estimated rows."""
+  with db.engine.connect() as connection:
+    for name, bounds, rows in list_partitions(connection):
+      click.echo('{0:<16} {1:>10} rows  {2}'.format(name, max(rows, 0), bounds))
+
+@partitions_cli.command('archive')
+@click.argument('before')
+@with_appcontext
+def archive_command(before):
+  """Detach the months before BEFORE (YYYY-MM) into the archive schema."""
+  with db.engine.begin() as connection:
+    archived = archive_partitions(connection, parse_month(before))
+  # Only reaches the web workers when they share a redis cache
+  cache.clear()
+  click.echo('{0} partitions archived to {1}{2}'.format(len(archived), ARCHIVE_SCHEMA,
+    ': ' + ', '.join(archived) if archived else ''))
@@ -0,0 +1,82 @@
+import random
+import threading
+import time
+from flask import g, session, request, current_app, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+#----------------------------------------------------------------------------#
+# Read replicas.
+#----------------------------------------------------------------------------#
+
+# The read-only views run their queries on one of the REPLICA_DATABASE_URIS (one replica per
+# request, picked at random), everything else, background threads and CLI commands included,
+# stays on SQLALCHEMY_DATABASE_URI. A replica lags behind the primary, so for
+# REPLICA_READ_YOUR_WRITES_SECONDS after a write the user who made it (through a session
+# cookie) and the worker that made it (whose caches were just invalidated and must not be
+# refilled with stale rows) read from the primary too.
+
+# Views that never write, the *_submission views, delete_venue and the import use the primary
+READ_ONLY_ENDPOINTS = {
+  'venues', 'search_venues', 'show_venue',
+  'artists', 'search_artists', 'show_artist',
+  'shows', 'search_suggest', 'image',
+  'shows_calendar', 'venue_calendar', 'artist_calendar', 'nearby_venues',
+}
+
+class ReplicaRouter:
+  def __init__(self):
+    self.bind_keys = []
+    self.window = 0
+    self.lock = threading.Lock()
+    # time.time() until which this worker reads from the primary
+    self.primary_until = 0
+
+  def init_app(self, app):
+    self.bind_keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith('replica_'))
+    # Every worker would drop the sessions signed by the others, and with them the window
+    if self.bind_keys and app.config.get('SECRET_KEY_IS_RANDOM'):
+      raise RuntimeError('FYYUR_REPLICA_URIS needs FYYUR_SECRET_KEY, the same in every worker.')
+    self.window = app.config.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5)
+    app.before_request(self.request_started)
+    app.after_request(self.request_finished)
+
+  def request_started(self):
+    if not self.bind_keys or request.endpoint not in READ_ONLY_ENDPOINTS:
+      return
+    now = time.time()
+    if now < self.primary_until or now < session.get('primary_until', 0):
+      return
+    g.replica_bind_key = random.choice(self.bind_keys)
+
+  def request_finished(self, response):
+    if g.get('database_written') and self.window:
+      until = time.time() + self.window
+      session['primary_until'] = until
+      with self.lock:
+        self.primary_until = max(self.primary_until, until)
+    return response
+
+  # The replica engine of the current request, None for the primary
+  def engine(self):
+    if not has_request_context():
+      return None
+    bind_key = g.get('replica_bind_key')
+    if bind_key is None:
+      return None
+    return current_app.extensions['sqlalchemy'].engines[bind_key]
+
+replica_router = ReplicaRouter()
+
+class RoutingSession(Session):
+  def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+    if bind is None and not self._flushing:
+      engine = replica_router.engine()
+      if engine is not None:
+        return engine
+    return super(RoutingSession, self).get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def record_write(session):
+  if has_request_context():
+    g.database_written = True
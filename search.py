@@ -0,0 +1,73 @@
+import re
+from sqlalchemy import func, or_
+from models import db, Venue, Artist
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+# Venues and Artists are searched through their search_vector column (name, city, state and
+# genres, kept up to date by a trigger, see migration 7c1e5b90d3a2) and through trigram
+# similarity on the name for misspelled terms. Both are served by GIN indexes.
+
+def search_venues(search_term, page=1, per_page=20):
+  return search(Venue, search_term, page, per_page)
+
+def search_artists(search_term, page=1, per_page=20):
+  return search(Artist, search_term, page, per_page)
+
+# Turns the words of search_term into a prefix tsquery: "musical ho" -> "musical:* & ho:*"
+def build_tsquery(search_term):
+  words = re.findall(r'\w+', search_term.lower())
+  return ' & '.join(word + ':*' for word in words)
+
+# Escapes the LIKE wildcards of a term, so "%" and "_" match themselves
+def like_escape(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Returns one page of model ranked by relevance, with the number of upcoming shows of each
+# result and the total number of results, all in one query.
+def search(model, search_term, page=1, per_page=20):
+  page = max(page, 1)
+  response = {
+    "count": 0,
+    "page": page,
+    "has_next": False,
+    "data": []
+  }
+  search_term = (search_term or '').strip()
+  if not search_term:
+    return response
+
+  tsquery = func.to_tsquery('simple', build_tsquery(search_term))
+  matches = [
+    model.name.ilike('%{}%'.format(like_escape(search_term)), escape='\\'),
+    model.name.op('%')(search_term)
+  ]
+  rank = func.similarity(model.name, search_term)
+  if build_tsquery(search_term):
+    matches.append(model.search_vector.op('@@')(tsquery))
+    rank = rank + func.ts_rank(model.search_vector, tsquery)
+
+  rows = db.session.query(
+      model.id,
+      model.name,
+      model.city,
+      model.state,
+      model.upcoming_shows_count,
+      func.count().over()
+    ).filter(or_(*matches))\
+    .order_by(rank.desc(), model.name, model.id)\
+    .limit(per_page).offset((page-1)*per_page).all()
+
+  for id, name, city, state, num_upcoming_shows, count in rows:
+    response['count'] = count
+    response['data'].append({
+      'id': id,
+      'name': name,
+      'city': city,
+      'state': state,
+      'num_upcoming_shows': num_upcoming_shows
+    })
+  response['has_next'] = page*per_page < response['count']
+  return response
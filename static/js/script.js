@@ -2,3 +2,31 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Fills the datalist of the navbar search inputs with /search/suggest results while typing
+document.addEventListener('DOMContentLoaded', function () {
+  var inputs = document.querySelectorAll('input[data-suggest-kind]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var datalist = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        var url = '/search/suggest?kind=' + input.getAttribute('data-suggest-kind') +
+          '&q=' + encodeURIComponent(input.value);
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET', url);
+        xhr.onload = function () {
+          if (xhr.status !== 200) return;
+          datalist.innerHTML = '';
+          JSON.parse(xhr.responseText).data.forEach(function (suggestion) {
+            var option = document.createElement('option');
+            option.value = suggestion.name;
+            datalist.appendChild(option);
+          });
+        };
+        xhr.send();
+      }, 100);
+    });
+  });
+});
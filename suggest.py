@@ -0,0 +1,110 @@
+import bisect
+import re
+import threading
+import unicodedata
+
+#----------------------------------------------------------------------------#
+# Name suggestions.
+#----------------------------------------------------------------------------#
+
+# In-process index of the Venue and Artist names answering /search/suggest without going to
+# the database. Every word of a name is a starting point, so "hop" suggests "The Musical Hop".
+# Entries live in a sorted list of (key, kind, id) and a prefix lookup is a bisect.
+#
+# The worker serving a create, edit or delete updates its index in place and bumps the
+# "suggest" version counter of the view cache (shared by the workers with redis). The other
+# workers see the counter move on their next lookup and reload their index.
+
+def normalize(name):
+  name = unicodedata.normalize('NFKD', name or '')
+  name = ''.join(c for c in name if not unicodedata.combining(c))
+  return ' '.join(re.findall(r'\w+', name.lower()))
+
+class NameIndex:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.loaded = False
+    # Value of the "suggest" version counter the content matches
+    self.version = None
+    self.keys = []
+    # (kind, id) -> name
+    self.names = {}
+
+  # Builds the index from the database, replacing any previous content
+  def load(self, venues, artists, version=None):
+    keys = []
+    names = {}
+    for kind, rows in [('venue', venues), ('artist', artists)]:
+      for id, name in rows:
+        names[(kind, id)] = name
+        keys.extend(self.entry_keys(kind, id, name))
+    keys.sort()
+    with self.lock:
+      self.keys = keys
+      self.names = names
+      self.loaded = True
+      self.version = version
+
+  # Whether the index is loaded and matches the version counter
+  def is_current(self, version):
+    return self.loaded and self.version == version
+
+  # Called with the new value of the version counter after an add() or remove() of this
+  # process. A change made by another worker in between leaves the index stale.
+  def updated(self, version):
+    with self.lock:
+      if self.version == version - 1:
+        self.version = version
+
+  def entry_keys(self, kind, id, name):
+    words = normalize(name).split(' ')
+    return [(' '.join(words[i:]), kind, id) for i in range(len(words)) if words[i]]
+
+  def add(self, kind, id, name):
+    with self.lock:
+      if not self.loaded:
+        return
+      self.remove_locked(kind, id)
+      self.names[(kind, id)] = name
+      for key in self.entry_keys(kind, id, name):
+        bisect.insort(self.keys, key)
+
+  def remove(self, kind, id):
+    with self.lock:
+      if self.loaded:
+        self.remove_locked(kind, id)
+
+  def remove_locked(self, kind, id):
+    name = self.names.pop((kind, id), None)
+    if name is None:
+      return
+    for key in self.entry_keys(kind, id, name):
+      i = bisect.bisect_left(self.keys, key)
+      if i < len(self.keys) and self.keys[i] == key:
+        del self.keys[i]
+
+  # Returns up to limit [{kind, id, name}] whose name has a word starting with prefix
+  def suggest(self, prefix, kind=None, limit=10):
+    prefix = normalize(prefix)
+    if not prefix:
+      return []
+    results = []
+    seen = set()
+    with self.lock:
+      i = bisect.bisect_left(self.keys, (prefix,))
+      while i < len(self.keys) and len(results) < limit:
+        key, entry_kind, id = self.keys[i]
+        i += 1
+        if not key.startswith(prefix):
+          break
+        if (kind and entry_kind != kind) or (entry_kind, id) in seen:
+          continue
+        seen.add((entry_kind, id))
+        results.append({
+          'kind': entry_kind,
+          'id': id,
+          'name': self.names[(entry_kind, id)]
+        })
+    return results
+
+name_index = NameIndex()
@@ -0,0 +1,385 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from flask import request, redirect, abort, send_file, url_for
+
+#----------------------------------------------------------------------------#
+# Thumbnails.
+#----------------------------------------------------------------------------#
+
+# The image_link of artists and venues points to other hosts, often with full size pictures.
+# Pages show them through /img/<kind>/<id>/<size>?v=<version> instead: the first request
+# fetches the image once, resizes it to every size of SIZES (Pillow) and stores the results
+# in a content-addressed on-disk cache (THUMBNAIL_CACHE_DIR) holding at most
+# THUMBNAIL_CACHE_MAX_BYTES, least recently served first out. The version is a hash of the
+# image_link, so a versioned URL never changes content and is served as immutable, and
+# is answered from the disk cache without a query.
+#
+#   <img src="{{ thumbnail_url('artist', show.artist_id, show.artist_image_link, 'tile') }}">
+#
+# Images that can't be fetched or decoded redirect to the image_link, and are retried after
+# THUMBNAIL_RETRY_SECONDS.
+
+# Bounding boxes, the aspect ratio is kept
+SIZES = {
+  'small': (160, 160),
+  'tile': (400, 400),
+  'large': (800, 800),
+}
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+VERSION = re.compile(r'^[0-9a-f]{16}$')
+
+class FetchError(Exception):
+  pass
+
+# Version of an image_link in the thumbnail URLs
+def link_version(link):
+  return hashlib.sha256(link.encode('utf-8')).hexdigest()[:16]
+
+# Connections opened by HttpFetcher.connect(), to an address checked when it was resolved
+class PinnedHTTPConnection(http.client.HTTPConnection):
+  def __init__(self, *args, fetcher=None, **kwargs):
+    super(PinnedHTTPConnection, self).__init__(*args, **kwargs)
+    self.fetcher = fetcher
+
+  def connect(self):
+    self.sock = self.fetcher.connect(self.host, self.port, self.timeout)
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+  def __init__(self, *args, fetcher=None, **kwargs):
+    super(PinnedHTTPSConnection, self).__init__(*args, **kwargs)
+    self.fetcher = fetcher
+
+  # The certificate is still checked against the host name
+  def connect(self):
+    sock = self.fetcher.connect(self.host, self.port, self.timeout)
+    self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+# Fetches images over http(s) with a timeout and a size limit. Hosts resolving to private,
+# loopback or link-local addresses are refused (image links are user input), unless
+# allow_private is set, e.g. to test against a local server. The connections go to the
+# addresses that were checked, so a host name can't resolve to a public address for the
+# check and to a private one for the connection. No proxy is used.
+class HttpFetcher:
+  def __init__(self, timeout=5, max_bytes=10 * 1024 * 1024, allow_private=False):
+    self.timeout = timeout
+    self.max_bytes = max_bytes
+    self.allow_private = allow_private
+    fetcher = self
+    class RedirectHandler(urllib.request.HTTPRedirectHandler):
+      def redirect_request(self, req, fp, code, msg, headers, newurl):
+        fetcher.check_url(newurl)
+        return super(RedirectHandler, self).redirect_request(req, fp, code, msg, headers, newurl)
+    class HTTPHandler(urllib.request.HTTPHandler):
+      def http_open(self, req):
+        return self.do_open(PinnedHTTPConnection, req, fetcher=fetcher)
+    class HTTPSHandler(urllib.request.HTTPSHandler):
+      def https_open(self, req):
+        return self.do_open(PinnedHTTPSConnection, req, context=self._context, fetcher=fetcher)
+    self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), HTTPHandler, HTTPSHandler,
+      RedirectHandler)
+
+  def check_url(self, url):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+      raise FetchError('not an http(s) URL: %s' % url)
+
+  # The addresses of host, refused when one of them isn't public
+  def resolve(self, host, port):
+    try:
+      addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as e:
+      raise FetchError('%s: %s' % (host, e))
+    if not self.allow_private:
+      for address in addresses:
+        ip = ipaddress.ip_address(address[4][0].split('%')[0])
+        if not ip.is_global:
+          raise FetchError('%s resolves to a non-public address' % host)
+    return addresses
+
+  # A socket connected to one of the checked addresses of host
+  def connect(self, host, port, timeout):
+    error = None
+    for family, type, proto, canonname, address in self.resolve(host, port):
+      sock = socket.socket(family, type, proto)
+      sock.settimeout(timeout)
+      try:
+        sock.connect(address)
+        return sock
+      except OSError as e:
+        sock.close()
+        error = e
+    raise error
+
+  # The body of url, raises FetchError
+  def __call__(self, url):
+    self.check_url(url)
+    try:
+      with self.opener.open(urllib.request.Request(url, headers={'User-Agent': 'fyyur-thumbnails'}),
+          timeout=self.timeout) as response:
+        data = response.read(self.max_bytes + 1)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+      raise FetchError('%s: %s' % (url, e))
+    if len(data) > self.max_bytes:
+      raise FetchError('%s: larger than %d bytes' % (url, self.max_bytes))
+    return data
+
+# Resizes an image to every size of SIZES, decoding it once. Returns
+# {size: (data, mimetype)}, JPEG for opaque images and PNG for the others.
+def resize(data, sizes=SIZES, max_pixels=50000000):
+  from PIL import Image, ImageOps
+  Image.MAX_IMAGE_PIXELS = max_pixels
+  try:
+    image = Image.open(io.BytesIO(data))
+    # JPEGs are decoded at the smallest scale still larger than the largest size
+    image.draft('RGB', max(sizes.values()))
+    image = ImageOps.exif_transpose(image)
+    image.load()
+  except (OSError, ValueError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+    raise FetchError('not an image: %s' % e)
+  opaque = image.mode in ('RGB', 'L', 'CMYK', 'YCbCr') and 'transparency' not in image.info
+  image = image.convert('RGB' if opaque else 'RGBA')
+  result = {}
+  for name, box in sizes.items():
+    thumbnail = image.copy()
+    thumbnail.thumbnail(box, Image.LANCZOS)
+    out = io.BytesIO()
+    if opaque:
+      thumbnail.save(out, 'JPEG', quality=85, optimize=True, progressive=True)
+      result[name] = (out.getvalue(), 'image/jpeg')
+    else:
+      thumbnail.save(out, 'PNG', optimize=True)
+      result[name] = (out.getvalue(), 'image/png')
+  return result
+
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png'}
+MIMETYPES = {extension: mimetype for mimetype, extension in EXTENSIONS.items()}
+
+# Files named by the sha256 of their content under objects/, and keys/<key> files holding
+# the name of the object of a key. Objects are evicted least recently served first when
+# they add up to more than max_bytes; the keys left pointing to them are misses.
+class DiskCache:
+  def __init__(self, folder, max_bytes):
+    self.folder = folder
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+    # object name -> size, least recently served first
+    self.objects = OrderedDict()
+    self.total_bytes = 0
+    self.evictions = 0
+    os.makedirs(os.path.join(folder, 'objects'), exist_ok=True)
+    os.makedirs(os.path.join(folder, 'keys'), exist_ok=True)
+    self.load()
+
+  # Rebuilds the LRU order from the modification times, touched on every hit
+  def load(self):
+    objects = []
+    for folder, folders, files in os.walk(os.path.join(self.folder, 'objects')):
+      for filename in files:
+        if filename.startswith('.'):
+          continue
+        stat = os.stat(os.path.join(folder, filename))
+        objects.append((stat.st_mtime, filename, stat.st_size))
+    for mtime, name, size in sorted(objects):
+      self.objects[name] = size
+      self.total_bytes += size
+
+  def object_path(self, name):
+    return os.path.join(self.folder, 'objects', name[:2], name)
+
+  def key_path(self, key):
+    return os.path.join(self.folder, 'keys', key)
+
+  # (path, object name) of the object of key, or None
+  def get(self, key):
+    try:
+      with open(self.key_path(key)) as f:
+        name = f.read().strip()
+    except OSError:
+      return None
+    path = self.object_path(name)
+    with self.lock:
+      if name not in self.objects:
+        # Written by another worker, or evicted
+        if not os.path.exists(path):
+          return None
+        self.add_locked(name, os.path.getsize(path))
+      self.objects.move_to_end(name)
+    try:
+      os.utime(path)
+    except OSError:
+      return None
+    return path, name
+
+  def set(self, key, data, extension):
+    name = hashlib.sha256(data).hexdigest() + extension
+    path = self.object_path(name)
+    if not os.path.exists(path):
+      self.write(path, data)
+    self.write(self.key_path(key), name.encode('utf-8'))
+    with self.lock:
+      if name not in self.objects:
+        self.add_locked(name, len(data))
+      self.objects.move_to_end(name)
+      self.evict_locked()
+    return path, name
+
+  def add_locked(self, name, size):
+    self.objects[name] = size
+    self.total_bytes += size
+
+  def evict_locked(self):
+    while self.total_bytes > self.max_bytes and len(self.objects) > 1:
+      name, size = self.objects.popitem(last=False)
+      self.total_bytes -= size
+      self.evictions += 1
+      try:
+        os.remove(self.object_path(name))
+      except OSError:
+        pass
+
+  # Written to a temporary file and renamed, readers never see partial files
+  def write(self, path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.replace(tmp, path)
+
+  def __len__(self):
+    return len(self.objects)
+
+class Thumbnails:
+  def __init__(self):
+    self.app = None
+    self.cache = None
+    # Called with an image URL, returns its content or raises FetchError
+    self.fetcher = None
+    self.retry_seconds = 300
+    self.lock = threading.Lock()
+    # version -> [lock, requests using it], so concurrent requests for an image fetch it once.
+    # Dropped by the last of them.
+    self.fetching = {}
+    # version -> time.monotonic() of the last failed fetch, oldest first, at most max_failures
+    # and none older than retry_seconds
+    self.failures = OrderedDict()
+    self.max_failures = 10000
+    self.counters = dict.fromkeys(['hits', 'misses', 'fetches', 'fetch_errors'], 0)
+
+  def init_app(self, app, fetcher=None):
+    self.app = app
+    self.cache = DiskCache(app.config.get('THUMBNAIL_CACHE_DIR', os.path.join(app.root_path, 'thumbnail_cache')),
+      app.config.get('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    self.fetcher = fetcher or HttpFetcher(app.config.get('THUMBNAIL_FETCH_TIMEOUT', 5),
+      app.config.get('THUMBNAIL_MAX_SOURCE_BYTES', 10 * 1024 * 1024))
+    self.retry_seconds = app.config.get('THUMBNAIL_RETRY_SECONDS', 300)
+    self.max_failures = app.config.get('THUMBNAIL_MAX_FAILURES', 10000)
+    app.jinja_env.globals['thumbnail_url'] = self.url
+
+  def url(self, kind, id, link, size='tile'):
+    if not link:
+      return link
+    return url_for('image', kind=kind, id=id, size=size, v=link_version(link))
+
+  def incr(self, name):
+    with self.lock:
+      self.counters[name] += 1
+
+  # The cached thumbnail of a versioned URL, answered without looking up the image_link
+  def cached(self, version, size):
+    entry = self.cache.get('%s-%s' % (version, size))
+    self.incr('hits' if entry else 'misses')
+    return entry
+
+  def failed_at(self, version):
+    with self.lock:
+      return self.failures.get(version)
+
+  def record_failure(self, version):
+    now = time.monotonic()
+    with self.lock:
+      self.failures.pop(version, None)
+      self.failures[version] = now
+      while self.failures and (len(self.failures) > self.max_failures or
+          now - next(iter(self.failures.values())) >= self.retry_seconds):
+        self.failures.popitem(last=False)
+
+  # Fetches and resizes link to every size, returns the (path, object name) of size
+  def build(self, link, version, size):
+    with self.lock:
+      fetching = self.fetching.setdefault(version, [threading.Lock(), 0])
+      fetching[1] += 1
+    try:
+      with fetching[0]:
+        entry = self.cache.get('%s-%s' % (version, size))
+        if entry is not None:
+          return entry
+        failed = self.failed_at(version)
+        if failed is not None and time.monotonic() - failed < self.retry_seconds:
+          raise FetchError('%s failed %ds ago' % (link, time.monotonic() - failed))
+        self.incr('fetches')
+        try:
+          images = resize(self.fetcher(link))
+        except FetchError:
+          self.incr('fetch_errors')
+          self.record_failure(version)
+          raise
+        with self.lock:
+          self.failures.pop(version, None)
+        entries = {name: self.cache.set('%s-%s' % (version, name), data, EXTENSIONS[mimetype])
+          for name, (data, mimetype) in images.items()}
+        return entries[size]
+    finally:
+      with self.lock:
+        fetching[1] -= 1
+        if not fetching[1]:
+          del self.fetching[version]
+
+  # Response of /img/<kind>/<id>/<size>, get_link() returns the image_link of the entity
+  # (None when it doesn't exist) and is only called on misses
+  def serve(self, size, get_link):
+    if size not in SIZES:
+      abort(404)
+    requested = request.args.get('v')
+    if requested and not VERSION.match(requested):
+      requested = None
+    entry = self.cached(requested, size) if requested else None
+    if entry is None:
+      link = get_link()
+      if not link:
+        abort(404)
+      version = link_version(link)
+      try:
+        entry = self.build(link, version, size)
+      except FetchError as e:
+        self.app.logger.warning('thumbnail: %s', e)
+        return redirect(link)
+      immutable = requested == version
+    else:
+      immutable = True
+    path, name = entry
+    response = send_file(path, mimetype=MIMETYPES[os.path.splitext(name)[1]], etag=name.split('.')[0])
+    # Unversioned URLs (or stale versions) may change content with the image_link
+    response.headers['Cache-Control'] = IMMUTABLE if immutable else 'public, max-age=3600'
+    return response
+
+  def to_dict(self):
+    with self.lock:
+      data = dict(self.counters)
+    if self.cache is not None:
+      data.update(entries=len(self.cache), bytes=self.cache.total_bytes, evictions=self.cache.evictions)
+    return data
+
+thumbnails = Thumbnails()
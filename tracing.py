@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+from flask import g, request
+
+#----------------------------------------------------------------------------#
+# Request traces.
+#----------------------------------------------------------------------------#
+
+# With TRACE_REQUESTS set, every request is appended as one JSON line to TRACE_LOG_PATH:
+#
+#   {"t": 1760000000.123, "method": "POST", "path": "/venues/search", "endpoint": "search_venues",
+#    "query": {}, "form": {"search_term": ["blue"]}, "status": 200, "duration_ms": 12.4}
+#
+# The csrf token, uploaded files and the Authorization header are never written, and the
+# fields of TRACE_REDACTED_FIELDS are replaced by "redacted". benchmarks/replay.py fires the
+# recorded traffic at a server.
+
+REDACTED = 'redacted'
+
+class TraceRecorder:
+  def __init__(self):
+    self.path = None
+    self.redacted_fields = set()
+    self.lock = threading.Lock()
+    self.file = None
+
+  def init_app(self, app):
+    if not app.config.get('TRACE_REQUESTS', False):
+      return
+    self.path = app.config.get('TRACE_LOG_PATH', 'request_traces.jsonl')
+    self.redacted_fields = set(app.config.get('TRACE_REDACTED_FIELDS', []))
+    app.before_request(self.request_started)
+    app.after_request(self.request_finished)
+
+  def request_started(self):
+    g.trace_started = (time.time(), time.perf_counter())
+
+  def sanitize(self, fields):
+    return {key: [REDACTED] * len(values) if key in self.redacted_fields else values
+      for key, values in fields.lists() if key != 'csrf_token'}
+
+  def request_finished(self, response):
+    started = g.pop('trace_started', None)
+    if started is None or request.endpoint == 'static':
+      return response
+    trace = {
+      't': round(started[0], 3),
+      'method': request.method,
+      'path': request.path,
+      'endpoint': request.endpoint,
+      'query': self.sanitize(request.args),
+      'form': self.sanitize(request.form),
+      'status': response.status_code,
+      'duration_ms': round((time.perf_counter() - started[1]) * 1000, 2),
+    }
+    self.write(json.dumps(trace, sort_keys=True))
+    return response
+
+  def write(self, line):
+    with self.lock:
+      if self.file is None:
+        self.file = open(self.path, 'a', buffering=1, encoding='utf-8')
+      self.file.write(line + '\n')
+
+trace_recorder = TraceRecorder()